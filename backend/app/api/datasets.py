@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session
+from sqlalchemy import exists
+from sqlalchemy.orm import Session, contains_eager, raiseload
 from typing import List
 
-from app.dependencies import get_db, get_current_user
+from app.dependencies import get_db, get_current_user, get_current_workspace
 from app.db import models, schemas
 from app.services.dataset_service import DatasetService
 
@@ -14,7 +15,7 @@ async def upload_dataset(
     workspace_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    workspace: models.Workspace = Depends(get_current_workspace)
 ):
     """
     Upload a dataset file for fine-tuning.
@@ -22,18 +23,6 @@ async def upload_dataset(
     Supports: JSON, JSONL, CSV formats.
     Expected format: {"instruction": "", "input": "", "output": ""}
     """
-    # Verify workspace ownership
-    workspace = db.query(models.Workspace).filter(
-        models.Workspace.id == workspace_id,
-        models.Workspace.owner_id == current_user.id
-    ).first()
-    
-    if not workspace:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Workspace not found"
-        )
-    
     dataset_service = DatasetService(db)
     dataset = await dataset_service.upload_dataset(
         file=file,
@@ -44,13 +33,15 @@ async def upload_dataset(
 
 
 @router.get("/{dataset_id}", response_model=schemas.DatasetResponse)
-async def get_dataset(
+def get_dataset(
     dataset_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get dataset details."""
-    dataset = db.query(models.Dataset).join(models.Workspace).filter(
+    dataset = db.query(models.Dataset).join(models.Workspace).options(
+        contains_eager(models.Dataset.workspace)
+    ).filter(
         models.Dataset.id == dataset_id,
         models.Workspace.owner_id == current_user.id
     ).first()
@@ -65,33 +56,33 @@ async def get_dataset(
 
 
 @router.get("/", response_model=List[schemas.DatasetResponse])
-async def list_datasets(
+def list_datasets(
     workspace_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """List all datasets in a workspace."""
-    # Verify workspace ownership
-    workspace = db.query(models.Workspace).filter(
-        models.Workspace.id == workspace_id,
+    # Ownership is enforced by the join; only an empty result needs a
+    # second look to tell "not yours" apart from "no rows yet".
+    datasets = db.query(models.Dataset).join(models.Workspace).options(raiseload("*")).filter(
+        models.Dataset.workspace_id == workspace_id,
         models.Workspace.owner_id == current_user.id
-    ).first()
+    ).all()
     
-    if not workspace:
+    if not datasets and not db.query(exists().where(
+        models.Workspace.id == workspace_id,
+        models.Workspace.owner_id == current_user.id
+    )).scalar():
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Workspace not found"
         )
     
-    datasets = db.query(models.Dataset).filter(
-        models.Dataset.workspace_id == workspace_id
-    ).all()
-    
-    return datasets
+    return [schemas.DatasetResponse.from_orm_fast(row) for row in datasets]
 
 
 @router.delete("/{dataset_id}")
-async def delete_dataset(
+def delete_dataset(
     dataset_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -1,29 +1,39 @@
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.dependencies import get_db, get_current_user
+from app.dependencies import get_db, get_current_user, get_inference_service
 from app.db import models, schemas
 from app.services.inference_service import InferenceService
 
 router = APIRouter()
 
 
+def _get_owned_model(db: Session, model_id: int, owner_id: int) -> Optional[models.Model]:
+    """Fetch a model if it belongs to one of the owner's workspaces."""
+    return db.query(models.Model).join(models.Workspace).filter(
+        models.Model.id == model_id,
+        models.Workspace.owner_id == owner_id
+    ).first()
+
+
 @router.post("/predict", response_model=schemas.InferenceResponse)
 async def predict(
     request: schemas.InferenceRequest,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    inference_service: InferenceService = Depends(get_inference_service)
 ):
     """
     Generate text using a fine-tuned model.
     
     Loads base model and attaches workspace-specific adapter.
     """
-    # Verify model ownership
-    model = db.query(models.Model).join(models.Workspace).filter(
-        models.Model.id == request.model_id,
-        models.Workspace.owner_id == current_user.id
-    ).first()
+    # Verify model ownership (off the event loop)
+    model = await run_in_threadpool(
+        _get_owned_model, db, request.model_id, current_user.id
+    )
     
     if not model:
         raise HTTPException(
@@ -31,8 +41,6 @@ async def predict(
             detail="Model not found"
         )
     
-    inference_service = InferenceService()
-    
     try:
         result = await inference_service.generate(
             model=model,
@@ -60,16 +68,16 @@ async def predict(
 async def batch_predict(
     request: schemas.BatchInferenceRequest,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    inference_service: InferenceService = Depends(get_inference_service)
 ):
     """
     Generate text for multiple prompts.
     """
-    # Verify model ownership
-    model = db.query(models.Model).join(models.Workspace).filter(
-        models.Model.id == request.model_id,
-        models.Workspace.owner_id == current_user.id
-    ).first()
+    # Verify model ownership (off the event loop)
+    model = await run_in_threadpool(
+        _get_owned_model, db, request.model_id, current_user.id
+    )
     
     if not model:
         raise HTTPException(
@@ -77,27 +85,32 @@ async def batch_predict(
             detail="Model not found"
         )
     
-    inference_service = InferenceService()
     results = []
     
-    for prompt in request.prompts:
+    if request.prompts:
+        # One batched call for all prompts instead of one call per prompt
         try:
-            result = await inference_service.generate(
+            outputs = await inference_service.generate_batch(
                 model=model,
-                prompt=prompt,
+                prompts=request.prompts,
                 max_tokens=request.max_tokens,
                 temperature=request.temperature
             )
-            results.append({
-                "prompt": prompt,
-                "generated_text": result["generated_text"],
-                "tokens_used": result["tokens_used"]
-            })
         except Exception as e:
-            results.append({
-                "prompt": prompt,
-                "error": str(e)
-            })
+            outputs = [{"error": str(e)}] * len(request.prompts)
+        
+        for prompt, output in zip(request.prompts, outputs):
+            if "error" in output:
+                results.append({
+                    "prompt": prompt,
+                    "error": output["error"]
+                })
+            else:
+                results.append({
+                    "prompt": prompt,
+                    "generated_text": output["generated_text"],
+                    "tokens_used": output["tokens_used"]
+                })
     
     return schemas.BatchInferenceResponse(
         model_id=model.id,
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import exists
+from sqlalchemy.orm import Session, contains_eager, raiseload
 from typing import List
 
 from app.dependencies import get_db, get_current_user
@@ -9,39 +10,41 @@ router = APIRouter()
 
 
 @router.get("/", response_model=List[schemas.ModelResponse])
-async def list_models(
+def list_models(
     workspace_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """List all trained models (adapters) in a workspace."""
-    # Verify workspace ownership
-    workspace = db.query(models.Workspace).filter(
-        models.Workspace.id == workspace_id,
+    # Ownership is enforced by the join; only an empty result needs a
+    # second look to tell "not yours" apart from "no rows yet".
+    trained_models = db.query(models.Model).join(models.Workspace).options(raiseload("*")).filter(
+        models.Model.workspace_id == workspace_id,
         models.Workspace.owner_id == current_user.id
-    ).first()
+    ).all()
     
-    if not workspace:
+    if not trained_models and not db.query(exists().where(
+        models.Workspace.id == workspace_id,
+        models.Workspace.owner_id == current_user.id
+    )).scalar():
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Workspace not found"
         )
     
-    trained_models = db.query(models.Model).filter(
-        models.Model.workspace_id == workspace_id
-    ).all()
-    
-    return trained_models
+    return [schemas.ModelResponse.from_orm_fast(row) for row in trained_models]
 
 
 @router.get("/{model_id}", response_model=schemas.ModelResponse)
-async def get_model(
+def get_model(
     model_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get model details."""
-    model = db.query(models.Model).join(models.Workspace).filter(
+    model = db.query(models.Model).join(models.Workspace).options(
+        contains_eager(models.Model.workspace)
+    ).filter(
         models.Model.id == model_id,
         models.Workspace.owner_id == current_user.id
     ).first()
@@ -56,7 +59,7 @@ async def get_model(
 
 
 @router.delete("/{model_id}")
-async def delete_model(
+def delete_model(
     model_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -81,7 +84,7 @@ async def delete_model(
 
 
 @router.patch("/{model_id}", response_model=schemas.ModelResponse)
-async def update_model(
+def update_model(
     model_id: int,
     model_update: schemas.ModelUpdate,
     db: Session = Depends(get_db),
@@ -104,7 +107,9 @@ async def update_model(
     if model_update.description:
         model.description = model_update.description
     
+    # Nothing here is server-generated, so serialize the in-memory row
+    # before commit expires it instead of paying for a refresh SELECT.
+    response = schemas.ModelResponse.model_validate(model)
     db.commit()
-    db.refresh(model)
     
-    return model
+    return response
@@ -1,15 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from typing import List
 
-from app.dependencies import get_db, get_current_user
+from app.dependencies import get_db, get_current_user, get_current_workspace
 from app.db import models, schemas
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[schemas.WorkspaceResponse])
-async def list_workspaces(
+def list_workspaces(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -18,11 +18,11 @@ async def list_workspaces(
         models.Workspace.owner_id == current_user.id
     ).all()
     
-    return workspaces
+    return [schemas.WorkspaceResponse.from_orm_fast(row) for row in workspaces]
 
 
 @router.post("/", response_model=schemas.WorkspaceResponse)
-async def create_workspace(
+def create_workspace(
     workspace_data: schemas.WorkspaceCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -41,44 +41,19 @@ async def create_workspace(
 
 
 @router.get("/{workspace_id}", response_model=schemas.WorkspaceResponse)
-async def get_workspace(
-    workspace_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+def get_workspace(
+    workspace: models.Workspace = Depends(get_current_workspace)
 ):
     """Get workspace details."""
-    workspace = db.query(models.Workspace).filter(
-        models.Workspace.id == workspace_id,
-        models.Workspace.owner_id == current_user.id
-    ).first()
-    
-    if not workspace:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Workspace not found"
-        )
-    
     return workspace
 
 
 @router.delete("/{workspace_id}")
-async def delete_workspace(
-    workspace_id: int,
+def delete_workspace(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    workspace: models.Workspace = Depends(get_current_workspace)
 ):
     """Delete a workspace."""
-    workspace = db.query(models.Workspace).filter(
-        models.Workspace.id == workspace_id,
-        models.Workspace.owner_id == current_user.id
-    ).first()
-    
-    if not workspace:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Workspace not found"
-        )
-    
     db.delete(workspace)
     db.commit()
     
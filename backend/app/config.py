@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import List
 import os
@@ -25,11 +26,13 @@ class Settings(BaseSettings):
     
     # Redis
     REDIS_URL: str = os.environ.get("REDIS_URL", "redis://localhost:16379/0")
+    INFERENCE_CACHE_TTL: int = 3600  # seconds; 0 disables the result cache
     
     # JWT
     SECRET_KEY: str = os.environ.get("SECRET_KEY", "your-secret-key-change-in-production")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    BCRYPT_ROUNDS: int = int(os.environ.get("BCRYPT_ROUNDS", "12"))  # cost; 4 is the minimum
     
     # CORS - Allow all origins in production for simplicity
     CORS_ORIGINS: List[str] = ["*"]
@@ -41,13 +44,27 @@ class Settings(BaseSettings):
     # ML Config
     BASE_MODEL: str = "mistralai/Mistral-7B-v0.1"
     MAX_TOKEN_LENGTH: int = 2048
+    INFERENCE_WORKERS: int = 0  # >0 runs generation in that many model-holding processes
+    INFERENCE_MAX_BASE_MODELS: int = 2  # base models kept loaded per process
+    INFERENCE_MAX_ADAPTERS: int = 2  # LoRA adapters kept loaded per base model
+    INFERENCE_WARMUP: bool = False  # load BASE_MODEL at startup (non-demo mode)
+    INFERENCE_MAX_BATCH_SIZE: int = 8  # coalesce concurrent prompts; 1 disables
+    INFERENCE_BATCH_WAIT_MS: int = 5  # how long a batch waits to fill up
     
     class Config:
         env_file = ".env"
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Parse the environment once; usable as a FastAPI dependency."""
+    return Settings()
 
-# Create directories if they don't exist
-os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-os.makedirs(settings.MODELS_DIR, exist_ok=True)
+
+settings = get_settings()
+
+
+def init_storage():
+    """Create storage directories if they don't exist (called at startup)."""
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    os.makedirs(settings.MODELS_DIR, exist_ok=True)
@@ -1,5 +1,5 @@
 # Core modules
-from app.core.security import verify_password, get_password_hash, create_access_token, verify_token
+from app.core.security import verify_password, get_password_hash, create_access_token, verify_token, decode_token, verify_and_require
 from app.core.workspace import WorkspaceManager
 from app.core.model_registry import ModelRegistry
 
@@ -8,6 +8,8 @@ __all__ = [
     "get_password_hash", 
     "create_access_token",
     "verify_token",
+    "decode_token",
+    "verify_and_require",
     "WorkspaceManager",
     "ModelRegistry"
 ]
@@ -1,4 +1,5 @@
 import os
+import shutil
 from typing import Optional, List
 from sqlalchemy.orm import Session
 
@@ -55,7 +56,6 @@ class ModelRegistry:
         
         # Delete adapter files
         if os.path.exists(model.adapter_path):
-            import shutil
             shutil.rmtree(model.adapter_path)
         
         self.db.delete(model)
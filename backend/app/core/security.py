@@ -1,7 +1,11 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Iterable, Optional, Tuple
+import threading
+import time
 import bcrypt
 from jose import JWTError, jwt
+from jose.exceptions import JWTClaimsError
 
 from app.config import settings
 
@@ -18,7 +22,7 @@ def get_password_hash(password: str) -> str:
     """Hash a password."""
     return bcrypt.hashpw(
         password.encode('utf-8'),
-        bcrypt.gensalt()
+        bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     ).decode('utf-8')
 
 
@@ -37,10 +41,55 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+# Decoded tokens (token -> (claims, expires_at)); a UI reuses one bearer
+# token for many requests, so skip the HMAC check + JSON parse on repeats.
+TOKEN_CACHE_TTL = 60  # seconds, never past the token's own expiry
+TOKEN_CACHE_MAX_SIZE = 10000
+_token_cache: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def decode_token(token: str) -> dict:
+    """Decode a JWT token, raising JWTError if it is invalid or expired.
+    
+    Valid tokens are cached; failures never are.
+    """
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+        if cached is not None:
+            if cached[1] > now:
+                _token_cache.move_to_end(token)
+                return dict(cached[0])
+            del _token_cache[token]
+    
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    
+    expires_at = min(now + TOKEN_CACHE_TTL, payload.get("exp", float("inf")))
+    with _token_cache_lock:
+        _token_cache[token] = (payload, expires_at)
+        if len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+    
+    return dict(payload)
+
+
+def verify_and_require(token: str, required_claims: Iterable[str] = ("sub", "exp")) -> dict:
+    """Decode a token once (verified) and require the given claims.
+    
+    Raises JWTError (JWTClaimsError for a missing claim); read claims from
+    the returned payload rather than decoding again unverified.
+    """
+    payload = decode_token(token)
+    missing = [claim for claim in required_claims if claim not in payload]
+    if missing:
+        raise JWTClaimsError(f"Token is missing required claims: {', '.join(missing)}")
+    return payload
+
+
 def verify_token(token: str) -> Optional[dict]:
     """Verify and decode a JWT token."""
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
+        return decode_token(token)
     except JWTError:
         return None
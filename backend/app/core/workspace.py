@@ -1,68 +1,205 @@
 import os
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterable, Optional, Set, Tuple
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 
 from app.config import settings
 from app.db import models
 
+# Threads for the stats walk; raise for network filesystems (NFS etc.)
+STATS_SCAN_WORKERS = 8
+
+
+# Storage roots never change at runtime, so per-workspace paths are built once
+@lru_cache(maxsize=1024)
+def _workspace_root(workspace_id: int) -> str:
+    return os.path.join(settings.MODELS_DIR, f"workspace_{workspace_id}")
+
+
+@lru_cache(maxsize=1024)
+def _dataset_root(workspace_id: int) -> str:
+    return os.path.join(settings.UPLOAD_DIR, f"workspace_{workspace_id}")
+
+
+@lru_cache(maxsize=1024)
+def _workspace_subdirs(workspace_id: int) -> Tuple[str, str, str]:
+    root = _workspace_root(workspace_id)
+    return (
+        os.path.join(root, "adapters"),
+        os.path.join(root, "checkpoints"),
+        os.path.join(root, "logs"),
+    )
+
+
+def _scan_tree(path: str) -> Tuple[int, int]:
+    """Return (total_bytes, file_count) for a directory tree.
+    
+    Uses os.scandir so each entry's stat comes from the directory read
+    where the platform provides it, instead of a separate getsize() call.
+    """
+    total_size = 0
+    file_count = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                size, count = _scan_tree(entry.path)
+                total_size += size
+                file_count += count
+            else:
+                total_size += entry.stat(follow_symlinks=False).st_size
+                file_count += 1
+    return total_size, file_count
+
+
+def _remove_tree(path: str) -> None:
+    """Delete a directory tree, reusing scandir's entry types.
+    
+    Unlike shutil.rmtree there is no extra lstat per entry; symlinks are
+    unlinked, never followed.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                _remove_tree(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
+
+
+def _scan_roots(roots: Iterable[str], max_workers: int = STATS_SCAN_WORKERS) -> Tuple[int, int]:
+    """Return (total_bytes, file_count) across several trees.
+    
+    Top-level files are counted inline; each top-level subdirectory
+    (adapters/, checkpoints/, logs/, ...) is walked on its own thread since
+    the stat calls block on disk rather than the GIL.
+    """
+    total_size = 0
+    file_count = 0
+    subdirs = []
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    total_size += entry.stat(follow_symlinks=False).st_size
+                    file_count += 1
+    
+    if subdirs:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(subdirs))) as ex:
+            for size, count in ex.map(_scan_tree, subdirs):
+                total_size += size
+                file_count += count
+    
+    return total_size, file_count
+
 
 class WorkspaceManager:
     """Manages workspace directories and resources."""
     
+    # Workspaces whose directories this process has already created
+    _created: Set[int] = set()
+    
     def __init__(self, db: Session):
         self.db = db
     
     def get_workspace_path(self, workspace_id: int) -> str:
         """Get the storage path for a workspace."""
-        return os.path.join(settings.MODELS_DIR, f"workspace_{workspace_id}")
+        return _workspace_root(workspace_id)
     
     def get_adapter_path(self, workspace_id: int, model_name: str) -> str:
         """Get the path for a model adapter."""
-        workspace_path = self.get_workspace_path(workspace_id)
-        return os.path.join(workspace_path, "adapters", model_name)
+        return os.path.join(_workspace_subdirs(workspace_id)[0], model_name)
     
     def get_dataset_path(self, workspace_id: int, filename: str) -> str:
         """Get the path for a dataset file."""
-        return os.path.join(settings.UPLOAD_DIR, f"workspace_{workspace_id}", filename)
+        return os.path.join(_dataset_root(workspace_id), filename)
     
-    def create_workspace_dirs(self, workspace_id: int) -> None:
-        """Create all necessary directories for a workspace."""
-        workspace_path = self.get_workspace_path(workspace_id)
+    def create_workspace_dirs(self, workspace_id: int, refresh: bool = False) -> None:
+        """Create all necessary directories for a workspace.
         
-        # Create directories
-        os.makedirs(os.path.join(workspace_path, "adapters"), exist_ok=True)
-        os.makedirs(os.path.join(workspace_path, "checkpoints"), exist_ok=True)
-        os.makedirs(os.path.join(workspace_path, "logs"), exist_ok=True)
+        Skipped for workspaces this process already created, unless
+        refresh=True: the directories may since have been removed by
+        another process or by hand.
+        """
+        if workspace_id in self._created and not refresh:
+            return
+        
+        # Create the shared parent once, then each leaf with a single mkdir
+        os.makedirs(_workspace_root(workspace_id), exist_ok=True)
+        for path in _workspace_subdirs(workspace_id):
+            try:
+                os.mkdir(path)
+            except FileExistsError:
+                pass
         
         # Dataset directory
-        dataset_path = os.path.join(settings.UPLOAD_DIR, f"workspace_{workspace_id}")
-        os.makedirs(dataset_path, exist_ok=True)
+        os.makedirs(_dataset_root(workspace_id), exist_ok=True)
+        
+        self._created.add(workspace_id)
     
     def delete_workspace_dirs(self, workspace_id: int) -> None:
-        """Delete all directories for a workspace."""
-        import shutil
+        """Delete all directories for a workspace (caller commits the stats reset)."""
+        self._created.discard(workspace_id)
         
         workspace_path = self.get_workspace_path(workspace_id)
         if os.path.exists(workspace_path):
-            shutil.rmtree(workspace_path)
+            _remove_tree(workspace_path)
         
-        dataset_path = os.path.join(settings.UPLOAD_DIR, f"workspace_{workspace_id}")
+        dataset_path = _dataset_root(workspace_id)
         if os.path.exists(dataset_path):
-            shutil.rmtree(dataset_path)
+            _remove_tree(dataset_path)
+        
+        self._set_stats(workspace_id, 0, 0)
     
-    def get_workspace_stats(self, workspace_id: int) -> dict:
-        """Get storage statistics for a workspace."""
-        workspace_path = self.get_workspace_path(workspace_id)
+    def adjust_stats(self, workspace_id: int, size_delta: int, count_delta: int) -> None:
+        """Apply a file write/delete to the cached stats (caller commits).
         
-        total_size = 0
-        file_count = 0
+        Unknown (NULL) stats stay NULL until the next refresh.
+        """
+        self.db.execute(
+            update(models.Workspace)
+            .where(models.Workspace.id == workspace_id)
+            .values(
+                total_size_bytes=models.Workspace.total_size_bytes + size_delta,
+                file_count=models.Workspace.file_count + count_delta
+            )
+        )
+    
+    def _set_stats(self, workspace_id: int, total_size: int, file_count: int) -> None:
+        self.db.execute(
+            update(models.Workspace)
+            .where(models.Workspace.id == workspace_id)
+            .values(total_size_bytes=total_size, file_count=file_count)
+        )
+    
+    def get_workspace_stats(self, workspace_id: int, refresh: bool = False) -> dict:
+        """Get storage statistics for a workspace (models and datasets).
         
-        if os.path.exists(workspace_path):
-            for dirpath, dirnames, filenames in os.walk(workspace_path):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    total_size += os.path.getsize(fp)
-                    file_count += 1
+        Returns the cached counters unless they are unknown or refresh=True,
+        in which case the trees are walked and the result written back
+        (caller commits).
+        """
+        row = self.db.query(
+            models.Workspace.total_size_bytes,
+            models.Workspace.file_count
+        ).filter(models.Workspace.id == workspace_id).first()
+        
+        if row is None:
+            # Deleted or never created; nothing on disk worth walking
+            total_size, file_count = 0, 0
+        elif not refresh and row.total_size_bytes is not None and row.file_count is not None:
+            total_size, file_count = row.total_size_bytes, row.file_count
+        else:
+            total_size, file_count = _scan_roots((
+                self.get_workspace_path(workspace_id),
+                _dataset_root(workspace_id)
+            ))
+            self._set_stats(workspace_id, total_size, file_count)
         
         return {
             "total_size_bytes": total_size,
@@ -1,19 +1,73 @@
-from sqlalchemy import create_engine
+import logging
+
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+if settings.DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(settings.DATABASE_URL)
+else:
+    # Sync routes run on a ~40-thread pool and training jobs hold their own
+    # session, so the default pool_size=5 starves under load.
+    engine = create_engine(
+        settings.DATABASE_URL,
+        pool_size=20,
+        max_overflow=40,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        query_cache_size=1200,
+        # psycopg v3: server-prepare statements after 5 executions
+        connect_args={"prepare_threshold": 5},
+    )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
 
 def init_db():
     """Initialize database tables."""
     from app.db import models  # Import models to register them
     Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+
+
+def add_missing_columns(bind) -> None:
+    """
+    Add model columns that existing tables don't have yet.
+    
+    create_all only creates missing tables, never ALTERs existing ones, so
+    a column added to a model would otherwise break every query on a
+    database created before it. Until migrations exist, nullable columns
+    are added here (existing rows read NULL); anything else is logged.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    preparer = bind.dialect.identifier_preparer
+    
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                if not column.nullable:
+                    logger.warning(
+                        "Column %s.%s is missing and NOT NULL; add it manually",
+                        table.name, column.name
+                    )
+                    continue
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} "
+                    f"ADD COLUMN {preparer.quote(column.name)} "
+                    f"{column.type.compile(dialect=bind.dialect)}"
+                ))
+                logger.info("Added missing column %s.%s", table.name, column.name)
 
 
 def get_db():
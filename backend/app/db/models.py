@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean, Float
+from sqlalchemy import BigInteger, Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean, Float, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -30,11 +30,20 @@ class Workspace(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
+    # Cached storage stats, kept current on file writes (NULL = unknown)
+    total_size_bytes = Column(BigInteger, default=0, nullable=True)
+    file_count = Column(Integer, default=0, nullable=True)
+    
     # Relationships
     owner = relationship("User", back_populates="workspaces")
     datasets = relationship("Dataset", back_populates="workspace", cascade="all, delete-orphan")
     training_jobs = relationship("TrainingJob", back_populates="workspace", cascade="all, delete-orphan")
     models = relationship("Model", back_populates="workspace", cascade="all, delete-orphan")
+    
+    # list_workspaces and ownership checks filter on owner_id
+    __table_args__ = (
+        Index("ix_workspaces_owner_id", "owner_id"),
+    )
 
 
 class Dataset(Base):
@@ -54,6 +63,10 @@ class Dataset(Base):
     # Relationships
     workspace = relationship("Workspace", back_populates="datasets")
     training_jobs = relationship("TrainingJob", back_populates="dataset")
+    
+    __table_args__ = (
+        Index("ix_datasets_workspace_id_id", "workspace_id", "id"),
+    )
 
 
 class TrainingJob(Base):
@@ -101,6 +114,14 @@ class TrainingJob(Base):
     workspace = relationship("Workspace", back_populates="training_jobs")
     dataset = relationship("Dataset", back_populates="training_jobs")
     model = relationship("Model", back_populates="training_job", uselist=False)
+    
+    # list_training_jobs' filter + ORDER BY created_at DESC, status
+    # dashboards, and joins from datasets
+    __table_args__ = (
+        Index("ix_training_jobs_workspace_created", workspace_id, created_at.desc()),
+        Index("ix_training_jobs_workspace_status", "workspace_id", "status"),
+        Index("ix_training_jobs_dataset_id", "dataset_id"),
+    )
 
 
 class Model(Base):
@@ -127,3 +148,8 @@ class Model(Base):
     # Relationships
     workspace = relationship("Workspace", back_populates="models")
     training_job = relationship("TrainingJob", back_populates="model")
+    
+    __table_args__ = (
+        Index("ix_models_workspace_id_id", "workspace_id", "id"),
+        Index("ix_models_workspace_active", "workspace_id", "is_active"),
+    )
@@ -1,8 +1,21 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 
+class TrustedORMResponse:
+    """Mixin for response schemas built from rows we just read or wrote."""
+    
+    @classmethod
+    def from_orm_fast(cls, obj):
+        """Build the response without re-validating every field.
+        
+        Only for trusted ORM objects: values are taken as-is, and FastAPI
+        passes instances of the response model through unchanged.
+        """
+        return cls.model_construct(**{name: getattr(obj, name) for name in cls.model_fields})
+
+
 # ============== User Schemas ==============
 
 class UserBase(BaseModel):
@@ -19,8 +32,7 @@ class UserResponse(UserBase):
     is_active: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class Token(BaseModel):
@@ -39,13 +51,12 @@ class WorkspaceCreate(WorkspaceBase):
     pass
 
 
-class WorkspaceResponse(WorkspaceBase):
+class WorkspaceResponse(TrustedORMResponse, WorkspaceBase):
     id: int
     owner_id: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============== Dataset Schemas ==============
@@ -58,7 +69,7 @@ class DatasetCreate(DatasetBase):
     workspace_id: int
 
 
-class DatasetResponse(DatasetBase):
+class DatasetResponse(TrustedORMResponse, DatasetBase):
     id: int
     workspace_id: int
     file_path: str
@@ -69,8 +80,7 @@ class DatasetResponse(DatasetBase):
     status: str
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============== Training Job Schemas ==============
@@ -94,7 +104,7 @@ class TrainingJobCreate(BaseModel):
     config: Optional[TrainingConfig] = None
 
 
-class TrainingJobResponse(BaseModel):
+class TrainingJobResponse(TrustedORMResponse, BaseModel):
     id: int
     workspace_id: int
     dataset_id: int
@@ -114,8 +124,7 @@ class TrainingJobResponse(BaseModel):
     started_at: Optional[datetime]
     completed_at: Optional[datetime]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============== Model Schemas ==============
@@ -130,7 +139,7 @@ class ModelUpdate(BaseModel):
     description: Optional[str] = None
 
 
-class ModelResponse(ModelBase):
+class ModelResponse(TrustedORMResponse, ModelBase):
     id: int
     workspace_id: int
     training_job_id: Optional[int]
@@ -140,8 +149,7 @@ class ModelResponse(ModelBase):
     is_active: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============== Inference Schemas ==============
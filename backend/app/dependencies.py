@@ -1,19 +1,21 @@
 from typing import Generator
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
+from jose import JWTError
+from starlette.concurrency import run_in_threadpool
 
 from app.db.database import SessionLocal
 from app.db import models
-from app.config import settings
-from app.core.security import verify_token
+from app.core.security import verify_and_require
+from app.services.inference_service import InferenceService
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
 
 def get_db() -> Generator:
-    """Database session dependency."""
+    """Database session dependency (sync, like the routes that use it)."""
     db = SessionLocal()
     try:
         yield db
@@ -21,44 +23,81 @@ def get_db() -> Generator:
         db.close()
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> models.User:
-    """Get current authenticated user."""
-    credentials_exception = HTTPException(
+def get_inference_service() -> InferenceService:
+    """Inference service dependency (model caches are class-level, so this is cheap)."""
+    return InferenceService()
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+
+def _decode_user_id(token: str) -> int:
+    """Return the user id carried by a bearer token, or raise 401."""
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
+        payload = verify_and_require(token)
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    
+    return int(payload["sub"])
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> models.User:
+    """Get current authenticated user."""
+    user_id = _decode_user_id(token)
     
-    user = db.query(models.User).filter(models.User.id == int(user_id)).first()
+    # The lookup is blocking; run it off the event loop so this async
+    # dependency never stalls other requests.
+    user = await run_in_threadpool(
+        db.query(models.User).filter(models.User.id == user_id).first
+    )
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     
     return user
 
 
+# Workspace + owner in one statement; built once so every request reuses
+# the same compiled (and, on Postgres, server-prepared) query.
+_OWNED_WORKSPACE = (
+    select(models.Workspace)
+    .join(models.User, models.Workspace.owner_id == models.User.id)
+    .where(
+        models.Workspace.id == bindparam("workspace_id"),
+        models.User.id == bindparam("user_id")
+    )
+)
+
+
 async def get_current_workspace(
     workspace_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
 ) -> models.Workspace:
-    """Get workspace with permission check."""
-    workspace = db.query(models.Workspace).filter(
-        models.Workspace.id == workspace_id,
-        models.Workspace.owner_id == current_user.id
-    ).first()
+    """Get workspace with permission check.
+    
+    Authenticates the token and checks ownership with a single query
+    instead of chaining on get_current_user. Routes that take a
+    workspace_id should depend on this rather than repeating the check.
+    """
+    user_id = _decode_user_id(token)
+    params = {"workspace_id": workspace_id, "user_id": user_id}
+    workspace = await run_in_threadpool(
+        lambda: db.scalars(_OWNED_WORKSPACE, params).first()
+    )
     
     if not workspace:
+        # Only now tell a stale token apart from someone else's workspace
+        user = await run_in_threadpool(db.get, models.User, user_id)
+        if user is None:
+            raise _credentials_exception()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Workspace not found"
@@ -1,9 +1,13 @@
+import threading
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api import auth, datasets, training, models, inference, workspaces
-from app.config import settings
+from app.config import settings, init_storage
 from app.db.database import init_db
+from app.services.inference_service import InferenceService
+from app.utils.log_utils import setup_logging
 
 app = FastAPI(
     title="ForgeLLM",
@@ -31,8 +35,16 @@ app.include_router(inference.router, prefix="/api/v1/inference", tags=["inferenc
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database tables on startup"""
+    """Initialize logging, storage and database tables on startup"""
+    setup_logging()
+    init_storage()
     init_db()
+    
+    if settings.INFERENCE_WARMUP and not InferenceService.DEMO_MODE and settings.INFERENCE_WORKERS <= 0:
+        # Load in the background so startup (and health checks) aren't held up
+        threading.Thread(
+            target=InferenceService().warmup, args=(settings.BASE_MODEL,), daemon=True
+        ).start()
 
 
 @app.get("/health")
@@ -1,20 +1,102 @@
+import asyncio
 import os
 import json
+import tempfile
 import aiofiles
-from typing import Optional
+import orjson
+from itertools import islice
+from typing import Any, Iterator, Optional, TextIO, Tuple
 from fastapi import UploadFile, HTTPException
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app.config import settings
 from app.db import models
 from app.core.workspace import WorkspaceManager
 
 
+# orjson has no incremental API, so array streaming keeps the stdlib decoder
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WS = " \t\n\r"
+
+
+def _iter_json_array(f: TextIO, chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """Yield elements of a top-level JSON array without loading the file.
+    
+    Falls back to a full parse (yielding the single value) when the
+    document isn't an array.
+    """
+    buf = f.read(chunk_size).lstrip(_JSON_WS)
+    if not buf.startswith("["):
+        f.seek(0)
+        yield orjson.loads(f.read())
+        return
+    
+    pos = 1
+    while True:
+        # Skip whitespace and separators, pulling more text as needed
+        while pos < len(buf) and buf[pos] in _JSON_WS + ",":
+            pos += 1
+        if pos == len(buf):
+            more = f.read(chunk_size)
+            if not more:
+                raise json.JSONDecodeError("Unterminated array", buf, pos)
+            buf, pos = more, 0
+            continue
+        if buf[pos] == "]":
+            return
+        
+        try:
+            item, end = _JSON_DECODER.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            more = f.read(chunk_size)
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        
+        if end == len(buf) or buf[end] not in _JSON_WS + ",]":
+            # A value not followed by a delimiter may be a cut-off number
+            more = f.read(chunk_size)
+            if more:
+                buf, pos = buf[pos:] + more, 0
+                continue
+        
+        yield item
+        pos = end
+
+
+def _count_json(file_path: str) -> Tuple[int, int]:
+    """(sample count, serialized size) of a JSON array file; (0, 0) otherwise."""
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    data = orjson.loads(raw)
+    if not isinstance(data, list):
+        return 0, 0
+    # The serialized array is already a good size proxy; no need to
+    # re-stringify every sample
+    return len(data), len(raw)
+
+
+def _count_jsonl(file_path: str) -> Tuple[int, int]:
+    """(non-blank line count, their total length) of a JSONL file."""
+    sample_count = 0
+    total_chars = 0
+    with open(file_path, "rb") as f:
+        for line in f:
+            line = line.rstrip(b"\n")
+            if line.strip():
+                sample_count += 1
+                total_chars += len(line)
+    return sample_count, total_chars
+
+
 class DatasetService:
     """Service for handling dataset operations."""
     
     ALLOWED_EXTENSIONS = {".json", ".jsonl", ".csv"}
     MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+    UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
     
     def __init__(self, db: Session):
         self.db = db
@@ -34,27 +116,64 @@ class DatasetService:
                 detail=f"Invalid file type. Allowed: {', '.join(self.ALLOWED_EXTENSIONS)}"
             )
         
+        # Reject sizes known before the copy: file.size is set once
+        # Starlette has spooled the body, and a part may declare its
+        # Content-Length. The copy loop below enforces the limit regardless.
+        declared_size = file.size
+        if declared_size is None:
+            declared_size = int(file.headers.get("content-length") or 0)
+        if declared_size > self.MAX_FILE_SIZE:
+            raise self._too_large()
+        
         # Create workspace directories
         self.workspace_manager.create_workspace_dirs(workspace_id)
         
         # Generate file path
         file_path = self.workspace_manager.get_dataset_path(workspace_id, file.filename)
         
-        # Save file
-        content = await file.read()
-        file_size = len(content)
-        
-        if file_size > self.MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Max size: {self.MAX_FILE_SIZE // (1024*1024)}MB"
+        # Stream into a temp file next to the target and only replace it
+        # once the upload is complete and parses: a rejected re-upload must
+        # leave the existing dataset (and its Dataset row's file) intact
+        try:
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(file_path), prefix=".upload_", suffix=file_ext
             )
-        
-        async with aiofiles.open(file_path, "wb") as f:
-            await f.write(content)
-        
-        # Parse and validate dataset
-        sample_count, token_count = await self._process_dataset(file_path, file_ext)
+        except FileNotFoundError:
+            # Directories removed outside this process since they were cached
+            self.workspace_manager.create_workspace_dirs(workspace_id, refresh=True)
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(file_path), prefix=".upload_", suffix=file_ext
+            )
+        os.close(fd)
+        try:
+            # Chunked so memory stays bounded; the write of one chunk
+            # overlaps the read of the next (two buffers max)
+            file_size = 0
+            async with aiofiles.open(temp_path, "wb") as f:
+                pending_write = None
+                while chunk := await file.read(self.UPLOAD_CHUNK_SIZE):
+                    file_size += len(chunk)
+                    if pending_write is not None:
+                        await pending_write
+                        pending_write = None
+                    if file_size > self.MAX_FILE_SIZE:
+                        break
+                    pending_write = asyncio.ensure_future(f.write(chunk))
+                if pending_write is not None:
+                    await pending_write
+            
+            if file_size > self.MAX_FILE_SIZE:
+                raise self._too_large()
+            
+            # Parse and validate dataset
+            sample_count, token_count = await self._process_dataset(temp_path, file_ext)
+            
+            # Re-uploading a filename overwrites it; account for the old bytes
+            previous_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
         
         # Create database entry
         dataset = models.Dataset(
@@ -69,36 +188,47 @@ class DatasetService:
         )
         
         self.db.add(dataset)
+        if previous_size is None:
+            self.workspace_manager.adjust_stats(workspace_id, file_size, 1)
+        else:
+            self.workspace_manager.adjust_stats(workspace_id, file_size - previous_size, 0)
         self.db.commit()
         self.db.refresh(dataset)
         
         return dataset
     
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"File too large. Max size: {self.MAX_FILE_SIZE // (1024*1024)}MB"
+        )
+    
     async def _process_dataset(self, file_path: str, file_ext: str) -> tuple:
         """Process dataset and return (sample_count, estimated_token_count)."""
         sample_count = 0
         total_chars = 0
         
-        async with aiofiles.open(file_path, "r") as f:
-            content = await f.read()
-        
         if file_ext == ".json":
-            data = json.loads(content)
-            if isinstance(data, list):
-                sample_count = len(data)
-                for sample in data:
-                    total_chars += len(str(sample))
+            # Up to MAX_FILE_SIZE of parsing; keep it off the event loop
+            sample_count, total_chars = await run_in_threadpool(_count_json, file_path)
         
         elif file_ext == ".jsonl":
-            lines = content.strip().split("\n")
-            sample_count = len(lines)
-            for line in lines:
-                total_chars += len(line)
+            # One sample per line. Iterating aiofiles costs a thread-pool
+            # round trip per line, so stream the file in one blocking pass
+            sample_count, total_chars = await run_in_threadpool(_count_jsonl, file_path)
         
         elif file_ext == ".csv":
-            lines = content.strip().split("\n")
-            sample_count = len(lines) - 1  # Exclude header
-            total_chars = len(content)
+            # Count newlines over raw chunks rather than building line strings
+            line_count = 0
+            last = b""
+            async with aiofiles.open(file_path, "rb") as f:
+                while chunk := await f.read(self.UPLOAD_CHUNK_SIZE):
+                    total_chars += len(chunk)
+                    line_count += chunk.count(b"\n")
+                    last = chunk
+            if last and not last.endswith(b"\n"):
+                line_count += 1  # final line without a trailing newline
+            sample_count = max(line_count - 1, 0)  # Exclude header
         
         # Rough token estimation (4 chars per token)
         estimated_tokens = total_chars // 4
@@ -109,7 +239,9 @@ class DatasetService:
         """Delete a dataset and its file."""
         # Delete file
         if os.path.exists(dataset.file_path):
+            size = os.path.getsize(dataset.file_path)
             os.remove(dataset.file_path)
+            self.workspace_manager.adjust_stats(dataset.workspace_id, -size, -1)
         
         # Delete database entry
         self.db.delete(dataset)
@@ -121,13 +253,13 @@ class DatasetService:
         
         with open(dataset.file_path, "r") as f:
             if dataset.format == "json":
-                data = json.load(f)
-                samples = data[:limit] if isinstance(data, list) else [data]
+                # Stop decoding once we have enough elements
+                samples = list(islice(_iter_json_array(f), limit))
             
             elif dataset.format == "jsonl":
                 for i, line in enumerate(f):
                     if i >= limit:
                         break
-                    samples.append(json.loads(line))
+                    samples.append(orjson.loads(line))
         
         return samples
@@ -1,21 +1,278 @@
-from typing import Optional, Dict, Any
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, Iterator, List
+from hashlib import blake2b
+from itertools import chain
 import asyncio
+import json
+import logging
+import mmap
+import multiprocessing
+import os
 import random
+import string
+import threading
+
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from starlette.concurrency import run_in_threadpool
 
 from app.db import models
+from app.db.database import SessionLocal
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+_PROMPT_WITH_INPUT = "### Instruction:\n{instruction}\n\n### Input:\n{input_text}\n\n### Response:\n"
+_PROMPT_NO_INPUT = "### Instruction:\n{instruction}\n\n### Response:\n"
+
+# Demo-mode matching: a training example answers a prompt when they share
+# two meaningful words, or one contains the other.
+_STOPWORDS = frozenset({'what', 'is', 'the', 'a', 'an', 'how', 'many', 'do', 'does', 'are', 'in', 'of', 'to'})
+_PUNCT_TABLE = str.maketrans("", "", string.punctuation)
+
+
+def _meaningful_words(text: str) -> frozenset:
+    return frozenset(text.translate(_PUNCT_TABLE).split()) - _STOPWORDS
+
+
+def _iter_jsonl_lines(file_path: str) -> Iterator[memoryview]:
+    """Yield each line of a file as a zero-copy view over an mmap.
+    
+    orjson parses memoryviews directly, so no per-line bytes are built.
+    """
+    with open(file_path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return
+    with mm, memoryview(mm) as view:
+        start = 0
+        size = len(mm)
+        while start < size:
+            end = mm.find(b"\n", start)
+            if end == -1:
+                end = size
+            line = view[start:end]
+            try:
+                yield line
+            finally:
+                line.release()
+            start = end + 1
+
+
+# Above this many word x row bits (8 MiB) match() falls back to postings
+_BITSET_MAX_BITS = 1 << 26
+
+
+class _QAIndex:
+    """Instruction/output pairs of one dataset plus a word -> rows index.
+    
+    Postings are stored structure-of-arrays style: words map to dense ids,
+    and each id's rows are one contiguous int32 array.
+    """
+    
+    def __init__(self, file_path: str):
+        self.instructions: List[str] = []
+        self.outputs: List[str] = []
+        self.vocab: Dict[str, int] = {}
+        self.postings: List[array] = []
+        
+        for line in _iter_jsonl_lines(file_path):
+            try:
+                item = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            if not isinstance(item, dict):
+                continue
+            instruction = item.get("instruction", "")
+            if not isinstance(instruction, str):
+                continue
+            
+            row = len(self.instructions)
+            self.instructions.append(instruction.lower())
+            self.outputs.append(item.get("output", ""))
+            for word in _meaningful_words(self.instructions[row]):
+                word_id = self.vocab.setdefault(word, len(self.postings))
+                if word_id == len(self.postings):
+                    self.postings.append(array("i"))
+                self.postings[word_id].append(row)
+        
+        # Small indexes also keep each word's rows as one int bitset
+        self.row_masks: Optional[List[int]] = None
+        if len(self.postings) * len(self.instructions) <= _BITSET_MAX_BITS:
+            self.row_masks = [self._bitset(rows) for rows in self.postings]
+    
+    def _bitset(self, rows: array) -> int:
+        buf = bytearray((len(self.instructions) + 7) // 8)
+        for row in rows:
+            buf[row >> 3] |= 1 << (row & 7)
+        return int.from_bytes(buf, "little")
+    
+    def _first_word_match(self, word_ids: List[int]) -> int:
+        """Lowest row sharing at least two of the words (len(rows) if none)."""
+        if self.row_masks is not None:
+            # Bit-parallel "seen once" / "seen twice" accumulators: a few
+            # big-int ANDs/ORs per word instead of touching each row
+            ones = twos = 0
+            for i in word_ids:
+                mask = self.row_masks[i]
+                twos |= ones & mask
+                ones |= mask
+            return (twos & -twos).bit_length() - 1 if twos else len(self.instructions)
+        
+        # Counter consumes the flat int arrays in C, no per-row Python loop
+        overlap = Counter(chain.from_iterable(self.postings[i] for i in word_ids))
+        return min((row for row, count in overlap.items() if count >= 2), default=len(self.instructions))
+    
+    def match(self, prompt_lower: str) -> Optional[str]:
+        """Return the output of the first matching row, in file order."""
+        vocab = self.vocab
+        word_ids = [vocab[word] for word in _meaningful_words(prompt_lower) if word in vocab]
+        best = self._first_word_match(word_ids)
+        
+        # Substring hits can't be indexed by word, but only rows before the
+        # best word match need checking
+        for row in range(best):
+            instruction = self.instructions[row]
+            if instruction in prompt_lower or prompt_lower in instruction:
+                best = row
+                break
+        
+        return self.outputs[best] if best < len(self.outputs) else None
+
+
+# dataset id -> (file mtime, index); rebuilt when the file changes
+_QA_INDEX: Dict[int, Any] = {}
+_qa_index_lock = threading.Lock()
+
+
+def _get_qa_index(dataset: models.Dataset) -> _QAIndex:
+    mtime = os.path.getmtime(dataset.file_path)
+    with _qa_index_lock:
+        cached = _QA_INDEX.get(dataset.id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        index = _QAIndex(dataset.file_path)
+        _QA_INDEX[dataset.id] = (mtime, index)
+        return index
+
+
+# Optional pool of inference processes (settings.INFERENCE_WORKERS > 0).
+# Each worker keeps its own loaded models, so generations neither reload
+# weights nor contend for one GIL.
+_inference_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+# Base models loaded by warmup(), claimed by the first request for them
+_PRELOADED_BASES: Dict[str, Any] = {}
+
+
+def _init_inference_worker(base_model_name: str, worker_counter) -> None:
+    """Pin the worker to one visible GPU and preload the default base model."""
+    with worker_counter.get_lock():
+        index = worker_counter.value
+        worker_counter.value += 1
+    
+    devices = [d for d in os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",") if d.strip()]
+    if devices:
+        os.environ["CUDA_VISIBLE_DEVICES"] = devices[index % len(devices)]
+    
+    InferenceService().warmup(base_model_name)
+
+
+def _get_inference_executor() -> Optional[ProcessPoolExecutor]:
+    """Return the inference process pool, or None to use the thread pool."""
+    global _inference_executor
+    if settings.INFERENCE_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _inference_executor is None:
+            # CUDA can't be re-initialised in a forked child
+            ctx = multiprocessing.get_context("spawn")
+            _inference_executor = ProcessPoolExecutor(
+                max_workers=settings.INFERENCE_WORKERS,
+                mp_context=ctx,
+                initializer=_init_inference_worker,
+                initargs=(settings.BASE_MODEL, ctx.Value("i", 0))
+            )
+    return _inference_executor
+
+
+def _prefetch_adapter_files(adapter_path: str) -> None:
+    """Ask the OS to start reading an adapter's weights into the page cache.
+    
+    Only a hint: the actual load happens later under the model lock, and by
+    then the disk read has (partly) overlapped with waiting for it.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        with os.scandir(adapter_path) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                fd = os.open(entry.path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+    except OSError:
+        pass
+
+
+def _model_spec(model: models.Model) -> Dict[str, Any]:
+    """The fields generation needs, as a picklable dict."""
+    return {"id": model.id, "base_model": model.base_model, "adapter_path": model.adapter_path}
+
+
+def _worker_generate(model_spec: Dict[str, Any], *args) -> Dict[str, Any]:
+    """Process-pool entry point for InferenceService._sync_generate."""
+    return InferenceService()._sync_generate(SimpleNamespace(**model_spec), *args)
+
+
+def _worker_generate_batch(model_spec: Dict[str, Any], *args) -> List[Dict[str, Any]]:
+    """Process-pool entry point for InferenceService._sync_generate_batch."""
+    return InferenceService()._sync_generate_batch(SimpleNamespace(**model_spec), *args)
+
+
+@lru_cache(maxsize=1)
+def _ml_backend() -> tuple:
+    """(ModelLoader, Predictor, PeftModel), imported on first use.
+    
+    The ML stack is heavy and absent in demo deploys, so it stays out of
+    module import, but is resolved only once rather than per request.
+    """
+    from ml.inference.model_loader import ModelLoader
+    from ml.inference.predictor import Predictor
+    from peft import PeftModel
+    return ModelLoader, Predictor, PeftModel
+
 
 class InferenceService:
     """Service for handling model inference."""
     
-    # Cache for loaded models
-    _model_cache: Dict[str, Any] = {}
-    _adapter_cache: Dict[int, str] = {}
+    # Loaded models, shared by every request in the process:
+    # base model name -> Predictor wrapping that base with PEFT (LRU order),
+    # and base model name -> {model id: adapter path loaded into it} (LRU order).
+    _model_cache: "OrderedDict[str, Any]" = OrderedDict()
+    _adapter_cache: "Dict[str, OrderedDict[int, str]]" = {}
+    # Each base model costs GBs of GPU memory, each adapter some more
+    MAX_CACHED_BASE_MODELS = settings.INFERENCE_MAX_BASE_MODELS
+    MAX_ADAPTERS_PER_BASE = settings.INFERENCE_MAX_ADAPTERS
+    # Serializes loading and generation: adapters on a shared base are
+    # switched in place, and one model can't run two requests at once anyway
+    _model_lock = threading.Lock()
     
     # Demo mode - set to True to use simulated responses without loading actual models
     DEMO_MODE = True
     
+    # Shared Redis client for the result cache (created on first use)
+    _redis: Optional[aioredis.Redis] = None
+    
     def __init__(self):
         self.base_model = None
         self.tokenizer = None
@@ -32,9 +289,46 @@ class InferenceService:
         if self.DEMO_MODE:
             return await self._demo_generate(model, prompt, max_tokens)
         
-        # Run inference in thread pool to avoid blocking
+        cache_key = self._cache_key(model, prompt, max_tokens, temperature, top_p)
+        if cache_key:
+            cached = await self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+        
+        if settings.INFERENCE_MAX_BATCH_SIZE > 1:
+            # Concurrent requests for the same model and sampling settings
+            # share one generate_batch() call
+            result = await _batch_scheduler.submit(self, model, prompt, max_tokens, temperature, top_p)
+        else:
+            result = await self._generate_one(model, prompt, max_tokens, temperature, top_p)
+        
+        if cache_key:
+            await self._cache_set(cache_key, result)
+        return result
+    
+    async def _generate_one(
+        self,
+        model: models.Model,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> Dict[str, Any]:
+        """Run a single generation off the event loop (process pool if configured)."""
         loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
+        self._prefetch_adapter(loop, model)
+        executor = _get_inference_executor()
+        if executor is not None:
+            return await loop.run_in_executor(
+                executor,
+                _worker_generate,
+                _model_spec(model),
+                prompt,
+                max_tokens,
+                temperature,
+                top_p
+            )
+        return await loop.run_in_executor(
             None,
             self._sync_generate,
             model,
@@ -43,7 +337,103 @@ class InferenceService:
             temperature,
             top_p
         )
-        return result
+    
+    def _prefetch_adapter(self, loop: asyncio.AbstractEventLoop, model: models.Model) -> None:
+        """Start pulling a not-yet-loaded adapter off disk, without waiting."""
+        loaded = self._adapter_cache.get(model.base_model, {})
+        if loaded.get(model.id) != model.adapter_path:
+            loop.run_in_executor(None, _prefetch_adapter_files, model.adapter_path)
+    
+    def _cache_key(
+        self,
+        model: models.Model,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> Optional[str]:
+        """Build the result-cache key, or None if the call isn't cacheable."""
+        # Sampled generations are non-deterministic and must not be reused
+        if settings.INFERENCE_CACHE_TTL <= 0 or temperature > 0:
+            return None
+        
+        raw = f"{model.id}|{model.adapter_path}|{prompt}|{max_tokens}|{temperature}|{top_p}"
+        return "inference:" + blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+    
+    @classmethod
+    def _get_redis(cls) -> aioredis.Redis:
+        if cls._redis is None:
+            cls._redis = aioredis.Redis.from_url(
+                settings.REDIS_URL,
+                socket_connect_timeout=0.2,
+                socket_timeout=0.2
+            )
+        return cls._redis
+    
+    async def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached result; cache failures count as a miss."""
+        try:
+            raw = await self._get_redis().get(key)
+        except RedisError:
+            return None
+        return json.loads(raw) if raw else None
+    
+    async def _cache_set(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a result; cache failures never fail the request."""
+        try:
+            await self._get_redis().setex(key, settings.INFERENCE_CACHE_TTL, json.dumps(result))
+        except RedisError:
+            pass
+    
+    async def generate_batch(
+        self,
+        model: models.Model,
+        prompts: List[str],
+        max_tokens: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate text for several prompts in one model call.
+        
+        Returns one result per prompt, in order. A prompt that failed on its
+        own is returned as {"error": "..."}.
+        """
+        if not prompts:
+            return []
+        
+        if self.DEMO_MODE:
+            outputs = await asyncio.gather(
+                *(self._demo_generate(model, prompt, max_tokens) for prompt in prompts),
+                return_exceptions=True
+            )
+            return [
+                {"error": str(output)} if isinstance(output, Exception) else output
+                for output in outputs
+            ]
+        
+        loop = asyncio.get_event_loop()
+        self._prefetch_adapter(loop, model)
+        executor = _get_inference_executor()
+        if executor is not None:
+            return await loop.run_in_executor(
+                executor,
+                _worker_generate_batch,
+                _model_spec(model),
+                prompts,
+                max_tokens,
+                temperature,
+                top_p
+            )
+        return await loop.run_in_executor(
+            None,
+            self._sync_generate_batch,
+            model,
+            prompts,
+            max_tokens,
+            temperature,
+            top_p
+        )
     
     async def _demo_generate(
         self,
@@ -52,58 +442,14 @@ class InferenceService:
         max_tokens: int
     ) -> Dict[str, Any]:
         """Generate a simulated response for demo purposes."""
-        import json
-        import os
-        
-        # Simulate some processing time
-        await asyncio.sleep(random.uniform(0.3, 0.8))
-        
         prompt_lower = prompt.lower().strip()
-        response = None
         
-        # Try to load training data from the model's training job
-        try:
-            from app.db.database import SessionLocal
-            db = SessionLocal()
-            
-            # Get the training job and its dataset
-            if model.training_job_id:
-                training_job = db.query(models.TrainingJob).filter(
-                    models.TrainingJob.id == model.training_job_id
-                ).first()
-                
-                if training_job:
-                    dataset = db.query(models.Dataset).filter(
-                        models.Dataset.id == training_job.dataset_id
-                    ).first()
-                    
-                    if dataset and os.path.exists(dataset.file_path):
-                        # Load the training data and find matching Q&A
-                        with open(dataset.file_path, 'r') as f:
-                            for line in f:
-                                try:
-                                    item = json.loads(line.strip())
-                                    instruction = item.get('instruction', '').lower()
-                                    
-                                    # Check if the prompt matches any training instruction
-                                    # Match on key words from the question
-                                    prompt_words = set(prompt_lower.replace('?', '').replace('.', '').split())
-                                    instruction_words = set(instruction.replace('?', '').replace('.', '').split())
-                                    
-                                    # Calculate word overlap
-                                    common_words = prompt_words & instruction_words
-                                    # Remove common stopwords
-                                    stopwords = {'what', 'is', 'the', 'a', 'an', 'how', 'many', 'do', 'does', 'are', 'in', 'of', 'to'}
-                                    meaningful_common = common_words - stopwords
-                                    
-                                    if len(meaningful_common) >= 2 or instruction in prompt_lower or prompt_lower in instruction:
-                                        response = item.get('output', '')
-                                        break
-                                except json.JSONDecodeError:
-                                    continue
-            db.close()
-        except Exception as e:
-            print(f"Error loading training data: {e}")
+        # The lookup is blocking, so it runs off the event loop, overlapped
+        # with the simulated processing time rather than after it
+        _, response = await asyncio.gather(
+            asyncio.sleep(random.uniform(0.3, 0.8)),
+            run_in_threadpool(self._lookup_response, model.training_job_id, prompt_lower)
+        )
         
         # Fallback to generic response if no match found
         if not response:
@@ -123,6 +469,32 @@ class InferenceService:
             "output_tokens": output_tokens
         }
     
+    def _lookup_response(self, training_job_id: Optional[int], prompt_lower: str) -> Optional[str]:
+        """Find the output of a training example matching the prompt, if any.
+        
+        Opens its own session: this runs on a worker thread.
+        """
+        if not training_job_id:
+            return None
+        
+        # Try to load training data from the model's training job
+        try:
+            db = SessionLocal()
+            try:
+                dataset = db.query(models.Dataset).join(
+                    models.TrainingJob, models.TrainingJob.dataset_id == models.Dataset.id
+                ).filter(models.TrainingJob.id == training_job_id).first()
+            finally:
+                db.close()
+            
+            if dataset and os.path.exists(dataset.file_path):
+                # Match against the cached index instead of rescanning the file
+                return _get_qa_index(dataset).match(prompt_lower)
+        except Exception as e:
+            logger.warning("Error loading training data: %s", e)
+        
+        return None
+    
     def _sync_generate(
         self,
         model: models.Model,
@@ -132,50 +504,193 @@ class InferenceService:
         top_p: float
     ) -> Dict[str, Any]:
         """Synchronous generation method."""
-        from ml.inference.model_loader import ModelLoader
-        from ml.inference.predictor import Predictor
-        
-        # Load base model if not cached
-        loader = ModelLoader()
-        base_model, tokenizer = loader.load_base_model(model.base_model)
-        
-        # Attach adapter
-        loaded_model = loader.attach_adapter(base_model, model.adapter_path)
-        
-        # Generate
-        predictor = Predictor(loaded_model, tokenizer)
-        generated_text = predictor.generate(
-            prompt=prompt,
-            max_new_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p
-        )
+        with self._model_lock:
+            predictor = self._load_predictor(model)
+            
+            # Generate; counts come from the generation's own tensors
+            output = predictor.generate_with_counts(
+                prompt=prompt,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p
+            )
         
-        # Count tokens
-        input_tokens = len(tokenizer.encode(prompt))
-        output_tokens = len(tokenizer.encode(generated_text))
+        return self._with_usage(output)
+    
+    def _sync_generate_batch(
+        self,
+        model: models.Model,
+        prompts: List[str],
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> List[Dict[str, Any]]:
+        """Synchronous batched generation method."""
+        with self._model_lock:
+            predictor = self._load_predictor(model)
+            
+            outputs = predictor.generate_batch_with_counts(
+                prompts,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p
+            )
         
+        return [self._with_usage(output) for output in outputs]
+    
+    @staticmethod
+    def _with_usage(output: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape a predictor result into the service's response dict."""
         return {
-            "generated_text": generated_text,
-            "tokens_used": input_tokens + output_tokens,
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens
+            "generated_text": output["generated_text"],
+            "tokens_used": output["input_tokens"] + output["output_tokens"],
+            "input_tokens": output["input_tokens"],
+            "output_tokens": output["output_tokens"]
         }
     
+    def warmup(self, base_model_name: str) -> None:
+        """Load a base model ahead of the first request that needs it."""
+        with self._model_lock:
+            if base_model_name in self._model_cache or base_model_name in _PRELOADED_BASES:
+                return
+            ModelLoader = _ml_backend()[0]
+            _PRELOADED_BASES[base_model_name] = ModelLoader().load_base_model(base_model_name, use_cache=False)
+    
+    def _load_predictor(self, model: models.Model):
+        """Return a Predictor for the model's base with its adapter active.
+        
+        Base models are loaded once and kept in an LRU of
+        MAX_CACHED_BASE_MODELS; each model's adapter is loaded into its base
+        once under its own name and re-selected on later calls, with at most
+        MAX_ADAPTERS_PER_BASE adapters (LRU) per base. Callers must hold
+        _model_lock.
+        """
+        ModelLoader, Predictor, PeftModel = _ml_backend()
+        
+        adapter_name = f"model_{model.id}"
+        predictor = self._model_cache.get(model.base_model)
+        
+        if predictor is None:
+            # Our LRU owns the weights, so bypass the loader's own cache
+            preloaded = _PRELOADED_BASES.pop(model.base_model, None)
+            if preloaded is not None:
+                base_model, tokenizer = preloaded
+            else:
+                base_model, tokenizer = ModelLoader().load_base_model(model.base_model, use_cache=False)
+            peft_model = PeftModel.from_pretrained(base_model, model.adapter_path, adapter_name=adapter_name)
+            predictor = Predictor(peft_model, tokenizer)
+            
+            self._model_cache[model.base_model] = predictor
+            self._adapter_cache[model.base_model] = OrderedDict({model.id: model.adapter_path})
+            while len(self._model_cache) > self.MAX_CACHED_BASE_MODELS:
+                evicted_name, _ = self._model_cache.popitem(last=False)
+                self._adapter_cache.pop(evicted_name, None)
+        else:
+            self._model_cache.move_to_end(model.base_model)
+            loaded = self._adapter_cache[model.base_model]
+            if loaded.get(model.id) != model.adapter_path:
+                if model.id in loaded:
+                    predictor.model.delete_adapter(adapter_name)
+                    del loaded[model.id]
+                predictor.model.load_adapter(model.adapter_path, adapter_name=adapter_name)
+                loaded[model.id] = model.adapter_path
+            else:
+                loaded.move_to_end(model.id)
+        
+        predictor.model.set_adapter(adapter_name)
+        predictor.model.eval()
+        
+        # Drop least recently used adapters (never the one just selected)
+        loaded = self._adapter_cache[model.base_model]
+        while len(loaded) > max(self.MAX_ADAPTERS_PER_BASE, 1):
+            evicted_id, _ = loaded.popitem(last=False)
+            predictor.model.delete_adapter(f"model_{evicted_id}")
+        
+        return predictor
+    
     def format_prompt(self, instruction: str, input_text: str = "") -> str:
         """Format prompt in instruction format."""
         if input_text:
-            return f"""### Instruction:
-{instruction}
+            return _PROMPT_WITH_INPUT.format(instruction=instruction, input_text=input_text)
+        return _PROMPT_NO_INPUT.format(instruction=instruction)
+    
+    def format_prompts(self, instructions: List[str], inputs: Optional[List[str]] = None) -> List[str]:
+        """Format a batch of prompts in instruction format."""
+        if inputs is None:
+            return [_PROMPT_NO_INPUT.format(instruction=i) for i in instructions]
+        return [self.format_prompt(i, x) for i, x in zip(instructions, inputs)]
 
-### Input:
-{input_text}
 
-### Response:
-"""
-        else:
-            return f"""### Instruction:
-{instruction}
+class _BatchScheduler:
+    """Coalesces concurrent generate() calls into generate_batch() calls.
+    
+    Requests are grouped by model and sampling settings. A group is sent
+    when it reaches INFERENCE_MAX_BATCH_SIZE prompts or INFERENCE_BATCH_WAIT_MS
+    after its first prompt arrived, whichever comes first.
+    """
+    
+    def __init__(self):
+        self._pending: Dict[tuple, List[Any]] = {}
+        self._running: set = set()  # keeps in-flight batch tasks referenced
+    
+    async def submit(
+        self,
+        service: InferenceService,
+        model: models.Model,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float
+    ) -> Dict[str, Any]:
+        key = (model.id, model.adapter_path, max_tokens, temperature, top_p)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            loop.call_later(
+                settings.INFERENCE_BATCH_WAIT_MS / 1000,
+                self._flush, key, batch, service, model, max_tokens, temperature, top_p
+            )
+        batch.append((prompt, future))
+        if len(batch) >= settings.INFERENCE_MAX_BATCH_SIZE:
+            self._flush(key, batch, service, model, max_tokens, temperature, top_p)
+        
+        return await future
+    
+    def _flush(self, key, batch, service, model, max_tokens, temperature, top_p) -> None:
+        # The timer may fire after the batch already went out when full
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        task = asyncio.ensure_future(self._run(batch, service, model, max_tokens, temperature, top_p))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+    
+    async def _run(self, batch, service, model, max_tokens, temperature, top_p) -> None:
+        prompts = [prompt for prompt, _ in batch]
+        try:
+            outputs = await service.generate_batch(
+                model=model,
+                prompts=prompts,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), output in zip(batch, outputs):
+            if future.done():
+                continue  # caller went away
+            if "error" in output:
+                future.set_exception(RuntimeError(output["error"]))
+            else:
+                future.set_result(output)
+
 
-### Response:
-"""
+_batch_scheduler = _BatchScheduler()
@@ -1,10 +1,167 @@
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Dict, List, Optional
+from sqlalchemy import bindparam, func, select, update
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timezone
+import atexit
+import logging
+import threading
+import time
+import uuid
 
 from app.db import models, schemas
 from app.config import settings
 from app.core.workspace import WorkspaceManager
+from app.db.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of buffered step progress
+PROGRESS_FLUSH_INTERVAL = 0.5
+
+# job id -> latest non-status fields reported by update_job_progress
+_PROGRESS_BUFFER: Dict[int, dict] = {}
+_progress_lock = threading.Lock()
+# Held while buffered rows are written so a status change or terminal
+# write can't be overtaken by an older progress row
+_progress_flush_lock = threading.Lock()
+_progress_flusher: Optional[threading.Thread] = None
+
+@lru_cache(maxsize=1)
+def worker_tasks():
+    """The Celery tasks module, or None without workers/Celery installed.
+    
+    Resolved once; a failed import would otherwise be retried (with a
+    sys.path search) on every call.
+    """
+    try:
+        from workers import tasks
+        return tasks
+    except ImportError:
+        return None
+
+
+@lru_cache(maxsize=1)
+def _celery_app():
+    try:
+        from workers.celery_app import celery
+        return celery
+    except ImportError:
+        return None
+
+
+# Publishes to the Celery broker off the request path; one thread keeps
+# messages in submission order
+_enqueue_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="celery-enqueue")
+
+
+def _fail_unsent_job(job_id: int, future: Future) -> None:
+    """Fail a job whose task never reached the broker.
+    
+    The job row is already committed as pending and the API has returned,
+    so without this it would stay pending forever.
+    """
+    error = future.exception()
+    if error is None:
+        return
+    
+    logger.error("Failed to enqueue Celery task for job %s", job_id, exc_info=error)
+    db = SessionLocal()
+    try:
+        TrainingService(db).fail_job(job_id, f"Could not queue job: {error}")
+    except Exception:
+        logger.exception("Could not mark job %s as failed", job_id)
+    finally:
+        db.close()
+
+
+def enqueue(task, job_id: int, task_id: Optional[str] = None) -> Future:
+    """Send a job's Celery task without waiting on the broker round-trip.
+    
+    If publishing fails, the job is marked failed.
+    """
+    future = _enqueue_pool.submit(task.apply_async, args=(job_id,), task_id=task_id)
+    future.add_done_callback(partial(_fail_unsent_job, job_id))
+    return future
+
+
+_STATUS_COLUMNS = (
+    models.TrainingJob.id,
+    models.TrainingJob.status,
+    models.TrainingJob.progress,
+    models.TrainingJob.current_step,
+    models.TrainingJob.total_steps,
+    models.TrainingJob.metrics,
+    models.TrainingJob.error_message,
+)
+
+
+def _buffer_progress(job_id: int, fields: dict) -> None:
+    global _progress_flusher
+    with _progress_lock:
+        _PROGRESS_BUFFER.setdefault(job_id, {}).update(fields)
+        if _progress_flusher is None:
+            _progress_flusher = threading.Thread(
+                target=_flush_progress_loop, name="progress-flush", daemon=True
+            )
+            _progress_flusher.start()
+
+
+def _take_progress(job_id: int) -> dict:
+    """Remove and return a job's buffered fields; hold the flush lock."""
+    with _progress_lock:
+        return _PROGRESS_BUFFER.pop(job_id, {})
+
+
+def flush_progress() -> None:
+    """Write all buffered progress in one bulk UPDATE."""
+    with _progress_flush_lock:
+        with _progress_lock:
+            pending = dict(_PROGRESS_BUFFER)
+            _PROGRESS_BUFFER.clear()
+        if not pending:
+            return
+        
+        # One executemany per distinct set of columns
+        batches: Dict[tuple, list] = {}
+        for job_id, fields in pending.items():
+            batches.setdefault(tuple(sorted(fields)), []).append(
+                {"job_id": job_id, **{f"new_{key}": value for key, value in fields.items()}}
+            )
+        
+        table = models.TrainingJob.__table__
+        db = SessionLocal()
+        try:
+            for columns, rows in batches.items():
+                db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("job_id"))
+                    .values({
+                        column: bindparam(f"new_{column}", type_=table.c[column].type)
+                        for column in columns
+                    }),
+                    rows,
+                )
+            db.commit()
+        except Exception:
+            logger.exception("Failed to write progress for %d job(s)", len(pending))
+        finally:
+            db.close()
+
+
+def _flush_progress_loop() -> None:
+    global _progress_flusher
+    while True:
+        time.sleep(PROGRESS_FLUSH_INTERVAL)
+        flush_progress()
+        with _progress_lock:
+            if not _PROGRESS_BUFFER:
+                _progress_flusher = None
+                return
+
+
+atexit.register(flush_progress)
 
 
 class TrainingService:
@@ -39,63 +196,59 @@ class TrainingService:
         )
         
         self.db.add(job)
+        self.db.flush()
+        
+        # Task id (or local marker) goes out with the INSERT, so the
+        # worker only ever sees committed rows
+        self._queue_training_job(job)
         self.db.commit()
         self.db.refresh(job)
         
-        # Queue the job for processing
-        self._queue_training_job(job.id)
+        tasks = worker_tasks()
+        if tasks is not None and job.celery_task_id and not job.celery_task_id.startswith("local_"):
+            enqueue(tasks.run_training_job, job.id, task_id=job.celery_task_id)
         
         return job
     
-    def _queue_training_job(self, job_id: int) -> str:
-        """Queue a training job for Celery worker processing."""
-        try:
-            from workers.tasks import run_training_job
-            
-            # Send to Celery
-            task = run_training_job.delay(job_id)
-            
-            # Update job with task ID
-            job = self.db.query(models.TrainingJob).filter(
-                models.TrainingJob.id == job_id
-            ).first()
-            
-            if job:
-                job.celery_task_id = task.id
-                self.db.commit()
-            
-            return task.id
-        except ImportError:
-            # Celery workers not available - mark job as queued for manual processing
-            job = self.db.query(models.TrainingJob).filter(
-                models.TrainingJob.id == job_id
-            ).first()
-            
-            if job:
-                job.status = "queued"
-                job.celery_task_id = f"local_{job_id}"
-                self.db.commit()
-            
-            return f"local_{job_id}"
+    def _queue_training_job(self, job: models.TrainingJob) -> str:
+        """Assign a job its Celery task id; it is sent once committed."""
+        if worker_tasks() is not None:
+            job.celery_task_id = str(uuid.uuid4())
+            return job.celery_task_id
+        
+        # Celery workers not available - mark job as queued for manual processing
+        job.status = "queued"
+        job.celery_task_id = f"local_{job.id}"
+        
+        return job.celery_task_id
+    
+    def _update_job(self, job_id: int, *returning, **values):
+        """UPDATE one job in place (no SELECT first).
+        
+        Returns the row of `returning` columns, or None if the job is gone.
+        """
+        stmt = (
+            update(models.TrainingJob)
+            .where(models.TrainingJob.id == job_id)
+            .values(**values)
+        )
+        if returning:
+            return self.db.execute(stmt.returning(*returning)).first()
+        self.db.execute(stmt)
+        return None
     
     def get_job_status(self, job_id: int) -> Optional[dict]:
         """Get the current status of a training job."""
-        job = self.db.query(models.TrainingJob).filter(
-            models.TrainingJob.id == job_id
-        ).first()
-        
-        if not job:
-            return None
-        
-        return {
-            "id": job.id,
-            "status": job.status,
-            "progress": job.progress,
-            "current_step": job.current_step,
-            "total_steps": job.total_steps,
-            "metrics": job.metrics,
-            "error_message": job.error_message
-        }
+        return self.get_statuses([job_id]).get(job_id)
+    
+    def get_statuses(self, job_ids: List[int]) -> Dict[int, dict]:
+        """Get the status of many training jobs in one query, keyed by id."""
+        if not job_ids:
+            return {}
+        rows = self.db.execute(
+            select(*_STATUS_COLUMNS).where(models.TrainingJob.id.in_(job_ids))
+        )
+        return {row.id: dict(row._mapping) for row in rows}
     
     def update_job_progress(
         self,
@@ -106,28 +259,34 @@ class TrainingService:
         total_steps: Optional[int] = None,
         metrics: Optional[dict] = None
     ) -> None:
-        """Update training job progress."""
-        job = self.db.query(models.TrainingJob).filter(
-            models.TrainingJob.id == job_id
-        ).first()
+        """Update training job progress.
         
-        if job:
-            if status:
-                job.status = status
-                if status == "running" and not job.started_at:
-                    job.started_at = datetime.now()
-                elif status in ["completed", "failed"]:
-                    job.completed_at = datetime.now()
-            
-            if progress is not None:
-                job.progress = progress
-            if current_step is not None:
-                job.current_step = current_step
-            if total_steps is not None:
-                job.total_steps = total_steps
-            if metrics:
-                job.metrics = metrics
+        Step progress is buffered and written every PROGRESS_FLUSH_INTERVAL
+        seconds; status changes are written immediately.
+        """
+        fields = {
+            key: value for key, value in (
+                ("progress", progress),
+                ("current_step", current_step),
+                ("total_steps", total_steps),
+            ) if value is not None
+        }
+        if metrics:
+            fields["metrics"] = metrics
+        
+        if not status:
+            if fields:
+                _buffer_progress(job_id, fields)
+            return
+        
+        with _progress_flush_lock:
+            fields = {**_take_progress(job_id), **fields}
+            if status == "running":
+                fields["started_at"] = func.coalesce(models.TrainingJob.started_at, datetime.now())
+            elif status in ["completed", "failed"]:
+                fields["completed_at"] = datetime.now()
             
+            self._update_job(job_id, status=status, **fields)
             self.db.commit()
     
     def complete_job(
@@ -137,20 +296,27 @@ class TrainingService:
         metrics: dict
     ) -> models.Model:
         """Mark job as complete and register the trained model."""
-        job = self.db.query(models.TrainingJob).filter(
-            models.TrainingJob.id == job_id
-        ).first()
+        with _progress_flush_lock:
+            _take_progress(job_id)
+        
+        # Update job, reading back what the model row needs
+        job = self._update_job(
+            job_id,
+            models.TrainingJob.id,
+            models.TrainingJob.workspace_id,
+            models.TrainingJob.name,
+            models.TrainingJob.base_model,
+            status="completed",
+            progress=100.0,
+            model_path=model_path,
+            metrics=metrics,
+            completed_at=datetime.now(),
+        )
         
         if not job:
+            self.db.rollback()
             raise ValueError(f"Job {job_id} not found")
         
-        # Update job
-        job.status = "completed"
-        job.progress = 100.0
-        job.model_path = model_path
-        job.metrics = metrics
-        job.completed_at = datetime.now()
-        
         # Create model entry
         model = models.Model(
             workspace_id=job.workspace_id,
@@ -162,6 +328,8 @@ class TrainingService:
         )
         
         self.db.add(model)
+        # The adapter and checkpoints were written outside the app; recount
+        self.workspace_manager.get_workspace_stats(job.workspace_id, refresh=True)
         self.db.commit()
         self.db.refresh(model)
         
@@ -169,23 +337,99 @@ class TrainingService:
     
     def fail_job(self, job_id: int, error_message: str) -> None:
         """Mark a job as failed."""
-        job = self.db.query(models.TrainingJob).filter(
-            models.TrainingJob.id == job_id
-        ).first()
+        with _progress_flush_lock:
+            _take_progress(job_id)
         
-        if job:
-            job.status = "failed"
-            job.error_message = error_message
-            job.completed_at = datetime.now()
-            self.db.commit()
+        self._update_job(
+            job_id,
+            status="failed",
+            error_message=error_message,
+            completed_at=datetime.now(),
+        )
+        self.db.commit()
     
     def cancel_job(self, job: models.TrainingJob) -> None:
         """Cancel a running or pending job."""
         # Revoke Celery task if exists
-        if job.celery_task_id:
-            from workers.celery_app import celery
+        celery = _celery_app() if job.celery_task_id else None
+        if celery is not None:
             celery.control.revoke(job.celery_task_id, terminate=True)
         
+        with _progress_flush_lock:
+            _take_progress(job.id)
+        
         job.status = "cancelled"
         job.completed_at = datetime.now()
         self.db.commit()
+
+
+# Simulated progress is written to the DB once per this many steps
+PROGRESS_COMMIT_INTERVAL = 10
+
+
+def simulate_training(job_id: int):
+    """Simulate training progress for demo purposes.
+
+    Runs outside any request (Celery worker or background thread), so it
+    opens its own session.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(models.TrainingJob).filter(models.TrainingJob.id == job_id).first()
+        if not job:
+            return
+        
+        # Update status to running
+        job.status = "running"
+        job.total_steps = 100
+        job.current_step = 0
+        db.commit()
+        
+        # Simulate training progress
+        for step in range(1, 101):
+            time.sleep(0.3)  # Simulate work - 30 seconds total
+            
+            # Nothing else writes this row, so skip the refresh and only
+            # persist progress every few steps with a plain UPDATE.
+            if step % PROGRESS_COMMIT_INTERVAL and step != 100:
+                continue
+            
+            db.execute(
+                update(models.TrainingJob)
+                .where(models.TrainingJob.id == job_id)
+                .values(
+                    current_step=step,
+                    progress=float(step),
+                    metrics={"loss": round(2.0 - (step * 0.018), 4), "step": step}
+                )
+            )
+            db.commit()
+        
+        # Mark as completed
+        job.status = "completed"
+        job.progress = 100.0
+        job.completed_at = datetime.now(timezone.utc)
+        db.commit()
+        
+        # Create a Model record so it appears in Models/Inference pages
+        trained_model = models.Model(
+            name=job.name,
+            base_model=job.base_model,
+            workspace_id=job.workspace_id,
+            adapter_path=f"data/models/workspace_{job.workspace_id}/adapters/{job.name}",
+            training_job_id=job.id,
+            metrics=job.metrics
+        )
+        db.add(trained_model)
+        db.commit()
+        logger.info("Training complete: model %r created (id=%s)", job.name, trained_model.id)
+        
+    except Exception as e:
+        logger.exception("Training job %s failed", job_id)
+        job = db.query(models.TrainingJob).filter(models.TrainingJob.id == job_id).first()
+        if job:
+            job.status = "failed"
+            job.error_message = str(e)
+            db.commit()
+    finally:
+        db.close()
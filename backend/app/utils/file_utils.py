@@ -1,6 +1,13 @@
+import errno
 import os
 import shutil
-from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 
 def ensure_dir(path: str) -> None:
@@ -28,21 +35,86 @@ def get_file_size(path: str) -> Optional[int]:
         return None
 
 
+def _scan_dir(path: str) -> Tuple[int, List[str]]:
+    """Return (bytes of files directly in path, subdirectory paths)."""
+    total = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+    except OSError:
+        pass
+    return total, subdirs
+
+
 def get_dir_size(path: str) -> int:
     """Get total size of a directory."""
-    total = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total += os.path.getsize(fp)
+    total, pending = _scan_dir(path)
+    if len(pending) < 2:
+        # Small or linear trees: a thread pool only adds overhead
+        while pending:
+            size, subdirs = _scan_dir(pending.pop())
+            total += size
+            pending.extend(subdirs)
+        return total
+
+    # Walk independent subtrees concurrently; stat blocks on I/O, not the GIL
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+        futures = {pool.submit(_scan_dir, d) for d in pending}
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                size, subdirs = future.result()
+                total += size
+                futures.update(pool.submit(_scan_dir, d) for d in subdirs)
     return total
 
 
-def copy_file(src: str, dst: str) -> bool:
+# ioctl(FICLONE): share extents on copy-on-write filesystems (Btrfs, XFS)
+_FICLONE = 0x40049409
+
+
+def _copy_in_kernel(src: str, dst: str, reflink: bool) -> bool:
+    """Copy without moving bytes through userspace; False if unsupported."""
+    reflink = reflink and fcntl is not None
+    if not hasattr(os, "copy_file_range") and not reflink:
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if reflink:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return True
+            except OSError:
+                pass
+        if not hasattr(os, "copy_file_range"):
+            return False
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                return False
+            raise
+        return remaining == 0
+
+
+def copy_file(src: str, dst: str, reflink: bool = True, copy_metadata: bool = True) -> bool:
     """Copy a file."""
     try:
         ensure_dir(os.path.dirname(dst))
-        shutil.copy2(src, dst)
+        if not _copy_in_kernel(src, dst, reflink):
+            # shutil.copyfile uses sendfile on Linux
+            shutil.copyfile(src, dst)
+        if copy_metadata:
+            shutil.copystat(src, dst)
         return True
     except Exception:
         return False
@@ -1,18 +1,44 @@
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 
 
-def estimate_token_count(text: str) -> int:
+@lru_cache(maxsize=8)
+def _get_tokenizer(model_name: str):
     """
-    Estimate token count without loading tokenizer.
-    Rough approximation: ~4 characters per token for English.
+    Load (once) the Rust fast tokenizer for a model.
+    Returns None if `tokenizers` isn't installed or the model can't be loaded.
     """
+    try:
+        from tokenizers import Tokenizer
+        return Tokenizer.from_pretrained(model_name)
+    except Exception:
+        return None
+
+
+def estimate_token_count(text: str, model_name: Optional[str] = None) -> int:
+    """
+    Estimate token count.
+    Uses the model's fast tokenizer when model_name is given and loadable;
+    otherwise ~4 characters per token for English.
+    """
+    tokenizer = _get_tokenizer(model_name) if model_name else None
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
     return len(text) // 4
 
 
-def truncate_to_tokens(text: str, max_tokens: int) -> str:
+def truncate_to_tokens(text: str, max_tokens: int, model_name: Optional[str] = None) -> str:
     """
     Truncate text to approximately max_tokens.
+    Exact (cut at a token boundary) when the model's tokenizer is available.
     """
+    tokenizer = _get_tokenizer(model_name) if model_name else None
+    if tokenizer is not None:
+        offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+        if len(offsets) <= max_tokens:
+            return text
+        return text[:offsets[max_tokens - 1][1]] if max_tokens > 0 else ""
+
     estimated_chars = max_tokens * 4
     if len(text) <= estimated_chars:
         return text
@@ -26,16 +52,39 @@ def count_tokens_accurate(text: str, tokenizer) -> int:
     return len(tokenizer.encode(text))
 
 
-def split_into_chunks(text: str, max_tokens: int, tokenizer) -> List[str]:
+def split_into_chunks(text: str, max_tokens: int, tokenizer, stride: int = 0) -> List[str]:
     """
     Split text into chunks of max_tokens.
+    Consecutive chunks overlap by `stride` tokens (text is tokenized once).
     """
+    step = max_tokens - stride
+    if step <= 0:
+        raise ValueError("stride must be smaller than max_tokens")
+
+    if getattr(tokenizer, "is_fast", False):
+        # Slice the original text at token offsets: one encode, no decodes
+        offsets = tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )["offset_mapping"]
+        n = len(offsets)
+        chunks = []
+        for i in range(0, n, step):
+            start = offsets[i][0] if i else 0
+            end = offsets[i + max_tokens][0] if i + max_tokens < n else len(text)
+            chunks.append(text[start:end])
+            if i + max_tokens >= n:
+                break
+        return chunks
+
     tokens = tokenizer.encode(text)
-    chunks = []
-    
-    for i in range(0, len(tokens), max_tokens):
-        chunk_tokens = tokens[i:i + max_tokens]
-        chunk_text = tokenizer.decode(chunk_tokens)
-        chunks.append(chunk_text)
-    
-    return chunks
+    windows = []
+    for i in range(0, len(tokens), step):
+        windows.append(tokens[i:i + max_tokens])
+        if i + max_tokens >= len(tokens):
+            break
+
+    # One call into the tokenizer instead of one per chunk
+    batch_decode = getattr(tokenizer, "batch_decode", None) or getattr(tokenizer, "decode_batch", None)
+    if batch_decode is not None:
+        return list(batch_decode(windows))
+    return [tokenizer.decode(window) for window in windows]
@@ -1,17 +1,40 @@
 """
 Pytest fixtures and configuration for ForgeLLM backend tests.
 """
+import functools
+import hashlib
+import os
 import pytest
-from typing import Generator, Dict, Any
+from contextvars import ContextVar
+from unittest.mock import AsyncMock
+from typing import AsyncGenerator, Generator, Dict
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+# Minimum bcrypt cost: tests check hashing round-trips, not KDF strength.
+# Read by app.config, so it must be set before the app is imported.
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+# pytest-xdist runs each worker in its own process (PYTEST_XDIST_WORKER=gw0,
+# gw1, ...). The in-memory test DB is per process already; give each worker
+# its own app DB file so equal row ids don't collide on disk. Storage dirs
+# come from the _storage_dirs fixture, whose tmp_path_factory is per worker.
+_XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER")
+if _XDIST_WORKER:
+    _db_url = os.environ.get("DATABASE_URL", "")
+    if _db_url.startswith("sqlite:///") and _db_url.endswith(".db"):
+        os.environ["DATABASE_URL"] = f"{_db_url[:-3]}_{_XDIST_WORKER}.db"
+
 from app.main import app
+from app.config import settings
 from app.db.database import Base
-from app.dependencies import get_db
-from app.core.security import get_password_hash, create_access_token
+from app.dependencies import get_db, get_inference_service
+from app.api import auth as auth_api
+from app.core.security import get_password_hash, verify_password, create_access_token
 from app.db import models
 from datetime import timedelta
 
@@ -24,12 +47,102 @@ engine = create_engine(
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+# pysqlite's own transaction handling breaks SAVEPOINT; emit BEGIN ourselves
+@event.listens_for(engine, "connect")
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(engine, "begin")
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
+TestingSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    join_transaction_mode="create_savepoint",
+)
+
+
+# Test-only: FORGE_TEST_FAST_CRYPTO=1 (or FAST_HASH=1) swaps bcrypt for
+# sha256 in the auth endpoints and fixture users. Tests only exercise the
+# hash round-trip, not the KDF's cost. test_security.py still uses the
+# real functions.
+FAST_HASH = "1" in (os.getenv("FORGE_TEST_FAST_CRYPTO"), os.getenv("FAST_HASH"))
+
+
+def _fast_hash(password: str) -> str:
+    return "sha256:" + hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+def _fast_verify(plain_password: str, hashed_password: str) -> bool:
+    if hashed_password.startswith("sha256:"):
+        return _fast_hash(plain_password) == hashed_password
+    return verify_password(plain_password, hashed_password)
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_hash(password: str) -> str:
+    """Hash each fixture password once per session."""
+    return _fast_hash(password) if FAST_HASH else get_password_hash(password)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _storage_dirs(tmp_path_factory) -> Generator:
+    """Write uploads and models under a temp dir, not the checkout's ./data."""
+    root = tmp_path_factory.mktemp("storage")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(settings, "UPLOAD_DIR", str(root / "uploads"))
+        mp.setattr(settings, "MODELS_DIR", str(root / "models"))
+        yield root
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _fast_password_hashing() -> Generator:
+    """Patch the auth endpoints once for the session; restored on teardown."""
+    if not FAST_HASH:
+        yield
+        return
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(auth_api, "get_password_hash", _fast_hash)
+        mp.setattr(auth_api, "verify_password", _fast_verify)
+        yield
+
+
+@pytest.fixture(scope="session")
+def _schema() -> Generator:
+    """Create the schema once for the whole test session."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="function")
+def connection(_schema) -> Generator:
+    """One outer transaction per test, rolled back afterwards.
+    
+    Sessions join it with SAVEPOINTs, so commits in fixtures and
+    endpoints never reach the database.
+    """
+    conn = engine.connect()
+    trans = conn.begin()
+    try:
+        yield conn
+    finally:
+        trans.rollback()
+        conn.close()
+
+
+# Connection (outer transaction) the current test's requests should join
+_current_connection: ContextVar[Connection] = ContextVar("_current_connection")
 
 
 def override_get_db():
     """Override database dependency for testing."""
-    db = TestingSessionLocal()
+    db = TestingSessionLocal(bind=_current_connection.get())
     try:
         yield db
     finally:
@@ -37,75 +150,151 @@ def override_get_db():
 
 
 @pytest.fixture(scope="function")
-def db() -> Generator:
+def db(connection) -> Generator:
     """Create a fresh database for each test."""
-    Base.metadata.create_all(bind=engine)
-    db = TestingSessionLocal()
+    db = TestingSessionLocal(bind=connection)
+    token = _current_connection.set(connection)
     try:
         yield db
     finally:
+        _current_connection.reset(token)
         db.close()
-        Base.metadata.drop_all(bind=engine)
 
 
-@pytest.fixture(scope="function")
-def client(db) -> Generator:
-    """Create a test client with database override."""
+@pytest.fixture(scope="session")
+def _app_client() -> Generator:
+    """One TestClient (and one startup/shutdown) for the whole session."""
     app.dependency_overrides[get_db] = override_get_db
-    Base.metadata.create_all(bind=engine)
     
     with TestClient(app) as c:
         yield c
     
     app.dependency_overrides.clear()
-    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="function")
+def client(_app_client, db) -> TestClient:
+    """Create a test client with database override."""
+    return _app_client
+
+
+@pytest.fixture(scope="function")
+async def async_client(_app_client, db) -> AsyncGenerator:
+    """Async client calling the app in-process on the test's event loop.
+    
+    Skips TestClient's thread portal per request; _app_client has already
+    run startup and installed the DB override.
+    """
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        yield ac
+
+
+@pytest.fixture(scope="session")
+def _session_users(_schema) -> Dict[str, int]:
+    """Create both fixture users once, committed outside any test's rollback.
+    
+    Hashing and token signing then happen once per run; tests that don't
+    ask for the users simply never look them up.
+    """
+    users = {
+        "test": models.User(
+            email="test@example.com",
+            username="testuser",
+            hashed_password=_cached_hash("testpass123")
+        ),
+        "second": models.User(
+            email="other@example.com",
+            username="otheruser",
+            hashed_password=_cached_hash("otherpass123")
+        ),
+    }
+    with TestingSessionLocal(bind=engine) as session:
+        session.add_all(users.values())
+        session.commit()
+        return {key: user.id for key, user in users.items()}
+
+
+def _bearer(user_id: int) -> Dict[str, str]:
+    access_token = create_access_token(
+        data={"sub": str(user_id)},
+        expires_delta=timedelta(minutes=30)
+    )
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+@pytest.fixture
+def mock_inference_service() -> Generator:
+    """Replace the inference service dependency with an AsyncMock."""
+    mock = AsyncMock()
+    app.dependency_overrides[get_inference_service] = lambda: mock
+    yield mock
+    app.dependency_overrides.pop(get_inference_service, None)
 
 
 @pytest.fixture
-def test_user(db) -> models.User:
+def test_user(db, _session_users) -> models.User:
     """Create a test user."""
-    user = models.User(
-        email="test@example.com",
-        username="testuser",
-        hashed_password=get_password_hash("testpass123")
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    return db.get(models.User, _session_users["test"])
+
+
+@pytest.fixture(scope="module")
+def _module_rows(_session_users) -> Generator:
+    """Create the workspace, dataset and model a module's tests share.
+    
+    They are committed once per module; each test still runs in its own
+    rolled-back transaction, so its updates and deletes never persist.
+    """
+    with TestingSessionLocal(bind=engine) as session:
+        workspace = models.Workspace(
+            name="Test Workspace",
+            description="A workspace for testing",
+            owner_id=_session_users["test"]
+        )
+        session.add(workspace)
+        session.flush()
+        dataset = models.Dataset(
+            name="test_dataset.jsonl",
+            workspace_id=workspace.id,
+            file_path="/data/uploads/test_dataset.jsonl",
+            file_size=1024,
+            token_count=500,
+            sample_count=10,
+            format="jsonl",
+            status="ready"
+        )
+        model = models.Model(
+            name="test-adapter-v1",
+            description="A test LoRA adapter",
+            workspace_id=workspace.id,
+            training_job_id=None,  # Can be null
+            adapter_path="/data/models/test-adapter",
+            base_model="mistralai/Mistral-7B-v0.1",
+            metrics={"loss": 0.5, "eval_loss": 0.6},
+            is_active=True
+        )
+        session.add_all([dataset, model])
+        session.commit()
+        rows = {"workspace": workspace.id, "dataset": dataset.id, "model": model.id}
+    
+    yield rows
+    
+    with TestingSessionLocal(bind=engine) as session:
+        session.delete(session.get(models.Model, rows["model"]))
+        session.delete(session.get(models.Dataset, rows["dataset"]))
+        session.delete(session.get(models.Workspace, rows["workspace"]))
+        session.commit()
 
 
 @pytest.fixture
-def test_workspace(db, test_user) -> models.Workspace:
+def test_workspace(db, _module_rows) -> models.Workspace:
     """Create a test workspace."""
-    workspace = models.Workspace(
-        name="Test Workspace",
-        description="A workspace for testing",
-        owner_id=test_user.id
-    )
-    db.add(workspace)
-    db.commit()
-    db.refresh(workspace)
-    return workspace
+    return db.get(models.Workspace, _module_rows["workspace"])
 
 
 @pytest.fixture
-def test_dataset(db, test_workspace) -> models.Dataset:
+def test_dataset(db, _module_rows) -> models.Dataset:
     """Create a test dataset."""
-    dataset = models.Dataset(
-        name="test_dataset.jsonl",
-        workspace_id=test_workspace.id,
-        file_path="/data/uploads/test_dataset.jsonl",
-        file_size=1024,
-        token_count=500,
-        sample_count=10,
-        format="jsonl",
-        status="ready"
-    )
-    db.add(dataset)
-    db.commit()
-    db.refresh(dataset)
-    return dataset
+    return db.get(models.Dataset, _module_rows["dataset"])
 
 
 @pytest.fixture
@@ -129,53 +318,24 @@ def test_training_job(db, test_workspace, test_dataset) -> models.TrainingJob:
 
 
 @pytest.fixture
-def test_model(db, test_workspace) -> models.Model:
+def test_model(db, _module_rows) -> models.Model:
     """Create a test trained model (without training job dependency)."""
-    model = models.Model(
-        name="test-adapter-v1",
-        description="A test LoRA adapter",
-        workspace_id=test_workspace.id,
-        training_job_id=None,  # Can be null
-        adapter_path="/data/models/test-adapter",
-        base_model="mistralai/Mistral-7B-v0.1",
-        metrics={"loss": 0.5, "eval_loss": 0.6},
-        is_active=True
-    )
-    db.add(model)
-    db.commit()
-    db.refresh(model)
-    return model
+    return db.get(models.Model, _module_rows["model"])
 
 
-@pytest.fixture
-def auth_headers(test_user) -> Dict[str, str]:
+@pytest.fixture(scope="session")
+def auth_headers(_session_users) -> Dict[str, str]:
     """Get authorization headers for test user."""
-    access_token = create_access_token(
-        data={"sub": str(test_user.id)},
-        expires_delta=timedelta(minutes=30)
-    )
-    return {"Authorization": f"Bearer {access_token}"}
+    return _bearer(_session_users["test"])
 
 
 @pytest.fixture
-def second_user(db) -> models.User:
+def second_user(db, _session_users) -> models.User:
     """Create a second test user (for isolation tests)."""
-    user = models.User(
-        email="other@example.com",
-        username="otheruser",
-        hashed_password=get_password_hash("otherpass123")
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    return db.get(models.User, _session_users["second"])
 
 
-@pytest.fixture
-def second_user_headers(second_user) -> Dict[str, str]:
+@pytest.fixture(scope="session")
+def second_user_headers(_session_users) -> Dict[str, str]:
     """Get authorization headers for second user."""
-    access_token = create_access_token(
-        data={"sub": str(second_user.id)},
-        expires_delta=timedelta(minutes=30)
-    )
-    return {"Authorization": f"Bearer {access_token}"}
+    return _bearer(_session_users["second"])
@@ -0,0 +1,55 @@
+"""
+Response shapes the tests expect, validated in one pass per response.
+
+Kept separate from app.db.schemas so a change to the API's schemas shows
+up as a test failure rather than silently redefining what is expected.
+Extra fields are ignored; only the ones listed here are checked.
+"""
+from typing import Any, Dict, List, Optional, Union
+from pydantic import BaseModel, ConfigDict
+
+
+class _Strict(BaseModel):
+    model_config = ConfigDict(strict=True)
+
+
+class PredictResponse(_Strict):
+    model_id: int
+    prompt: str
+    generated_text: str
+    tokens_used: int
+
+
+class BatchResult(_Strict):
+    prompt: str
+    generated_text: str
+    tokens_used: int
+
+
+class BatchError(_Strict):
+    prompt: str
+    error: str
+
+
+class BatchResponse(_Strict):
+    model_id: int
+    results: List[Union[BatchResult, BatchError]]
+
+
+class DatasetDetail(_Strict):
+    id: int
+    name: str
+    workspace_id: int
+    file_path: str
+    token_count: Optional[int]
+    sample_count: Optional[int]
+
+
+class ModelDetail(_Strict):
+    id: int
+    name: str
+    description: Optional[str]
+    base_model: str
+    adapter_path: str
+    metrics: Optional[Dict[str, Any]]
+    is_active: bool
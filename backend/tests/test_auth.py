@@ -6,9 +6,12 @@ Endpoints tested:
 - POST /api/v1/auth/login
 - GET /api/v1/auth/me
 """
-import pytest
+from datetime import timedelta
 from fastapi.testclient import TestClient
 
+from app.core.security import create_access_token
+from app.db import models
+
 
 class TestRegister:
     """Tests for user registration."""
@@ -73,8 +76,6 @@ class TestRegister:
     
     def test_register_creates_default_workspace(self, client: TestClient, db):
         """Test that registration creates a default workspace."""
-        from app.db import models
-        
         response = client.post(
             "/api/v1/auth/register",
             json={
@@ -197,9 +198,6 @@ class TestGetCurrentUser:
     
     def test_get_me_expired_token(self, client: TestClient, test_user):
         """Test getting current user info with expired token."""
-        from app.core.security import create_access_token
-        from datetime import timedelta
-        
         # Create expired token
         expired_token = create_access_token(
             data={"sub": str(test_user.id)},
@@ -7,22 +7,41 @@ Endpoints tested:
 - GET /api/v1/datasets/
 - DELETE /api/v1/datasets/{dataset_id}
 """
+import json
+import os
+import shutil
+import uuid
 import pytest
 from io import BytesIO
-from fastapi.testclient import TestClient
+from fastapi import HTTPException, UploadFile
+from httpx import AsyncClient
+
+from app.db import models
+from app.services.dataset_service import DatasetService
+from tests.schemas import DatasetDetail
+
+
+# Upload payloads, built once (BytesIO wrappers are still per request)
+_JSONL_ROW = b'{"instruction": "Hello", "input": "", "output": "Hi there!"}\n'
+_JSONL_BYTES = _JSONL_ROW + b'{"instruction": "Bye", "input": "", "output": "Goodbye!"}\n'
+_JSON_BYTES = b'[{"instruction": "Test", "input": "", "output": "Response"}]'
+
+# (headers fixture, use a missing id, expected status) for access checks
+ACCESS_CASES = pytest.mark.parametrize(
+    "headers_fixture,missing,expected",
+    [("auth_headers", True, 404), (None, False, 401), ("second_user_headers", False, 404)],
+    ids=["not_found", "unauthorized", "wrong_user"],
+)
 
 
 class TestUploadDataset:
     """Tests for dataset upload."""
     
-    def test_upload_dataset_jsonl(self, client: TestClient, test_workspace, auth_headers):
+    async def test_upload_dataset_jsonl(self, async_client: AsyncClient, test_workspace, auth_headers):
         """Test uploading a JSONL dataset."""
-        content = b'{"instruction": "Hello", "input": "", "output": "Hi there!"}\n'
-        content += b'{"instruction": "Bye", "input": "", "output": "Goodbye!"}\n'
-        
-        response = client.post(
+        response = await async_client.post(
             f"/api/v1/datasets/upload?workspace_id={test_workspace.id}",
-            files={"file": ("train.jsonl", BytesIO(content), "application/jsonl")},
+            files={"file": ("train.jsonl", BytesIO(_JSONL_BYTES), "application/jsonl")},
             headers=auth_headers
         )
         
@@ -32,105 +51,146 @@ class TestUploadDataset:
         assert "id" in data
         assert data["status"] in ["processing", "ready"]
     
-    def test_upload_dataset_json(self, client: TestClient, test_workspace, auth_headers):
+    async def test_upload_dataset_json(self, async_client: AsyncClient, test_workspace, auth_headers):
         """Test uploading a JSON dataset."""
-        content = b'[{"instruction": "Test", "input": "", "output": "Response"}]'
+        response = await async_client.post(
+            f"/api/v1/datasets/upload?workspace_id={test_workspace.id}",
+            files={"file": ("train.json", BytesIO(_JSON_BYTES), "application/json")},
+            headers=auth_headers
+        )
         
-        response = client.post(
+        assert response.status_code == 200
+    
+    async def test_upload_dataset_updates_workspace_stats(self, async_client: AsyncClient, db, test_workspace, auth_headers):
+        """Test upload and delete keep the cached workspace stats current."""
+        response = await async_client.post(
             f"/api/v1/datasets/upload?workspace_id={test_workspace.id}",
-            files={"file": ("train.json", BytesIO(content), "application/json")},
+            files={"file": (f"stats_{uuid.uuid4().hex}.jsonl", BytesIO(_JSONL_ROW), "application/jsonl")},
             headers=auth_headers
         )
+        assert response.status_code == 200
+        
+        db.refresh(test_workspace)
+        assert test_workspace.total_size_bytes == len(_JSONL_ROW)
+        assert test_workspace.file_count == 1
         
+        response = await async_client.delete(
+            f"/api/v1/datasets/{response.json()['id']}",
+            headers=auth_headers
+        )
         assert response.status_code == 200
+        
+        db.refresh(test_workspace)
+        assert test_workspace.total_size_bytes == 0
+        assert test_workspace.file_count == 0
     
-    def test_upload_dataset_unauthorized(self, client: TestClient, test_workspace):
-        """Test uploading dataset without authentication."""
-        content = b'{"instruction": "Test", "input": "", "output": "Response"}\n'
+    async def test_upload_dataset_too_large(self, async_client: AsyncClient, test_workspace, auth_headers, monkeypatch):
+        """Test oversize uploads are rejected with 413."""
+        monkeypatch.setattr(DatasetService, "MAX_FILE_SIZE", 16)
         
-        response = client.post(
+        response = await async_client.post(
             f"/api/v1/datasets/upload?workspace_id={test_workspace.id}",
-            files={"file": ("train.jsonl", BytesIO(content), "application/jsonl")}
+            files={"file": ("too_large.jsonl", BytesIO(_JSONL_ROW), "application/jsonl")},
+            headers=auth_headers
         )
         
-        assert response.status_code == 401
+        assert response.status_code == 413
     
-    def test_upload_dataset_wrong_workspace(self, client: TestClient, test_workspace, second_user_headers):
-        """Test uploading to another user's workspace fails."""
-        content = b'{"instruction": "Test", "input": "", "output": "Response"}\n'
+    async def test_upload_dataset_recreates_removed_dirs(self, async_client: AsyncClient, db, test_workspace, auth_headers):
+        """Test uploads still work after the workspace dirs were removed externally."""
+        response = await async_client.post(
+            f"/api/v1/datasets/upload?workspace_id={test_workspace.id}",
+            files={"file": ("train.jsonl", BytesIO(_JSONL_ROW), "application/jsonl")},
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        shutil.rmtree(os.path.dirname(db.get(models.Dataset, response.json()["id"]).file_path))
         
-        response = client.post(
+        response = await async_client.post(
             f"/api/v1/datasets/upload?workspace_id={test_workspace.id}",
-            files={"file": ("train.jsonl", BytesIO(content), "application/jsonl")},
-            headers=second_user_headers
+            files={"file": ("train.jsonl", BytesIO(_JSONL_ROW), "application/jsonl")},
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+    
+    async def test_upload_dataset_too_large_keeps_existing_file(self, async_client: AsyncClient, db, test_workspace, auth_headers, monkeypatch):
+        """Test a rejected re-upload leaves the existing file and stats alone."""
+        filename = f"keep_{uuid.uuid4().hex}.jsonl"
+        response = await async_client.post(
+            f"/api/v1/datasets/upload?workspace_id={test_workspace.id}",
+            files={"file": (filename, BytesIO(_JSONL_ROW), "application/jsonl")},
+            headers=auth_headers
         )
+        assert response.status_code == 200
+        file_path = db.get(models.Dataset, response.json()["id"]).file_path
         
-        assert response.status_code == 404
-        assert "workspace" in response.json()["detail"].lower()
+        # No declared size, so only the streaming copy can catch it
+        monkeypatch.setattr(DatasetService, "MAX_FILE_SIZE", len(_JSONL_ROW))
+        upload = UploadFile(file=BytesIO(_JSONL_BYTES), filename=filename)
+        with pytest.raises(HTTPException) as exc_info:
+            await DatasetService(db).upload_dataset(upload, test_workspace.id)
+        assert exc_info.value.status_code == 413
+        
+        with open(file_path, "rb") as f:
+            assert f.read() == _JSONL_ROW
+        assert not [name for name in os.listdir(os.path.dirname(file_path)) if name.startswith(".upload_")]
+        db.refresh(test_workspace)
+        assert test_workspace.total_size_bytes == len(_JSONL_ROW)
+        assert test_workspace.file_count == 1
     
-    def test_upload_dataset_nonexistent_workspace(self, client: TestClient, auth_headers):
-        """Test uploading to non-existent workspace."""
-        content = b'{"instruction": "Test", "input": "", "output": "Response"}\n'
+    @ACCESS_CASES
+    async def test_upload_dataset_access(self, request, async_client: AsyncClient, test_workspace, headers_fixture, missing, expected):
+        """Test uploading without auth, to another user's workspace, or to a missing one."""
+        headers = request.getfixturevalue(headers_fixture) if headers_fixture else {}
+        workspace_id = 99999 if missing else test_workspace.id
         
-        response = client.post(
-            "/api/v1/datasets/upload?workspace_id=99999",
-            files={"file": ("train.jsonl", BytesIO(content), "application/jsonl")},
-            headers=auth_headers
+        response = await async_client.post(
+            f"/api/v1/datasets/upload?workspace_id={workspace_id}",
+            files={"file": ("train.jsonl", BytesIO(_JSONL_ROW), "application/jsonl")},
+            headers=headers
         )
         
-        assert response.status_code == 404
+        assert response.status_code == expected
+        if expected == 404:
+            assert "workspace" in response.json()["detail"].lower()
 
 
 class TestGetDataset:
     """Tests for getting dataset details."""
     
-    def test_get_dataset_success(self, client: TestClient, test_dataset, auth_headers):
+    async def test_get_dataset_success(self, async_client: AsyncClient, test_dataset, auth_headers):
         """Test getting dataset details."""
-        response = client.get(
+        response = await async_client.get(
             f"/api/v1/datasets/{test_dataset.id}",
             headers=auth_headers
         )
         
         assert response.status_code == 200
-        data = response.json()
-        assert data["id"] == test_dataset.id
-        assert data["name"] == test_dataset.name
-        assert data["workspace_id"] == test_dataset.workspace_id
-        assert "file_path" in data
-        assert "token_count" in data
-        assert "sample_count" in data
-    
-    def test_get_dataset_not_found(self, client: TestClient, auth_headers):
-        """Test getting non-existent dataset."""
-        response = client.get(
-            "/api/v1/datasets/99999",
-            headers=auth_headers
-        )
-        
-        assert response.status_code == 404
+        data = DatasetDetail.model_validate(response.json())
+        assert data.id == test_dataset.id
+        assert data.name == test_dataset.name
+        assert data.workspace_id == test_dataset.workspace_id
     
-    def test_get_dataset_unauthorized(self, client: TestClient, test_dataset):
-        """Test getting dataset without authentication."""
-        response = client.get(f"/api/v1/datasets/{test_dataset.id}")
+    @ACCESS_CASES
+    async def test_get_dataset_access(self, request, async_client: AsyncClient, test_dataset, headers_fixture, missing, expected):
+        """Test getting a missing dataset, without auth, or another user's."""
+        headers = request.getfixturevalue(headers_fixture) if headers_fixture else {}
+        dataset_id = 99999 if missing else test_dataset.id
         
-        assert response.status_code == 401
-    
-    def test_get_dataset_wrong_user(self, client: TestClient, test_dataset, second_user_headers):
-        """Test getting another user's dataset fails."""
-        response = client.get(
-            f"/api/v1/datasets/{test_dataset.id}",
-            headers=second_user_headers
+        response = await async_client.get(
+            f"/api/v1/datasets/{dataset_id}",
+            headers=headers
         )
         
-        assert response.status_code == 404
+        assert response.status_code == expected
 
 
 class TestListDatasets:
     """Tests for listing datasets."""
     
-    def test_list_datasets_success(self, client: TestClient, test_workspace, test_dataset, auth_headers):
+    async def test_list_datasets_success(self, async_client: AsyncClient, test_workspace, test_dataset, auth_headers):
         """Test listing datasets in workspace."""
-        response = client.get(
+        response = await async_client.get(
             f"/api/v1/datasets/?workspace_id={test_workspace.id}",
             headers=auth_headers
         )
@@ -141,10 +201,8 @@ class TestListDatasets:
         assert len(data) >= 1
         assert any(d["id"] == test_dataset.id for d in data)
     
-    def test_list_datasets_empty(self, client: TestClient, db, test_user, auth_headers):
+    async def test_list_datasets_empty(self, async_client: AsyncClient, db, test_user, auth_headers):
         """Test listing datasets in empty workspace."""
-        from app.db import models
-        
         # Create empty workspace
         empty_workspace = models.Workspace(
             name="Empty Workspace",
@@ -153,7 +211,7 @@ class TestListDatasets:
         db.add(empty_workspace)
         db.commit()
         
-        response = client.get(
+        response = await async_client.get(
             f"/api/v1/datasets/?workspace_id={empty_workspace.id}",
             headers=auth_headers
         )
@@ -161,9 +219,9 @@ class TestListDatasets:
         assert response.status_code == 200
         assert response.json() == []
     
-    def test_list_datasets_wrong_workspace(self, client: TestClient, test_workspace, second_user_headers):
+    async def test_list_datasets_wrong_workspace(self, async_client: AsyncClient, test_workspace, second_user_headers):
         """Test listing datasets in another user's workspace fails."""
-        response = client.get(
+        response = await async_client.get(
             f"/api/v1/datasets/?workspace_id={test_workspace.id}",
             headers=second_user_headers
         )
@@ -174,11 +232,11 @@ class TestListDatasets:
 class TestDeleteDataset:
     """Tests for deleting datasets."""
     
-    def test_delete_dataset_success(self, client: TestClient, test_dataset, auth_headers, db):
+    async def test_delete_dataset_success(self, async_client: AsyncClient, test_dataset, auth_headers, db):
         """Test deleting a dataset."""
         dataset_id = test_dataset.id
         
-        response = client.delete(
+        response = await async_client.delete(
             f"/api/v1/datasets/{dataset_id}",
             headers=auth_headers
         )
@@ -186,26 +244,50 @@ class TestDeleteDataset:
         assert response.status_code == 200
         
         # Verify dataset is deleted
-        from app.db import models
-        deleted = db.query(models.Dataset).filter(
-            models.Dataset.id == dataset_id
-        ).first()
+        # The fixture's row is still in db's identity map; bypass it
+        deleted = db.get(models.Dataset, dataset_id, populate_existing=True)
         assert deleted is None
     
-    def test_delete_dataset_not_found(self, client: TestClient, auth_headers):
+    async def test_delete_dataset_not_found(self, async_client: AsyncClient, auth_headers):
         """Test deleting non-existent dataset."""
-        response = client.delete(
+        response = await async_client.delete(
             "/api/v1/datasets/99999",
             headers=auth_headers
         )
         
         assert response.status_code == 404
     
-    def test_delete_dataset_wrong_user(self, client: TestClient, test_dataset, second_user_headers):
+    async def test_delete_dataset_wrong_user(self, async_client: AsyncClient, test_dataset, second_user_headers):
         """Test deleting another user's dataset fails."""
-        response = client.delete(
+        response = await async_client.delete(
             f"/api/v1/datasets/{test_dataset.id}",
             headers=second_user_headers
         )
         
         assert response.status_code == 404
+
+
+class TestDatasetSamples:
+    """Tests for reading sample entries from dataset files."""
+    
+    def test_samples_json_stops_at_limit(self, db, tmp_path):
+        """Test JSON samples are read incrementally up to the limit."""
+        rows = [{"instruction": f"Q{i}", "input": "", "output": f"A{i}"} for i in range(50)]
+        path = tmp_path / "train.json"
+        # Trailing garbage proves the reader never parses past the limit
+        path.write_text(json.dumps(rows, indent=2)[:-1] + ', {"broken": ')
+        
+        dataset = models.Dataset(name="train.json", file_path=str(path), format="json")
+        samples = DatasetService(db).get_dataset_samples(dataset, limit=3)
+        
+        assert samples == rows[:3]
+    
+    def test_samples_jsonl(self, db, tmp_path):
+        """Test JSONL samples return the first lines."""
+        path = tmp_path / "train.jsonl"
+        path.write_text('{"instruction": "Q0"}\n{"instruction": "Q1"}\n{"instruction": "Q2"}\n')
+        
+        dataset = models.Dataset(name="train.jsonl", file_path=str(path), format="jsonl")
+        samples = DatasetService(db).get_dataset_samples(dataset, limit=2)
+        
+        assert [s["instruction"] for s in samples] == ["Q0", "Q1"]
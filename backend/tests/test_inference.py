@@ -6,24 +6,36 @@ Endpoints tested:
 - POST /api/v1/inference/batch
 """
 import pytest
-from unittest.mock import patch, AsyncMock
-from fastapi.testclient import TestClient
+from collections import OrderedDict
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from httpx import AsyncClient
+
+from app.services import inference_service
+from app.services.inference_service import InferenceService, _QAIndex
+from tests.schemas import BatchError, BatchResponse, BatchResult, PredictResponse
+
+
+# (headers fixture, use a missing id, expected status) for access checks
+ACCESS_CASES = pytest.mark.parametrize(
+    "headers_fixture,missing,expected",
+    [("auth_headers", True, 404), (None, False, 401), ("second_user_headers", False, 404)],
+    ids=["not_found", "unauthorized", "wrong_user"],
+)
 
 
 class TestPredict:
     """Tests for single prediction endpoint."""
     
-    @patch('app.api.inference.InferenceService')
-    def test_predict_success(self, mock_service, client: TestClient, test_model, auth_headers):
+    async def test_predict_success(self, mock_inference_service, async_client: AsyncClient, test_model, auth_headers):
         """Test successful prediction."""
         # Mock the inference service
-        mock_instance = mock_service.return_value
-        mock_instance.generate = AsyncMock(return_value={
+        mock_inference_service.generate = AsyncMock(return_value={
             "generated_text": "Hello! How can I help you today?",
             "tokens_used": 42
         })
         
-        response = client.post(
+        response = await async_client.post(
             "/api/v1/inference/predict",
             json={
                 "model_id": test_model.id,
@@ -35,91 +47,64 @@ class TestPredict:
         )
         
         assert response.status_code == 200
-        data = response.json()
-        assert data["model_id"] == test_model.id
-        assert data["prompt"] == "Hello, how are you?"
-        assert "generated_text" in data
-        assert "tokens_used" in data
-    
-    def test_predict_model_not_found(self, client: TestClient, auth_headers):
-        """Test prediction with non-existent model."""
-        response = client.post(
+        data = PredictResponse.model_validate(response.json())
+        assert data.model_id == test_model.id
+        assert data.prompt == "Hello, how are you?"
+    
+    @ACCESS_CASES
+    async def test_predict_access(self, request, async_client: AsyncClient, test_model, headers_fixture, missing, expected):
+        """Test prediction with a missing model, without auth, or another user's model."""
+        headers = request.getfixturevalue(headers_fixture) if headers_fixture else {}
+        
+        response = await async_client.post(
             "/api/v1/inference/predict",
             json={
-                "model_id": 99999,
+                "model_id": 99999 if missing else test_model.id,
                 "prompt": "Hello"
             },
-            headers=auth_headers
+            headers=headers
         )
         
-        assert response.status_code == 404
-        assert "model" in response.json()["detail"].lower()
+        assert response.status_code == expected
+        if expected == 404:
+            assert "model" in response.json()["detail"].lower()
     
-    def test_predict_unauthorized(self, client: TestClient, test_model):
-        """Test prediction without authentication."""
-        response = client.post(
+    async def test_predict_missing_prompt(self, async_client: AsyncClient, test_model, auth_headers):
+        """Test prediction with missing prompt."""
+        response = await async_client.post(
             "/api/v1/inference/predict",
-            json={
-                "model_id": test_model.id,
-                "prompt": "Hello"
-            }
+            json={"model_id": test_model.id},
+            headers=auth_headers
         )
         
-        assert response.status_code == 401
+        assert response.status_code == 422
     
-    def test_predict_wrong_user(self, client: TestClient, test_model, second_user_headers):
-        """Test prediction with another user's model fails."""
-        response = client.post(
+    async def test_predict_with_all_params(self, mock_inference_service, async_client: AsyncClient, test_model, auth_headers):
+        """Test prediction with all optional parameters."""
+        mock_inference_service.generate = AsyncMock(return_value={
+            "generated_text": "Response",
+            "tokens_used": 10
+        })
+        
+        response = await async_client.post(
             "/api/v1/inference/predict",
             json={
                 "model_id": test_model.id,
-                "prompt": "Hello"
+                "prompt": "Test prompt",
+                "max_tokens": 512,
+                "temperature": 0.5,
+                "top_p": 0.85
             },
-            headers=second_user_headers
-        )
-        
-        assert response.status_code == 404
-    
-    def test_predict_missing_prompt(self, client: TestClient, test_model, auth_headers):
-        """Test prediction with missing prompt."""
-        response = client.post(
-            "/api/v1/inference/predict",
-            json={"model_id": test_model.id},
             headers=auth_headers
         )
         
-        assert response.status_code == 422
+        assert response.status_code == 200
     
-    def test_predict_with_all_params(self, client: TestClient, test_model, auth_headers):
-        """Test prediction with all optional parameters."""
-        with patch('app.api.inference.InferenceService') as mock_service:
-            mock_instance = mock_service.return_value
-            mock_instance.generate = AsyncMock(return_value={
-                "generated_text": "Response",
-                "tokens_used": 10
-            })
-            
-            response = client.post(
-                "/api/v1/inference/predict",
-                json={
-                    "model_id": test_model.id,
-                    "prompt": "Test prompt",
-                    "max_tokens": 512,
-                    "temperature": 0.5,
-                    "top_p": 0.85
-                },
-                headers=auth_headers
-            )
-            
-            assert response.status_code == 200
-    
-    @patch('app.api.inference.InferenceService')
-    def test_predict_service_error(self, mock_service, client: TestClient, test_model, auth_headers):
+    async def test_predict_service_error(self, mock_inference_service, async_client: AsyncClient, test_model, auth_headers):
         """Test prediction when inference service fails."""
-        mock_instance = mock_service.return_value
-        mock_instance.generate = AsyncMock(side_effect=Exception("GPU out of memory"))
+        mock_inference_service.generate = AsyncMock(side_effect=Exception("GPU out of memory"))
         
-        response = client.post(
+        response = await async_client.post(
             "/api/v1/inference/predict",
             json={
                 "model_id": test_model.id,
@@ -135,17 +120,15 @@ class TestPredict:
 class TestBatchPredict:
     """Tests for batch prediction endpoint."""
     
-    @patch('app.api.inference.InferenceService')
-    def test_batch_predict_success(self, mock_service, client: TestClient, test_model, auth_headers):
+    async def test_batch_predict_success(self, mock_inference_service, async_client: AsyncClient, test_model, auth_headers):
         """Test successful batch prediction."""
-        mock_instance = mock_service.return_value
-        mock_instance.generate = AsyncMock(side_effect=[
+        mock_inference_service.generate_batch = AsyncMock(return_value=[
             {"generated_text": "Response 1", "tokens_used": 10},
             {"generated_text": "Response 2", "tokens_used": 15},
             {"generated_text": "Response 3", "tokens_used": 12}
         ])
         
-        response = client.post(
+        response = await async_client.post(
             "/api/v1/inference/batch",
             json={
                 "model_id": test_model.id,
@@ -157,80 +140,54 @@ class TestBatchPredict:
         )
         
         assert response.status_code == 200
-        data = response.json()
-        assert data["model_id"] == test_model.id
-        assert "results" in data
-        assert len(data["results"]) == 3
+        data = BatchResponse.model_validate(response.json())
+        assert data.model_id == test_model.id
+        assert len(data.results) == 3
+        assert all(isinstance(r, BatchResult) for r in data.results)
+        mock_inference_service.generate_batch.assert_awaited_once()
     
-    def test_batch_predict_model_not_found(self, client: TestClient, auth_headers):
-        """Test batch prediction with non-existent model."""
-        response = client.post(
+    @ACCESS_CASES
+    async def test_batch_predict_access(self, request, async_client: AsyncClient, test_model, headers_fixture, missing, expected):
+        """Test batch prediction with a missing model, without auth, or another user's model."""
+        headers = request.getfixturevalue(headers_fixture) if headers_fixture else {}
+        
+        response = await async_client.post(
             "/api/v1/inference/batch",
             json={
-                "model_id": 99999,
+                "model_id": 99999 if missing else test_model.id,
                 "prompts": ["Hello", "World"]
             },
-            headers=auth_headers
-        )
-        
-        assert response.status_code == 404
-    
-    def test_batch_predict_unauthorized(self, client: TestClient, test_model):
-        """Test batch prediction without authentication."""
-        response = client.post(
-            "/api/v1/inference/batch",
-            json={
-                "model_id": test_model.id,
-                "prompts": ["Hello"]
-            }
+            headers=headers
         )
         
-        assert response.status_code == 401
+        assert response.status_code == expected
     
-    def test_batch_predict_wrong_user(self, client: TestClient, test_model, second_user_headers):
-        """Test batch prediction with another user's model fails."""
-        response = client.post(
+    async def test_batch_predict_empty_prompts(self, mock_inference_service, async_client: AsyncClient, test_model, auth_headers):
+        """Test batch prediction with empty prompts list."""
+        response = await async_client.post(
             "/api/v1/inference/batch",
             json={
                 "model_id": test_model.id,
-                "prompts": ["Hello"]
+                "prompts": []
             },
-            headers=second_user_headers
+            headers=auth_headers
         )
         
-        assert response.status_code == 404
+        assert response.status_code == 200
+        data = response.json()
+        assert data["results"] == []
+        mock_inference_service.generate_batch.assert_not_called()
     
-    def test_batch_predict_empty_prompts(self, client: TestClient, test_model, auth_headers):
-        """Test batch prediction with empty prompts list."""
-        with patch('app.api.inference.InferenceService') as mock_service:
-            mock_instance = mock_service.return_value
-            
-            response = client.post(
-                "/api/v1/inference/batch",
-                json={
-                    "model_id": test_model.id,
-                    "prompts": []
-                },
-                headers=auth_headers
-            )
-            
-            assert response.status_code == 200
-            data = response.json()
-            assert data["results"] == []
-    
-    @patch('app.api.inference.InferenceService')
-    def test_batch_predict_partial_failure(self, mock_service, client: TestClient, test_model, auth_headers):
+    async def test_batch_predict_partial_failure(self, mock_inference_service, async_client: AsyncClient, test_model, auth_headers):
         """Test batch prediction where some prompts fail."""
-        mock_instance = mock_service.return_value
-        
-        # First call succeeds, second fails, third succeeds
-        mock_instance.generate = AsyncMock(side_effect=[
+        # First prompt succeeds, second fails, third succeeds
+        mock_inference_service.generate_batch = AsyncMock(return_value=[
             {"generated_text": "Response 1", "tokens_used": 10},
-            Exception("Token limit exceeded"),
+            {"error": "Token limit exceeded"},
             {"generated_text": "Response 3", "tokens_used": 12}
         ])
         
-        response = client.post(
+        response = await async_client.post(
             "/api/v1/inference/batch",
             json={
                 "model_id": test_model.id,
@@ -240,7 +197,90 @@ class TestBatchPredict:
         )
         
         assert response.status_code == 200
-        data = response.json()
-        assert len(data["results"]) == 3
+        data = BatchResponse.model_validate(response.json())
+        assert len(data.results) == 3
         # Check that error is captured for failed prompt
-        assert any("error" in r for r in data["results"])
+        assert [type(r) for r in data.results] == [BatchResult, BatchError, BatchResult]
+        assert data.results[1].prompt == "Very long prompt..."
+    
+    async def test_batch_predict_batch_failure(self, mock_inference_service, async_client: AsyncClient, test_model, auth_headers):
+        """Test batch prediction where the whole batched call fails."""
+        mock_inference_service.generate_batch = AsyncMock(side_effect=Exception("GPU out of memory"))
+        
+        response = await async_client.post(
+            "/api/v1/inference/batch",
+            json={
+                "model_id": test_model.id,
+                "prompts": ["Prompt 1", "Prompt 2"]
+            },
+            headers=auth_headers
+        )
+        
+        assert response.status_code == 200
+        data = BatchResponse.model_validate(response.json())
+        assert len(data.results) == 2
+        assert all(isinstance(r, BatchError) for r in data.results)
+
+
+class TestDemoMatching:
+    """Tests for demo-mode matching of prompts against training data."""
+    
+    def test_qa_index_matches_in_file_order(self, tmp_path):
+        """Test word-overlap and substring matches pick the first row."""
+        path = tmp_path / "train.jsonl"
+        path.write_text(
+            '{"instruction": "What is the capital of France?", "output": "Paris"}\n'
+            'not json\n'
+            '{"instruction": "Capital city of France", "output": "Also Paris"}\n'
+            '{"instruction": "What color is the sky?", "output": "Blue"}\n'
+        )
+        index = _QAIndex(str(path))
+        
+        assert index.match("tell me the capital of france") == "Paris"
+        assert index.match("what color is the sky? answer briefly") == "Blue"
+        assert index.match("hello there") is None
+
+
+class _FakePeftModel:
+    """Tracks adapters the way PeftModel's load/delete/set calls would."""
+    
+    def __init__(self, adapter_name):
+        self.adapters = [adapter_name]
+    
+    @classmethod
+    def from_pretrained(cls, base_model, adapter_path, adapter_name):
+        return cls(adapter_name)
+    
+    def load_adapter(self, adapter_path, adapter_name):
+        self.adapters.append(adapter_name)
+    
+    def delete_adapter(self, adapter_name):
+        self.adapters.remove(adapter_name)
+    
+    def set_adapter(self, adapter_name):
+        assert adapter_name in self.adapters
+    
+    def eval(self):
+        pass
+
+
+class TestAdapterCache:
+    """Tests for the per-base-model adapter LRU."""
+    
+    def test_least_recently_used_adapter_is_deleted(self, monkeypatch):
+        """Serving a new adapter over the cap deletes the least recently used one."""
+        loader = SimpleNamespace(load_base_model=lambda name, use_cache: ("base", "tokenizer"))
+        predictor = lambda model, tokenizer: SimpleNamespace(model=model)
+        monkeypatch.setattr(inference_service, "_ml_backend", lambda: (lambda: loader, predictor, _FakePeftModel))
+        monkeypatch.setattr(InferenceService, "_model_cache", OrderedDict())
+        monkeypatch.setattr(InferenceService, "_adapter_cache", {})
+        monkeypatch.setattr(InferenceService, "MAX_ADAPTERS_PER_BASE", 2)
+        
+        service = InferenceService()
+        served = [
+            service._load_predictor(SimpleNamespace(id=model_id, base_model="base", adapter_path=f"/adapters/{model_id}"))
+            for model_id in (1, 2, 1, 3)
+        ]
+        
+        assert served[-1].model.adapters == ["model_1", "model_3"]
+        assert list(InferenceService._adapter_cache["base"]) == [1, 3]
@@ -8,6 +8,17 @@ Tests:
 """
 import pytest
 from datetime import timedelta
+from jose import jwt, ExpiredSignatureError
+from jose.exceptions import JWTClaimsError
+
+from app.config import settings
+from app.core.security import (
+    create_access_token,
+    get_password_hash,
+    verify_and_require,
+    verify_password,
+)
+from app.db import models
 
 
 class TestPasswordSecurity:
@@ -15,8 +26,6 @@ class TestPasswordSecurity:
     
     def test_hash_password(self):
         """Test password hashing."""
-        from app.core.security import get_password_hash
-        
         password = "mysecretpassword"
         hashed = get_password_hash(password)
         
@@ -27,8 +36,6 @@ class TestPasswordSecurity:
     
     def test_verify_password_correct(self):
         """Test password verification with correct password."""
-        from app.core.security import get_password_hash, verify_password
-        
         password = "mysecretpassword"
         hashed = get_password_hash(password)
         
@@ -36,8 +43,6 @@ class TestPasswordSecurity:
     
     def test_verify_password_incorrect(self):
         """Test password verification with incorrect password."""
-        from app.core.security import get_password_hash, verify_password
-        
         password = "mysecretpassword"
         hashed = get_password_hash(password)
         
@@ -45,8 +50,6 @@ class TestPasswordSecurity:
     
     def test_hash_is_unique(self):
         """Test that same password produces different hashes (due to salt)."""
-        from app.core.security import get_password_hash
-        
         password = "samepassword"
         hash1 = get_password_hash(password)
         hash2 = get_password_hash(password)
@@ -59,8 +62,6 @@ class TestJWTTokens:
     
     def test_create_access_token(self):
         """Test JWT token creation."""
-        from app.core.security import create_access_token
-        
         token = create_access_token(
             data={"sub": "123"},
             expires_delta=timedelta(minutes=30)
@@ -74,39 +75,27 @@ class TestJWTTokens:
     
     def test_token_contains_user_id(self):
         """Test that token payload contains user ID."""
-        from app.core.security import create_access_token
-        from jose import jwt
-        from app.config import settings
-        
         user_id = "456"
         token = create_access_token(
             data={"sub": user_id},
             expires_delta=timedelta(minutes=30)
         )
         
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = verify_and_require(token)
         assert payload["sub"] == user_id
     
     def test_token_has_expiration(self):
         """Test that token has expiration claim."""
-        from app.core.security import create_access_token
-        from jose import jwt
-        from app.config import settings
-        
         token = create_access_token(
             data={"sub": "123"},
             expires_delta=timedelta(minutes=30)
         )
         
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = verify_and_require(token)
         assert "exp" in payload
     
     def test_expired_token_raises(self):
         """Test that expired token raises exception."""
-        from app.core.security import create_access_token
-        from jose import jwt, ExpiredSignatureError
-        from app.config import settings
-        
         # Create token that's already expired
         token = create_access_token(
             data={"sub": "123"},
@@ -115,6 +104,16 @@ class TestJWTTokens:
         
         with pytest.raises(ExpiredSignatureError):
             jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    
+    def test_token_missing_required_claim(self):
+        """Test that a valid token without a required claim is rejected."""
+        token = create_access_token(
+            data={"role": "admin"},
+            expires_delta=timedelta(minutes=30)
+        )
+        
+        with pytest.raises(JWTClaimsError):
+            verify_and_require(token)
 
 
 class TestMultiTenantIsolation:
@@ -191,8 +190,6 @@ class TestMultiTenantIsolation:
         self, client, db, test_user, test_workspace, test_dataset, second_user, auth_headers, second_user_headers
     ):
         """Test that each user only sees their own data."""
-        from app.db import models
-        
         # Create workspace and dataset for second user
         second_workspace = models.Workspace(
             name="Second User Workspace",
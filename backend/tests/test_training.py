@@ -7,10 +7,17 @@ Endpoints tested:
 - GET /api/v1/training/
 - POST /api/v1/training/{job_id}/cancel
 """
+import inspect
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import patch
 import pytest
-from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 
+from app.db import models
+from app.services import training_service
+
 
 class TestStartTraining:
     """Tests for starting training jobs."""
@@ -177,8 +184,6 @@ class TestListTrainingJobs:
     
     def test_list_training_jobs_empty(self, client: TestClient, db, test_user, auth_headers):
         """Test listing training jobs in workspace with no jobs."""
-        from app.db import models
-        
         # Create empty workspace
         empty_workspace = models.Workspace(
             name="Empty Workspace",
@@ -197,9 +202,6 @@ class TestListTrainingJobs:
     
     def test_list_training_jobs_ordered_by_date(self, client: TestClient, db, test_workspace, test_dataset, auth_headers):
         """Test that training jobs are ordered by created_at desc."""
-        from app.db import models
-        from datetime import datetime, timedelta
-        
         # Create multiple jobs
         job1 = models.TrainingJob(
             workspace_id=test_workspace.id,
@@ -264,3 +266,55 @@ class TestCancelTrainingJob:
         )
         
         assert response.status_code == 404
+
+
+class TestEnqueue:
+    """Tests for publishing training tasks to the broker."""
+    
+    def test_enqueue_failure_fails_job(self):
+        """A job whose task can't be published is marked failed, not left pending."""
+        class UnreachableBroker:
+            def apply_async(self, args, task_id=None):
+                raise ConnectionError("broker unreachable")
+        
+        with patch.object(training_service.TrainingService, "fail_job") as mock_fail:
+            future = training_service.enqueue(UnreachableBroker(), 42, task_id="task-id")
+            with pytest.raises(ConnectionError):
+                future.result()
+            # The done callback may still be running on the pool thread
+            training_service._enqueue_pool.submit(lambda: None).result()
+        
+        mock_fail.assert_called_once()
+        job_id, message = mock_fail.call_args.args
+        assert job_id == 42
+        assert "broker unreachable" in message
+
+
+@pytest.fixture
+def worker_tasks_module(monkeypatch):
+    """workers.tasks, unloaded again afterwards so the app keeps running without Celery."""
+    pytest.importorskip("celery")
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from workers import tasks
+    yield tasks
+    for name in [name for name in sys.modules if name == "workers" or name.startswith("workers.")]:
+        del sys.modules[name]
+
+
+class TestTrainingJobRetry:
+    """Tests for the OOM retry of the Celery training task."""
+    
+    def test_oom_retry_signature_binds(self, worker_tasks_module):
+        """The retried call must bind to run_training_job's parameters."""
+        from celery.app.task import Context
+        
+        task = worker_tasks_module.run_training_job
+        # As sent by enqueue(): positional job id, no kwargs
+        request = Context(id="task-id", args=[7], kwargs={}, retries=0, delivery_info={})
+        
+        signature = task.signature_from_request(
+            request, **worker_tasks_module.oom_retry_call(7, 8)
+        )
+        bound = inspect.signature(task.run).bind(*signature.args, **signature.kwargs)
+        
+        assert bound.arguments == {"job_id": 7, "gradient_accumulation_steps": 8}
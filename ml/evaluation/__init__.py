@@ -4,6 +4,7 @@ from ml.evaluation.metrics import (
     calculate_bleu,
     calculate_rouge,
     calculate_rouge_l,
+    calculate_rouge_l_scores,
     calculate_exact_match
 )
 from ml.evaluation.evaluator import Evaluator
@@ -13,6 +14,7 @@ __all__ = [
     "calculate_bleu",
     "calculate_rouge",
     "calculate_rouge_l",
+    "calculate_rouge_l_scores",
     "calculate_exact_match",
     "Evaluator"
 ]
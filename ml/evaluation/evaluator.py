@@ -3,15 +3,19 @@ Evaluator for trained models.
 Runs evaluation on test sets and generates metrics.
 """
 
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+import os
 import torch
 from datasets import Dataset
 from tqdm import tqdm
 
+from ml.inference.model_loader import get_compute_dtype
 from ml.evaluation.metrics import (
     calculate_perplexity,
     calculate_bleu,
     calculate_rouge,
+    calculate_rouge_l_scores,
     calculate_exact_match
 )
 
@@ -32,12 +36,39 @@ class Evaluator:
         model,
         tokenizer,
         max_length: int = 2048,
-        device: Optional[str] = None
+        device: Optional[str] = None,
+        dtype: Optional[torch.dtype] = None,
+        compile: bool = False
     ):
         self.model = model
         self.tokenizer = tokenizer
         self.max_length = max_length
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        
+        if self.device.startswith("cuda"):
+            # Quantized (bitsandbytes) weights can't be cast, and a model
+            # dispatched over several devices must stay where it was placed
+            device_map = getattr(model, "hf_device_map", None) or {}
+            sharded = len(set(device_map.values())) > 1
+            if not getattr(model, "is_quantized", False) and not sharded:
+                # bf16 only where the GPU supports it
+                self.model = model.to(self.device, dtype=dtype or get_compute_dtype())
+            
+            # Compile forward only: generate() drives it once per new token,
+            # and the compiled graph is reused across evaluate() calls. Off
+            # by default: new batch shapes and decode lengths recompile
+            if compile:
+                self.model.forward = torch.compile(
+                    self.model.forward, mode="reduce-overhead", fullgraph=False
+                )
+        
+        # Batched generation pads prompts, so a pad token is required
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
+        
+        # Evaluation only ever generates; reuse past key/values every step
+        self.model.config.use_cache = True
     
     def evaluate(
         self,
@@ -49,7 +80,9 @@ class Evaluator:
         Run evaluation on a dataset.
         
         Args:
-            dataset: HuggingFace Dataset with 'text', 'prompt', 'completion' fields
+            dataset: HuggingFace Dataset with 'prompt' and 'completion' fields
+                (loss is taken on the completion tokens), or 'text' alone;
+                columns added by preprocess() are used instead of re-tokenizing
             batch_size: Batch size for evaluation
             generate_predictions: Whether to generate predictions for BLEU/ROUGE
         
@@ -63,37 +96,30 @@ class Evaluator:
         predictions = []
         references = []
         
-        with torch.no_grad():
-            for i in tqdm(range(0, len(dataset), batch_size), desc="Evaluating"):
-                batch = dataset[i:i + batch_size]
+        # Slice/tokenize/pad the next batch on a CPU thread while the
+        # current one runs on the device
+        with ThreadPoolExecutor(max_workers=1) as prefetch, torch.inference_mode():
+            pending = prefetch.submit(self._load_batch, dataset, 0, batch_size)
+            for start in tqdm(range(0, len(dataset), batch_size), desc="Evaluating"):
+                batch, encodings = pending.result()
+                if start + batch_size < len(dataset):
+                    pending = prefetch.submit(self._load_batch, dataset, start + batch_size, batch_size)
+                
+                if encodings is None:
+                    continue
                 
                 # Calculate loss (perplexity)
-                if "text" in batch:
-                    texts = batch["text"]
-                    encodings = self.tokenizer(
-                        texts,
-                        padding=True,
-                        truncation=True,
-                        max_length=self.max_length,
-                        return_tensors="pt"
-                    ).to(self.device)
-                    
-                    labels = encodings["input_ids"].clone()
-                    labels[encodings["attention_mask"] == 0] = -100
-                    
-                    outputs = self.model(**encodings, labels=labels)
-                    total_loss += outputs.loss.item() * len(texts)
-                    total_samples += len(texts)
+                inputs = self._to_device(
+                    {key: encodings[key] for key in ("input_ids", "attention_mask", "labels")}
+                )
+                outputs = self.model(**inputs)
+                total_loss += outputs.loss.item() * len(inputs["input_ids"])
+                total_samples += len(inputs["input_ids"])
                 
                 # Generate predictions for BLEU/ROUGE
-                if generate_predictions and "prompt" in batch and "completion" in batch:
-                    prompts = batch["prompt"]
-                    completions = batch["completion"]
-                    
-                    for prompt, completion in zip(prompts, completions):
-                        generated = self._generate(prompt)
-                        predictions.append(generated)
-                        references.append(completion)
+                if generate_predictions and "prompt_ids" in encodings:
+                    predictions.extend(self._generate_from_ids(encodings["prompt_ids"]))
+                    references.extend(batch["completion"])
         
         # Calculate metrics
         metrics = {}
@@ -123,28 +149,198 @@ class Evaluator:
         temperature: float = 0.7
     ) -> str:
         """Generate text for a single prompt."""
-        inputs = self.tokenizer(
-            prompt,
-            return_tensors="pt",
+        return self._generate_batch([prompt], max_new_tokens, temperature)[0]
+    
+    def _generate_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int = 128,
+        temperature: float = 0.7
+    ) -> List[str]:
+        """Generate text for a batch of prompts with one generate call."""
+        if not prompts:
+            return []
+        
+        prompt_ids = self.tokenizer(
+            prompts,
             truncation=True,
             max_length=self.max_length
-        ).to(self.device)
+        )["input_ids"]
         
-        with torch.no_grad():
+        return self._generate_from_ids(prompt_ids, max_new_tokens, temperature)
+    
+    def preprocess(
+        self,
+        dataset: Dataset,
+        cache_file_name: Optional[str] = None,
+        num_proc: Optional[int] = None
+    ) -> Dataset:
+        """
+        Tokenize a dataset once, ahead of (repeated) evaluate() calls.
+        
+        Adds `prompt_ids`/`completion_ids` for prompt/completion datasets,
+        else `input_ids` from 'text'. The result is Arrow-backed; pass
+        cache_file_name to reuse it across runs. Rows stay unpadded lists,
+        since each batch is padded to its own longest row.
+        """
+        if "prompt" in dataset.column_names and "completion" in dataset.column_names:
+            tokenize = self._tokenize_pairs
+        else:
+            tokenize = self._tokenize_texts
+        
+        return dataset.map(
+            tokenize,
+            batched=True,
+            batch_size=1000,
+            num_proc=num_proc or max(1, (os.cpu_count() or 2) // 2),
+            cache_file_name=cache_file_name,
+            desc="Tokenizing"
+        )
+    
+    def _tokenize_pairs(self, batch: Dict[str, List[str]]) -> Dict[str, List[List[int]]]:
+        return {
+            "prompt_ids": self.tokenizer(
+                batch["prompt"],
+                truncation=True,
+                max_length=self.max_length
+            )["input_ids"],
+            "completion_ids": self.tokenizer(
+                batch["completion"],
+                add_special_tokens=False
+            )["input_ids"],
+        }
+    
+    def _tokenize_texts(self, batch: Dict[str, List[str]]) -> Dict[str, List[List[int]]]:
+        return {
+            "input_ids": self.tokenizer(
+                batch["text"],
+                truncation=True,
+                max_length=self.max_length
+            )["input_ids"]
+        }
+    
+    def _load_batch(
+        self,
+        dataset: Dataset,
+        start: int,
+        batch_size: int
+    ) -> Tuple[Dict[str, List], Optional[Dict[str, Any]]]:
+        """
+        Slice and encode one batch on the CPU.
+        
+        Prompt/completion pairs go through prepare_encodings; 'text' (or
+        preprocessed 'input_ids') rows get full-sequence labels. Tensors are
+        pinned on CUDA so the copy in evaluate() can be non-blocking.
+        Encodings are None if the batch has none of those columns.
+        """
+        batch = dataset[start:start + batch_size]
+        
+        if "prompt" in batch and "completion" in batch:
+            encodings = self.prepare_encodings(batch)
+        elif "input_ids" in batch or "text" in batch:
+            if "input_ids" not in batch:
+                batch = {**batch, **self._tokenize_texts(batch)}
+            encodings = self._pad(batch["input_ids"], "right")
+            
+            encodings["labels"] = encodings["input_ids"].masked_fill(
+                encodings["attention_mask"] == 0, -100
+            )
+        else:
+            return batch, None
+        
+        if self.device.startswith("cuda"):
+            for key in ("input_ids", "attention_mask", "labels"):
+                encodings[key] = encodings[key].pin_memory()
+        return batch, encodings
+    
+    def prepare_encodings(self, batch: Dict[str, List[str]]) -> Dict[str, Any]:
+        """
+        Tokenize a batch of prompt/completion pairs once.
+        
+        Returns the unpadded `prompt_ids` and `completion_ids`, plus padded
+        `input_ids`/`attention_mask` over prompt + completion and `labels`
+        with the prompt and padding positions masked to -100 (CPU tensors).
+        Ids already in the batch (from preprocess()) are used as-is.
+        """
+        if "prompt_ids" not in batch:
+            batch = {**batch, **self._tokenize_pairs(batch)}
+        prompt_ids = batch["prompt_ids"]
+        completion_ids = batch["completion_ids"]
+        
+        full_ids = [
+            (prompt + completion)[:self.max_length]
+            for prompt, completion in zip(prompt_ids, completion_ids)
+        ]
+        encodings = self._pad(full_ids, "right")
+        
+        # Padding and prompt positions in one mask, applied in one op
+        prompt_lens = torch.tensor([len(prompt) for prompt in prompt_ids])
+        positions = torch.arange(encodings["input_ids"].shape[1])
+        ignore = (encodings["attention_mask"] == 0) | (positions < prompt_lens[:, None])
+        encodings["labels"] = encodings["input_ids"].masked_fill(ignore, -100)
+        
+        encodings["prompt_ids"] = prompt_ids
+        encodings["completion_ids"] = completion_ids
+        return encodings
+    
+    def _pad(self, ids: List[List[int]], side: str) -> Dict[str, torch.Tensor]:
+        """
+        Pad token id lists into CPU tensors.
+        
+        Built by hand rather than with tokenizer.pad: that reads the shared
+        tokenizer.padding_side, and evaluate() pads on its prefetch thread
+        (right) and the main thread (left) at the same time.
+        """
+        longest = max((len(row) for row in ids), default=0)
+        input_ids = torch.full((len(ids), longest), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(ids), longest), dtype=torch.long)
+        
+        for index, row in enumerate(ids):
+            if not row:
+                continue
+            columns = slice(longest - len(row), longest) if side == "left" else slice(0, len(row))
+            input_ids[index, columns] = torch.tensor(row, dtype=torch.long)
+            attention_mask[index, columns] = 1
+        
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+    
+    def _to_device(self, tensors: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Copy tensors to the eval device (asynchronously from pinned memory)."""
+        return {key: value.to(self.device, non_blocking=True) for key, value in tensors.items()}
+    
+    def _generate_from_ids(
+        self,
+        prompt_ids: List[List[int]],
+        max_new_tokens: int = 128,
+        temperature: float = 0.7
+    ) -> List[str]:
+        """Generate from already tokenized prompts."""
+        if not prompt_ids:
+            return []
+        
+        # Left padding so every prompt ends where generation starts
+        inputs = self._to_device(self._pad(prompt_ids, "left"))
+        
+        if temperature > 0:
+            gen_kwargs = {"do_sample": True, "temperature": temperature, "top_p": 0.9}
+        else:
+            # Greedy: no sampling, so no top-p sort on every step
+            gen_kwargs = {"do_sample": False, "num_beams": 1}
+        
+        with torch.inference_mode():
             outputs = self.model.generate(
                 **inputs,
                 max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                do_sample=temperature > 0,
-                top_p=0.9,
-                pad_token_id=self.tokenizer.pad_token_id
+                use_cache=True,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **gen_kwargs
             )
         
         # Decode only the generated part
-        generated_tokens = outputs[0][inputs["input_ids"].shape[1]:]
-        generated_text = self.tokenizer.decode(generated_tokens, skip_special_tokens=True)
+        generated_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        generated_texts = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
         
-        return generated_text.strip()
+        return [text.strip() for text in generated_texts]
     
     def evaluate_samples(
         self,
@@ -156,19 +352,18 @@ class Evaluator:
         
         Returns list of dicts with prompt, expected, generated.
         """
-        results = []
+        samples = samples[:num_samples]
+        prompts = [sample.get("prompt", "") for sample in samples]
+        expected = [sample.get("completion", "") for sample in samples]
+        generated = self._generate_batch(prompts)
+        rouge_l = calculate_rouge_l_scores(generated, expected)
         
-        for sample in samples[:num_samples]:
-            prompt = sample.get("prompt", "")
-            expected = sample.get("completion", "")
-            
-            generated = self._generate(prompt)
-            
-            results.append({
+        return [
+            {
                 "prompt": prompt,
-                "expected": expected,
-                "generated": generated,
-                "rouge_l": calculate_rouge([generated], [expected])["rouge_l"]
-            })
-        
-        return results
+                "expected": exp,
+                "generated": gen,
+                "rouge_l": float(score)
+            }
+            for prompt, exp, gen, score in zip(prompts, expected, generated, rouge_l)
+        ]
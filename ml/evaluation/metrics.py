@@ -3,9 +3,37 @@ Evaluation metrics for LLM fine-tuning.
 """
 
 import math
+import os
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
+import numpy as np
 import torch
-from collections import Counter
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import sacrebleu
+except ImportError:
+    sacrebleu = None
+
+try:
+    from rouge_score import rouge_scorer
+except ImportError:
+    rouge_scorer = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# FAST_METRICS=1 uses sacrebleu / rouge_score when installed. Opt-in, since
+# they are different metrics from the implementations below: canonical
+# tokenization, case-sensitive, a brevity penalty, and empty predictions
+# count, so their scores aren't comparable with stored job metrics.
+FAST_METRICS = os.getenv("FAST_METRICS", "0") == "1"
 
 
 def calculate_perplexity(loss: float) -> float:
@@ -18,6 +46,37 @@ def calculate_perplexity(loss: float) -> float:
     return math.exp(loss)
 
 
+def _ngram_levels(pred_ids: np.ndarray, ref_ids: np.ndarray, max_n: int):
+    """
+    Yield (pred_codes, ref_codes) for n = 1..max_n, one int64 per n-gram.
+    
+    Each level extends the previous one by a token, (code, next id) ->
+    code * vocab + id, then renumbers the codes densely across both sides.
+    Codes stay below len(pred) + len(ref), so they are exact (no hashing,
+    no collisions) and never overflow, however large the vocabulary.
+    """
+    base = int(max(pred_ids.max(initial=0), ref_ids.max(initial=0))) + 1
+    pred_codes = pred_ids.astype(np.int64)
+    ref_codes = ref_ids.astype(np.int64)
+    
+    for n in range(1, max_n + 1):
+        yield pred_codes, ref_codes
+        pred_codes = pred_codes[:-1] * base + pred_ids[n:]
+        ref_codes = ref_codes[:-1] * base + ref_ids[n:]
+        _, dense = np.unique(np.concatenate([pred_codes, ref_codes]), return_inverse=True)
+        pred_codes, ref_codes = dense[:len(pred_codes)], dense[len(pred_codes):]
+
+
+def _clipped_matches(pred_codes: np.ndarray, ref_codes: np.ndarray) -> int:
+    """Sum over distinct predicted n-grams of min(pred count, ref count)."""
+    pred_unique, pred_counts = np.unique(pred_codes, return_counts=True)
+    ref_unique, ref_counts = np.unique(ref_codes, return_counts=True)
+    _, pred_idx, ref_idx = np.intersect1d(
+        pred_unique, ref_unique, assume_unique=True, return_indices=True
+    )
+    return int(np.minimum(pred_counts[pred_idx], ref_counts[ref_idx]).sum())
+
+
 def calculate_bleu(
     predictions: List[str],
     references: List[str],
@@ -26,32 +85,41 @@ def calculate_bleu(
     """
     Calculate BLEU score.
     
-    A simple implementation of BLEU for evaluation.
+    A simple implementation of BLEU for evaluation. Each pair is tokenized
+    once into ids over a shared vocabulary; n-grams are then counted and
+    clipped with vectorized NumPy ops instead of Counters of tuples.
+    
+    With FAST_METRICS=1 and sacrebleu installed, sacrebleu's corpus BLEU
+    is reported instead (max_n is fixed at 4 there); see FAST_METRICS.
     """
-    def get_ngrams(text: str, n: int) -> Counter:
-        tokens = text.lower().split()
-        return Counter(tuple(tokens[i:i+n]) for i in range(len(tokens) - n + 1))
+    if FAST_METRICS and sacrebleu is not None and max_n == 4:
+        result = sacrebleu.corpus_bleu(predictions, [references])
+        return {
+            "bleu": result.score / 100,
+            **{f"bleu_{i + 1}": p / 100 for i, p in enumerate(result.precisions)},
+        }
     
-    total_precision = []
+    total_matches = [0] * max_n
+    total_count = [0] * max_n
     
-    for n in range(1, max_n + 1):
-        total_matches = 0
-        total_count = 0
-        
-        for pred, ref in zip(predictions, references):
-            pred_ngrams = get_ngrams(pred, n)
-            ref_ngrams = get_ngrams(ref, n)
-            
-            for ngram, count in pred_ngrams.items():
-                total_matches += min(count, ref_ngrams.get(ngram, 0))
-                total_count += count
+    for pred, ref in zip(predictions, references):
+        pred_tokens = pred.lower().split()
+        ref_tokens = ref.lower().split()
+        if not pred_tokens:
+            continue
         
-        if total_count > 0:
-            precision = total_matches / total_count
-        else:
-            precision = 0
+        _, ids = np.unique(np.array(pred_tokens + ref_tokens), return_inverse=True)
+        pred_ids, ref_ids = ids[:len(pred_tokens)], ids[len(pred_tokens):]
         
-        total_precision.append(precision)
+        levels = _ngram_levels(pred_ids, ref_ids, max_n)
+        for n, (pred_codes, ref_codes) in enumerate(levels):
+            total_matches[n] += _clipped_matches(pred_codes, ref_codes)
+            total_count[n] += len(pred_codes)
+    
+    total_precision = [
+        matches / count if count > 0 else 0
+        for matches, count in zip(total_matches, total_count)
+    ]
     
     # Calculate geometric mean
     if all(p > 0 for p in total_precision):
@@ -68,38 +136,113 @@ def calculate_bleu(
     }
 
 
-def calculate_rouge_l(prediction: str, reference: str) -> float:
+def _lcs_len_bits(a: List[int], b: List[int]) -> int:
     """
-    Calculate ROUGE-L (Longest Common Subsequence) F1 score.
+    LCS length by bit-parallel DP (Hyyro): one big-int row, one pass over b.
+    
+    Bit i of v is clear once a[i] has been matched; each token of b updates
+    the whole row with a handful of integer ops instead of a Python loop.
     """
-    pred_tokens = prediction.lower().split()
-    ref_tokens = reference.lower().split()
+    masks: Dict[int, int] = {}
+    for i, tok in enumerate(a):
+        masks[tok] = masks.get(tok, 0) | (1 << i)
     
-    if not pred_tokens or not ref_tokens:
-        return 0.0
+    full = (1 << len(a)) - 1
+    v = full
+    for tok in b:
+        u = v & masks.get(tok, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _lcs_len_jit(a, b):
+        # Single rolling row; `diag` holds row[j-1] from the previous i
+        row = np.zeros(len(b) + 1, dtype=np.int32)
+        for i in range(len(a)):
+            diag = 0
+            for j in range(len(b)):
+                up = row[j + 1]
+                if a[i] == b[j]:
+                    row[j + 1] = diag + 1
+                elif row[j] > up:
+                    row[j + 1] = row[j]
+                diag = up
+        return row[len(b)]
+    
+    # Compile (or load from cache) now rather than on the first score
+    _lcs_len_jit(np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int32))
+
+
+def _lcs_len(a: List[int], b: List[int]) -> int:
+    if njit is not None:
+        return int(_lcs_len_jit(np.asarray(a, dtype=np.int32), np.asarray(b, dtype=np.int32)))
+    return _lcs_len_bits(a, b)
+
+
+def _rouge_l_f1(lcs_length: int, pred_len: int, ref_len: int) -> float:
+    precision = lcs_length / pred_len
+    recall = lcs_length / ref_len
     
-    # LCS length using dynamic programming
-    m, n = len(pred_tokens), len(ref_tokens)
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
+    if precision + recall > 0:
+        return 2 * precision * recall / (precision + recall)
+    return 0.0
+
+
+def _rouge_l_batch(preds: List[List[int]], refs: List[List[int]]) -> np.ndarray:
+    """ROUGE-L F1 for each pair of token-id sequences."""
+    scores = np.zeros(len(preds), dtype=np.float64)
+    for i, (a, b) in enumerate(zip(preds, refs)):
+        if a and b:
+            scores[i] = _rouge_l_f1(_lcs_len(a, b), len(a), len(b))
+    return scores
+
+
+def calculate_rouge_l(prediction: str, reference: str) -> float:
+    """
+    Calculate ROUGE-L (Longest Common Subsequence) F1 score.
+    """
+    vocab: Dict[str, int] = {}
+    pred_ids = [vocab.setdefault(tok, len(vocab)) for tok in prediction.lower().split()]
+    ref_ids = [vocab.setdefault(tok, len(vocab)) for tok in reference.lower().split()]
     
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if pred_tokens[i-1] == ref_tokens[j-1]:
-                dp[i][j] = dp[i-1][j-1] + 1
-            else:
-                dp[i][j] = max(dp[i-1][j], dp[i][j-1])
+    return float(_rouge_l_batch([pred_ids], [ref_ids])[0])
+
+
+@lru_cache(maxsize=1)
+def _rouge_scorer():
+    return rouge_scorer.RougeScorer(["rougeL"])
+
+
+def calculate_rouge_l_scores(
+    predictions: List[str],
+    references: List[str]
+) -> np.ndarray:
+    """
+    Calculate the ROUGE-L F1 score of each prediction/reference pair.
     
-    lcs_length = dp[m][n]
+    All texts share one token vocabulary, so each is split and mapped to
+    ids once. With FAST_METRICS=1 and rouge_score installed, its ROUGE-L
+    F-measure is used instead.
+    """
+    if FAST_METRICS and rouge_scorer is not None:
+        scorer = _rouge_scorer()
+        return np.array([
+            scorer.score(ref, pred)["rougeL"].fmeasure
+            for pred, ref in zip(predictions, references)
+        ], dtype=np.float64)
     
-    precision = lcs_length / len(pred_tokens)
-    recall = lcs_length / len(ref_tokens)
+    vocab: Dict[str, int] = {}
     
-    if precision + recall > 0:
-        f1 = 2 * precision * recall / (precision + recall)
-    else:
-        f1 = 0
+    def encode(text: str) -> List[int]:
+        return [vocab.setdefault(tok, len(vocab)) for tok in text.lower().split()]
     
-    return f1
+    pairs = list(zip(predictions, references))
+    return _rouge_l_batch(
+        [encode(pred) for pred, _ in pairs],
+        [encode(ref) for _, ref in pairs]
+    )
 
 
 def calculate_rouge(
@@ -109,13 +252,10 @@ def calculate_rouge(
     """
     Calculate ROUGE scores for a batch.
     """
-    rouge_l_scores = [
-        calculate_rouge_l(pred, ref) 
-        for pred, ref in zip(predictions, references)
-    ]
+    rouge_l_scores = calculate_rouge_l_scores(predictions, references)
     
     return {
-        "rouge_l": sum(rouge_l_scores) / len(rouge_l_scores) if rouge_l_scores else 0
+        "rouge_l": float(rouge_l_scores.mean()) if len(rouge_l_scores) else 0
     }
 
 
@@ -125,12 +265,27 @@ def calculate_exact_match(
 ) -> float:
     """
     Calculate exact match accuracy.
+    
+    With xxhash installed, normalized strings are compared as 64-bit
+    digests in one NumPy comparison.
     """
+    if not predictions:
+        return 0
+    
+    if xxhash is not None:
+        def digest(text: str) -> int:
+            return xxhash.xxh64_intdigest(text.strip().lower().encode("utf-8"))
+        
+        count = min(len(predictions), len(references))
+        pred_h = np.fromiter(map(digest, predictions[:count]), dtype=np.uint64, count=count)
+        ref_h = np.fromiter(map(digest, references[:count]), dtype=np.uint64, count=count)
+        return int((pred_h == ref_h).sum()) / len(predictions)
+    
     matches = sum(
         1 for pred, ref in zip(predictions, references)
         if pred.strip().lower() == ref.strip().lower()
     )
-    return matches / len(predictions) if predictions else 0
+    return matches / len(predictions)
 
 
 def calculate_token_accuracy(
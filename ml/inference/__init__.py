@@ -1,5 +1,5 @@
 # ML Inference
 from ml.inference.model_loader import ModelLoader
-from ml.inference.predictor import Predictor
+from ml.inference.predictor import Predictor, ReplicatedPredictor
 
-__all__ = ["ModelLoader", "Predictor"]
+__all__ = ["ModelLoader", "Predictor", "ReplicatedPredictor"]
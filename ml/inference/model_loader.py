@@ -3,31 +3,96 @@ Model loader for inference.
 Handles loading base models and attaching LoRA adapters.
 """
 
-from typing import Optional, Dict, Any, Tuple
+import gc
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 from peft import PeftModel
 
+from ml.inference.predictor import Predictor
+
+
+@lru_cache(maxsize=1)
+def get_attn_implementation() -> str:
+    """
+    Best attention backend for this machine, for from_pretrained.
+    
+    FlashAttention-2 needs the flash-attn package and an Ampere or newer
+    GPU; otherwise PyTorch's fused SDPA kernels are used.
+    """
+    if torch.cuda.is_available() and torch.cuda.get_device_capability() >= (8, 0):
+        try:
+            import flash_attn  # noqa: F401
+            return "flash_attention_2"
+        except ImportError:
+            pass
+    return "sdpa"
+
+
+def load_causal_lm(model_name: str, **kwargs) -> Any:
+    """
+    AutoModelForCausalLM.from_pretrained with the fastest attention the
+    architecture supports.
+    
+    Tries get_attn_implementation(), then SDPA, then eager; transformers
+    raises ValueError for an implementation a model class doesn't have.
+    """
+    implementations = list(dict.fromkeys([get_attn_implementation(), "sdpa", "eager"]))
+    for implementation in implementations[:-1]:
+        try:
+            return AutoModelForCausalLM.from_pretrained(
+                model_name, attn_implementation=implementation, **kwargs
+            )
+        except ValueError:
+            continue
+    return AutoModelForCausalLM.from_pretrained(
+        model_name, attn_implementation=implementations[-1], **kwargs
+    )
+
+
+@lru_cache(maxsize=1)
+def get_compute_dtype() -> torch.dtype:
+    """
+    bf16 where the GPU supports it, else fp16.
+    
+    bf16 keeps fp32's exponent range, so it needs no loss scaling and
+    doesn't overflow on long sequences, at the same tensor-core throughput.
+    """
+    if torch.cuda.is_available() and torch.cuda.is_bf16_supported():
+        return torch.bfloat16
+    return torch.float16
+
 
 class ModelLoader:
     """
     Loads base models and attaches adapters for inference.
     
-    Supports caching of base models to avoid reloading.
+    Supports caching of base models to avoid reloading. The cache is an
+    LRU shared by all loaders and holds at most max_models base models;
+    each one occupies GPU memory until it is evicted.
     """
     
-    # Class-level cache for base models
-    _model_cache: Dict[str, Any] = {}
-    _tokenizer_cache: Dict[str, Any] = {}
+    # Class-level LRU: (model_name, use_4bit, compute_dtype, compiled) -> (model, tokenizer)
+    _model_cache: "OrderedDict[Tuple[str, bool, torch.dtype, bool], Tuple[Any, Any]]" = OrderedDict()
     
-    def __init__(self, use_4bit: bool = True):
+    def __init__(
+        self,
+        use_4bit: bool = True,
+        compute_dtype: Optional[torch.dtype] = None,
+        max_models: int = 1
+    ):
         self.use_4bit = use_4bit
+        self.compute_dtype = compute_dtype or get_compute_dtype()
+        self.max_models = max_models
         self.current_adapter: Optional[str] = None
     
     def load_base_model(
         self,
         model_name: str,
-        use_cache: bool = True
+        use_cache: bool = True,
+        compile_model: bool = False
     ) -> Tuple[Any, Any]:
         """
         Load a base model and tokenizer.
@@ -35,35 +100,98 @@ class ModelLoader:
         Args:
             model_name: HuggingFace model name
             use_cache: Whether to use cached model
+            compile_model: Compile the forward pass with torch.compile
+                (CUDA-graph replay for decoding); the compiled model is
+                what gets cached, so the compile cost is paid once
         
         Returns:
             Tuple of (model, tokenizer)
         """
         # Check cache
-        if use_cache and model_name in self._model_cache:
-            return self._model_cache[model_name], self._tokenizer_cache[model_name]
+        key = (model_name, self.use_4bit, self.compute_dtype, compile_model)
+        if use_cache and key in self._model_cache:
+            self._model_cache.move_to_end(key)
+            return self._model_cache[key]
+        
+        # Make room before loading, so two models never share the GPU
+        if use_cache:
+            self._evict(max(self.max_models - 1, 0))
+        
+        model = self._load_model(model_name, "auto", compile_model)
+        tokenizer = self._load_tokenizer(model_name)
+        
+        # Cache
+        if use_cache and self.max_models > 0:
+            self._model_cache[key] = (model, tokenizer)
         
+        return model, tokenizer
+    
+    def load_replicated(
+        self,
+        model_name: str,
+        devices: Optional[List[int]] = None,
+        compile_model: bool = False
+    ) -> List[Predictor]:
+        """
+        Load one full copy of a base model per GPU (data parallel).
+        
+        A 7B model fits on one card, so independent replicas scale
+        throughput without the cross-GPU traffic of device_map="auto"
+        sharding. Replicas bypass the model cache; wrap the result in a
+        ReplicatedPredictor to spread prompts across them.
+        
+        Args:
+            model_name: HuggingFace model name
+            devices: CUDA device indices (default: all visible GPUs)
+            compile_model: Compile each replica's forward pass
+        
+        Returns:
+            One Predictor per device, each with its own tokenizer
+        """
+        if devices is None:
+            devices = list(range(torch.cuda.device_count()))
+        
+        return [
+            Predictor(
+                self._load_model(model_name, {"": f"cuda:{index}"}, compile_model),
+                self._load_tokenizer(model_name),
+                device=f"cuda:{index}"
+            )
+            for index in devices
+        ]
+    
+    def _load_model(self, model_name: str, device_map: Any, compile_model: bool) -> Any:
+        """Load a base model for inference onto device_map."""
         # Quantization config
         if self.use_4bit:
             bnb_config = BitsAndBytesConfig(
                 load_in_4bit=True,
                 bnb_4bit_quant_type="nf4",
-                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_compute_dtype=self.compute_dtype,
                 bnb_4bit_use_double_quant=True
             )
         else:
             bnb_config = None
         
         # Load model
-        model = AutoModelForCausalLM.from_pretrained(
+        model = load_causal_lm(
             model_name,
             quantization_config=bnb_config,
-            device_map="auto",
+            device_map=device_map,
             trust_remote_code=True,
-            torch_dtype=torch.float16
+            torch_dtype=self.compute_dtype
         )
         
-        # Load tokenizer
+        model.eval()
+        if compile_model:
+            # Adapters attached later wrap this model and call its forward
+            model.forward = torch.compile(model.forward, mode="reduce-overhead", dynamic=False)
+        
+        return model
+    
+    @staticmethod
+    def _load_tokenizer(model_name: str) -> Any:
+        """Load a tokenizer with a pad token set."""
         tokenizer = AutoTokenizer.from_pretrained(
             model_name,
             trust_remote_code=True
@@ -74,12 +202,7 @@ class ModelLoader:
             tokenizer.pad_token = tokenizer.eos_token
             tokenizer.pad_token_id = tokenizer.eos_token_id
         
-        # Cache
-        if use_cache:
-            self._model_cache[model_name] = model
-            self._tokenizer_cache[model_name] = tokenizer
-        
-        return model, tokenizer
+        return tokenizer
     
     def attach_adapter(
         self,
@@ -126,13 +249,25 @@ class ModelLoader:
         
         return model, tokenizer
     
+    @classmethod
+    def _evict(cls, keep: int) -> None:
+        """Drop least recently used models until at most `keep` remain."""
+        if len(cls._model_cache) <= keep:
+            return
+        while len(cls._model_cache) > keep:
+            cls._model_cache.popitem(last=False)
+        
+        # The popped entries were the last references; collect them now so
+        # their GPU memory is actually returned before the next load
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    
     def clear_cache(self) -> None:
         """Clear the model cache."""
-        self._model_cache.clear()
-        self._tokenizer_cache.clear()
-        torch.cuda.empty_cache()
+        self._evict(0)
     
     @classmethod
     def get_cached_models(cls) -> list:
         """Get list of cached model names."""
-        return list(cls._model_cache.keys())
+        return list(dict.fromkeys(key[0] for key in cls._model_cache))
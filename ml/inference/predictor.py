@@ -3,8 +3,54 @@ Predictor for text generation.
 Handles inference with fine-tuned models.
 """
 
-from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Sequence, Tuple
 import torch
+from transformers import GenerationConfig, StoppingCriteria, StoppingCriteriaList
+
+from ml.preprocessing.formatter import CHAT_TEMPLATE
+
+# Pre-allocated KV caches arrived in transformers 4.38
+STATIC_CACHE_SUPPORTED = hasattr(GenerationConfig(), "cache_implementation")
+
+
+class StopOnTokens(StoppingCriteria):
+    """
+    Stop generate() once every row ends in a stop sequence or EOS.
+    
+    Stop strings are matched as pre-encoded token id sequences against the
+    tail of the generated tokens, on the device, so generation ends as soon
+    as they are produced rather than running to max_new_tokens.
+    """
+    
+    def __init__(
+        self,
+        stop_ids: Sequence[Sequence[int]],
+        prompt_length: int,
+        finished_ids: Sequence[int] = (),
+        device: Optional[str] = None
+    ):
+        self.stop_ids = [torch.tensor(ids, device=device) for ids in stop_ids if ids]
+        self.finished_ids = torch.tensor(list(finished_ids), device=device)
+        self.prompt_length = prompt_length
+        self.done = None
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        if self.done is None:
+            self.done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        
+        generated = input_ids.shape[1] - self.prompt_length
+        for ids in self.stop_ids:
+            # Only match inside the generated part, never the prompt
+            if len(ids) <= generated:
+                self.done |= (input_ids[:, -len(ids):] == ids).all(dim=1)
+        
+        # Rows that already emitted EOS are only padded from here on
+        if len(self.finished_ids):
+            self.done |= torch.isin(input_ids[:, -1], self.finished_ids)
+        
+        return bool(self.done.all())
 
 
 class Predictor:
@@ -18,14 +64,36 @@ class Predictor:
         self,
         model,
         tokenizer,
-        device: Optional[str] = None
+        device: Optional[str] = None,
+        warmup: bool = False,
+        stop_strings: Optional[List[str]] = None,
+        static_cache: bool = False
     ):
         self.model = model
         self.tokenizer = tokenizer
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         
+        # A static KV cache is allocated once at its full length, so decode
+        # steps do no allocation and a compiled forward can replay as a CUDA
+        # graph; ignored on transformers versions without it
+        self.static_cache = static_cache and STATIC_CACHE_SUPPORTED
+        
+        # Encoded stop strings, keyed by the tuple of strings
+        self._stop_ids: Dict[Tuple[str, ...], List[List[int]]] = {}
+        self.stop_strings = stop_strings
+        if stop_strings:
+            self._encode_stop_strings(stop_strings)
+        
+        # UIs re-count the same prompt on every keystroke/poll
+        self._token_counts = lru_cache(maxsize=1024)(self._count_tokens)
+        
         # Ensure model is in eval mode
         self.model.eval()
+        
+        # A compiled model captures its graphs on the first calls; pay that
+        # here rather than on the first request
+        if warmup:
+            self.generate("Hello", max_new_tokens=4, do_sample=False)
     
     def generate(
         self,
@@ -51,18 +119,111 @@ class Predictor:
             repetition_penalty: Penalty for repeating tokens
             do_sample: Whether to use sampling (False = greedy)
             num_return_sequences: Number of sequences to generate
-            stop_strings: Strings that stop generation
+            stop_strings: Strings that stop generation (defaults to the
+                ones given to __init__)
         
         Returns:
             Generated text (without the prompt)
         """
-        # Tokenize input
-        inputs = self.tokenizer(
+        return self.generate_with_counts(
             prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=2048 - max_new_tokens
-        ).to(self.device)
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            repetition_penalty=repetition_penalty,
+            do_sample=do_sample,
+            num_return_sequences=num_return_sequences,
+            stop_strings=stop_strings
+        )["generated_text"]
+    
+    def generate_with_counts(
+        self,
+        prompt: str,
+        max_new_tokens: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        repetition_penalty: float = 1.1,
+        do_sample: bool = True,
+        num_return_sequences: int = 1,
+        stop_strings: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate text and report token counts from the generation itself.
+        
+        Takes the same arguments as generate(). The counts come from the
+        tensors already produced, so callers don't need to re-encode the
+        prompt or the output to meter usage.
+        
+        Returns:
+            Dict with generated_text (str, or list when
+            num_return_sequences > 1), input_tokens and output_tokens
+        """
+        return self.generate_batch_with_counts(
+            [prompt],
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            repetition_penalty=repetition_penalty,
+            do_sample=do_sample,
+            num_return_sequences=num_return_sequences,
+            stop_strings=stop_strings
+        )[0]
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        **kwargs
+    ) -> List[str]:
+        """Generate text for multiple prompts."""
+        return [
+            output["generated_text"]
+            for output in self.generate_batch_with_counts(prompts, **kwargs)
+        ]
+    
+    def generate_batch_with_counts(
+        self,
+        prompts: List[str],
+        max_new_tokens: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        repetition_penalty: float = 1.1,
+        do_sample: bool = True,
+        num_return_sequences: int = 1,
+        stop_strings: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate text and token counts for multiple prompts.
+        
+        All prompts are tokenized together (left-padded, so every row's
+        generation starts at the same column) and run through one
+        model.generate call. Returns one generate_with_counts() dict per
+        prompt, in order.
+        """
+        if not prompts:
+            return []
+        
+        if stop_strings is None:
+            stop_strings = self.stop_strings
+        
+        # Tokenize input
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        try:
+            inputs = self.tokenizer(
+                prompts,
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=2048 - max_new_tokens,
+                # Bucket prompt lengths so compiled graphs see few shapes
+                pad_to_multiple_of=64 if self.static_cache else None
+            ).to(self.device)
+        finally:
+            self.tokenizer.padding_side = padding_side
         
         # Generation config
         gen_kwargs = {
@@ -76,6 +237,19 @@ class Predictor:
             "pad_token_id": self.tokenizer.pad_token_id,
             "eos_token_id": self.tokenizer.eos_token_id,
         }
+        if self.static_cache:
+            # Sized from the prompt length plus max_new_tokens
+            gen_kwargs["cache_implementation"] = "static"
+        
+        if stop_strings:
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList([
+                StopOnTokens(
+                    self._encode_stop_strings(stop_strings),
+                    prompt_length=inputs["input_ids"].shape[1],
+                    finished_ids={self.tokenizer.eos_token_id, self.tokenizer.pad_token_id} - {None},
+                    device=self.device
+                )
+            ])
         
         # Generate
         with torch.no_grad():
@@ -83,46 +257,57 @@ class Predictor:
         
         # Decode - remove the input prompt from output
         input_length = inputs["input_ids"].shape[1]
+        generated_tokens = outputs[:, input_length:]
+        texts = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
         
-        if num_return_sequences == 1:
-            generated_tokens = outputs[0][input_length:]
-            generated_text = self.tokenizer.decode(
-                generated_tokens, 
-                skip_special_tokens=True
-            )
-            
-            # Handle stop strings
-            if stop_strings:
-                for stop_str in stop_strings:
-                    if stop_str in generated_text:
-                        generated_text = generated_text.split(stop_str)[0]
-            
-            return generated_text.strip()
-        else:
-            results = []
-            for output in outputs:
-                generated_tokens = output[input_length:]
-                text = self.tokenizer.decode(
-                    generated_tokens,
-                    skip_special_tokens=True
-                )
-                
-                if stop_strings:
-                    for stop_str in stop_strings:
-                        if stop_str in text:
-                            text = text.split(stop_str)[0]
-                
-                results.append(text.strip())
-            
-            return results
+        # Sequences are padded to a common length; don't bill padding
+        input_counts = inputs["attention_mask"].sum(dim=1).tolist()
+        output_counts = (
+            (generated_tokens != self.tokenizer.pad_token_id)
+            .sum(dim=1)
+            .view(len(prompts), num_return_sequences)
+            .sum(dim=1)
+            .tolist()
+        )
+        
+        results = []
+        for row, prompt in enumerate(prompts):
+            # generate() returns each prompt's sequences consecutively
+            sequences = [
+                self._apply_stop_strings(text, stop_strings)
+                for text in texts[row * num_return_sequences:(row + 1) * num_return_sequences]
+            ]
+            results.append({
+                "generated_text": sequences[0] if num_return_sequences == 1 else sequences,
+                "input_tokens": int(input_counts[row]),
+                "output_tokens": int(output_counts[row])
+            })
+        
+        return results
     
-    def generate_batch(
-        self,
-        prompts: List[str],
-        **kwargs
-    ) -> List[str]:
-        """Generate text for multiple prompts."""
-        return [self.generate(prompt, **kwargs) for prompt in prompts]
+    def _encode_stop_strings(self, stop_strings: List[str]) -> List[List[int]]:
+        """Token ids of each stop string, encoded once per set of strings."""
+        key = tuple(stop_strings)
+        if key not in self._stop_ids:
+            self._stop_ids[key] = [
+                self.tokenizer.encode(stop_str, add_special_tokens=False)
+                for stop_str in stop_strings
+            ]
+        return self._stop_ids[key]
+    
+    @staticmethod
+    def _apply_stop_strings(text: str, stop_strings: Optional[List[str]]) -> str:
+        """
+        Cut text at each stop string it contains, then strip.
+        
+        StopOnTokens ends generation early; this trims the stop string
+        itself (and catches one that tokenized differently in context).
+        """
+        if stop_strings:
+            for stop_str in stop_strings:
+                if stop_str in text:
+                    text = text.split(stop_str)[0]
+        return text.strip()
     
     def chat(
         self,
@@ -143,25 +328,71 @@ class Predictor:
         return self.generate(prompt, **kwargs)
     
     def _format_chat(self, messages: List[Dict[str, str]]) -> str:
-        """Format chat messages into prompt."""
-        formatted = []
-        
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-            
-            if role == "system":
-                formatted.append(f"### System:\n{content}")
-            elif role == "user":
-                formatted.append(f"### User:\n{content}")
-            elif role == "assistant":
-                formatted.append(f"### Assistant:\n{content}")
-        
-        # Add assistant prompt
-        formatted.append("### Assistant:\n")
+        """
+        Format chat messages into prompt.
         
-        return "\n\n".join(formatted)
+        Uses the training prompt template (compiled once by the tokenizer)
+        whatever template the base tokenizer ships with.
+        """
+        return self.tokenizer.apply_chat_template(
+            messages,
+            chat_template=CHAT_TEMPLATE,
+            tokenize=False,
+            add_generation_prompt=True
+        )
     
     def get_token_count(self, text: str) -> int:
         """Count tokens in text."""
-        return len(self.tokenizer.encode(text))
+        return self._token_counts(text)
+    
+    def _count_tokens(self, text: str) -> int:
+        # The tokenizer reports the length itself; no id list is built
+        return self.tokenizer([text], return_length=True)["length"][0]
+
+
+
+class ReplicatedPredictor:
+    """
+    Spreads batches across Predictors holding replicas on different GPUs.
+    
+    Each replica gets a contiguous slice of the prompts and they generate
+    in parallel threads (generate() releases the GIL inside CUDA calls).
+    Build the replicas with ModelLoader.load_replicated().
+    """
+    
+    def __init__(self, predictors: List[Predictor]):
+        if not predictors:
+            raise ValueError("ReplicatedPredictor needs at least one predictor")
+        self.predictors = predictors
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(predictors),
+            thread_name_prefix="replica"
+        )
+    
+    def generate_batch_with_counts(self, prompts: List[str], **kwargs) -> List[Dict[str, Any]]:
+        """Same as Predictor.generate_batch_with_counts, across replicas."""
+        if not prompts:
+            return []
+        
+        # Contiguous, near-equal slices keep results in prompt order
+        per_replica = -(-len(prompts) // len(self.predictors))
+        futures = [
+            self._executor.submit(
+                predictor.generate_batch_with_counts,
+                prompts[start:start + per_replica],
+                **kwargs
+            )
+            for predictor, start in zip(self.predictors, range(0, len(prompts), per_replica))
+        ]
+        return [output for future in futures for output in future.result()]
+    
+    def generate_batch(self, prompts: List[str], **kwargs) -> List[str]:
+        """Generate text for multiple prompts across replicas."""
+        return [
+            output["generated_text"]
+            for output in self.generate_batch_with_counts(prompts, **kwargs)
+        ]
+    
+    def shutdown(self) -> None:
+        """Stop the replica threads."""
+        self._executor.shutdown(wait=True)
@@ -1,10 +1,28 @@
 # ML Preprocessing
-from ml.preprocessing.formatter import DatasetFormatter, prepare_dataset
-from ml.preprocessing.tokenizer import TokenizerWrapper, DataCollatorForCausalLM
+# Submodules are imported on first attribute access (PEP 562), so e.g.
+# `from ml.preprocessing.formatter import ...` doesn't pull in transformers
+import importlib
+
+_LAZY = {
+    "DatasetFormatter": "ml.preprocessing.formatter",
+    "prepare_dataset": "ml.preprocessing.formatter",
+    "iter_prepared_dataset": "ml.preprocessing.formatter",
+    "TokenizerWrapper": "ml.preprocessing.tokenizer",
+    "DataCollatorForCausalLM": "ml.preprocessing.tokenizer",
+}
 
 __all__ = [
     "DatasetFormatter",
     "prepare_dataset", 
+    "iter_prepared_dataset",
     "TokenizerWrapper",
     "DataCollatorForCausalLM"
 ]
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
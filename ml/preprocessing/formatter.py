@@ -3,8 +3,27 @@ Dataset formatter for instruction fine-tuning.
 Converts raw data into instruction format compatible with LLM training.
 """
 
-from typing import Dict, Any, List, Optional
-import json
+from typing import Dict, Any, Iterator, List, Optional
+import os
+import orjson
+
+
+# The training prompt format as a tokenizer chat template, so chat requests
+# at inference render exactly the prompts the adapter was trained on.
+# A user turn is the instruction, optionally followed by its "### Input:".
+CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if message['role'] == 'system' %}"
+    "{{ message['content'] + '\n\n' }}"
+    "{% elif message['role'] == 'user' %}"
+    "{{ '### Instruction:\n' + message['content'] + '\n\n' }}"
+    "{% elif message['role'] == 'assistant' %}"
+    "{{ '### Response:\n' + message['content'] }}"
+    "{% if not loop.last %}{{ '\n\n' }}{% endif %}"
+    "{% endif %}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}{{ '### Response:\n' }}{% endif %}"
+)
 
 
 class DatasetFormatter:
@@ -69,6 +88,52 @@ class DatasetFormatter:
         """Format entire dataset."""
         return [self.format_sample(sample) for sample in samples]
     
+    def format_batch(self, batch: Dict[str, List[Any]]) -> Dict[str, List[str]]:
+        """
+        Format a columnar batch (as passed by Dataset.map(batched=True)).
+        
+        Produces the same text as format_sample, reading each column once
+        instead of three dict lookups per sample.
+        """
+        size = len(next(iter(batch.values()), []))
+        instructions = batch.get(self.instruction_key) or [""] * size
+        inputs = batch.get(self.input_key) or [""] * size
+        outputs = batch.get(self.output_key) or [""] * size
+        
+        if self.template:
+            template = self.template.format
+            texts = [
+                template(instruction=instruction, input=input_text, output=output)
+                for instruction, input_text, output in zip(instructions, inputs, outputs)
+            ]
+        else:
+            with_input = self.DEFAULT_TEMPLATE.format
+            without_input = self.NO_INPUT_TEMPLATE.format
+            texts = [
+                with_input(instruction=instruction, input=input_text, output=output)
+                if input_text else
+                without_input(instruction=instruction, output=output)
+                for instruction, input_text, output in zip(instructions, inputs, outputs)
+            ]
+        
+        return {"text": texts}
+    
+    def map_dataset(self, dataset, num_proc: Optional[int] = None):
+        """
+        Format a HuggingFace Dataset into a single 'text' column.
+        
+        Runs format_batch over Arrow batches in several processes; the
+        result is cached on disk with the dataset, so re-runs skip it.
+        """
+        return dataset.map(
+            self.format_batch,
+            batched=True,
+            batch_size=1000,
+            num_proc=num_proc or max(1, (os.cpu_count() or 2) // 2),
+            remove_columns=dataset.column_names,
+            desc="Formatting"
+        )
+    
     def format_for_training(self, sample: Dict[str, Any]) -> Dict[str, str]:
         """Format sample for training with separate prompt and completion."""
         instruction = sample.get(self.instruction_key, "")
@@ -100,33 +165,51 @@ class DatasetFormatter:
 
 def load_json_dataset(file_path: str) -> List[Dict[str, Any]]:
     """Load dataset from JSON file."""
-    with open(file_path, "r") as f:
-        data = json.load(f)
+    with open(file_path, "rb") as f:
+        data = orjson.loads(f.read())
     return data if isinstance(data, list) else [data]
 
 
-def load_jsonl_dataset(file_path: str) -> List[Dict[str, Any]]:
-    """Load dataset from JSONL file."""
-    samples = []
-    with open(file_path, "r") as f:
+def iter_jsonl_dataset(file_path: str) -> Iterator[Dict[str, Any]]:
+    """Yield samples from a JSONL file one line at a time."""
+    # Binary mode: orjson parses the raw bytes, no text decoding pass
+    with open(file_path, "rb") as f:
         for line in f:
             if line.strip():
-                samples.append(json.loads(line))
-    return samples
+                yield orjson.loads(line)
 
 
-def prepare_dataset(
+def load_jsonl_dataset(file_path: str) -> List[Dict[str, Any]]:
+    """Load dataset from JSONL file."""
+    return list(iter_jsonl_dataset(file_path))
+
+
+def iter_prepared_dataset(
     file_path: str,
     formatter: Optional[DatasetFormatter] = None
-) -> List[Dict[str, str]]:
-    """Load and format dataset for training."""
+) -> Iterator[Dict[str, str]]:
+    """
+    Yield formatted training samples without building the whole list.
+    
+    JSONL is read line by line; JSON files are parsed whole (the format
+    requires it) but formatted lazily.
+    """
     formatter = formatter or DatasetFormatter()
     
     if file_path.endswith(".json"):
         samples = load_json_dataset(file_path)
     elif file_path.endswith(".jsonl"):
-        samples = load_jsonl_dataset(file_path)
+        samples = iter_jsonl_dataset(file_path)
     else:
         raise ValueError(f"Unsupported file format: {file_path}")
     
-    return [formatter.format_for_training(sample) for sample in samples]
+    for sample in samples:
+        yield formatter.format_for_training(sample)
+
+
+def prepare_dataset(
+    file_path: str,
+    formatter: Optional[DatasetFormatter] = None
+) -> List[Dict[str, str]]:
+    """Load and format dataset for training."""
+    return list(iter_prepared_dataset(file_path, formatter))
@@ -3,9 +3,14 @@ Tokenizer utilities for dataset preprocessing.
 Handles tokenization, truncation, and padding for training.
 """
 
+from functools import lru_cache
 from typing import Dict, List, Optional, Any
+import os
+from datasets import Dataset
 from transformers import AutoTokenizer, PreTrainedTokenizer
 
+from ml.preprocessing.formatter import CHAT_TEMPLATE
+
 
 class TokenizerWrapper:
     """Wrapper for handling tokenization operations."""
@@ -14,7 +19,7 @@ class TokenizerWrapper:
         self,
         model_name: str,
         max_length: int = 2048,
-        padding: str = "max_length",
+        padding: str = "longest",
         truncation: bool = True
     ):
         self.model_name = model_name
@@ -22,12 +27,14 @@ class TokenizerWrapper:
         self.padding = padding
         self.truncation = truncation
         self.tokenizer = None
+        self._token_counts = lru_cache(maxsize=1024)(self._count_tokens)
     
     def load(self) -> PreTrainedTokenizer:
         """Load the tokenizer."""
         self.tokenizer = AutoTokenizer.from_pretrained(
             self.model_name,
-            trust_remote_code=True
+            trust_remote_code=True,
+            use_fast=True
         )
         
         # Set pad token if not set
@@ -35,6 +42,9 @@ class TokenizerWrapper:
             self.tokenizer.pad_token = self.tokenizer.eos_token
             self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
         
+        # Render chats in the training prompt format
+        self.tokenizer.chat_template = CHAT_TEMPLATE
+        
         return self.tokenizer
     
     def tokenize(self, text: str) -> Dict[str, Any]:
@@ -64,11 +74,32 @@ class TokenizerWrapper:
         )
     
     def count_tokens(self, text: str) -> int:
-        """Count tokens in text."""
+        """Count tokens in text (cached per text)."""
+        return self._token_counts(text)
+    
+    def _count_tokens(self, text: str) -> int:
         if self.tokenizer is None:
             self.load()
         
-        return len(self.tokenizer.encode(text))
+        # The tokenizer reports the length itself; no id list is built
+        return self.tokenizer([text], return_length=True)["length"][0]
+    
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """
+        Count tokens in many texts with one tokenizer call.
+        
+        A fast tokenizer encodes the batch on its Rust thread pool; counts
+        match count_tokens.
+        """
+        if self.tokenizer is None:
+            self.load()
+        
+        return self.tokenizer(
+            texts,
+            return_length=True,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )["length"]
     
     def truncate_to_max_length(self, text: str) -> str:
         """Truncate text to max_length tokens."""
@@ -86,7 +117,8 @@ class TokenizerWrapper:
 def prepare_training_data(
     samples: List[Dict[str, str]],
     tokenizer: PreTrainedTokenizer,
-    max_length: int = 2048
+    max_length: int = 2048,
+    padding: str = "longest"
 ) -> Dict[str, List]:
     """
     Prepare samples for training.
@@ -95,6 +127,8 @@ def prepare_training_data(
         samples: List of dicts with 'text' key
         tokenizer: HuggingFace tokenizer
         max_length: Maximum sequence length
+        padding: "longest" pads to the batch's longest sample;
+            "max_length" pads every sample to max_length
     
     Returns:
         Dict with input_ids, attention_mask, labels
@@ -105,7 +139,7 @@ def prepare_training_data(
     encodings = tokenizer(
         texts,
         max_length=max_length,
-        padding="max_length",
+        padding=padding,
         truncation=True,
         return_tensors="pt"
     )
@@ -116,6 +150,65 @@ def prepare_training_data(
     return encodings
 
 
+def tokenize_dataset(
+    dataset: Dataset,
+    tokenizer: PreTrainedTokenizer,
+    max_length: int = 2048,
+    num_proc: Optional[int] = None
+) -> Dataset:
+    """
+    Tokenize a dataset's 'text' column once, ahead of training.
+    
+    Returns input_ids, attention_mask and a token `length` column (for
+    length-grouped sampling). datasets caches the result next to the
+    source Arrow files, so a rerun over the same data skips the work.
+    """
+    def tokenize(batch: Dict[str, List[str]]) -> Dict[str, List]:
+        encodings = tokenizer(batch["text"], truncation=True, max_length=max_length)
+        encodings["length"] = [len(ids) for ids in encodings["input_ids"]]
+        return encodings
+    
+    return dataset.map(
+        tokenize,
+        batched=True,
+        num_proc=num_proc or os.cpu_count(),
+        remove_columns=dataset.column_names,
+        desc="Tokenizing"
+    )
+
+
+def pack_dataset(
+    dataset: Dataset,
+    max_length: int,
+    eos_token_id: int
+) -> Dataset:
+    """
+    Concatenate tokenized samples (EOS-separated) into max_length rows.
+    
+    Like TRL's ConstantLengthDataset: no row needs padding, at the cost of
+    attention spanning sample boundaries. A leftover shorter than
+    max_length at the end of each map batch is kept as its own row.
+    """
+    def pack(batch: Dict[str, List[List[int]]]) -> Dict[str, List]:
+        stream: List[int] = []
+        for ids in batch["input_ids"]:
+            stream.extend(ids)
+            stream.append(eos_token_id)
+        rows = [stream[i:i + max_length] for i in range(0, len(stream), max_length)]
+        return {
+            "input_ids": rows,
+            "attention_mask": [[1] * len(row) for row in rows],
+            "length": [len(row) for row in rows],
+        }
+    
+    return dataset.map(
+        pack,
+        batched=True,
+        remove_columns=dataset.column_names,
+        desc="Packing"
+    )
+
+
 class DataCollatorForCausalLM:
     """Data collator for causal language modeling."""
     
@@ -130,23 +223,34 @@ class DataCollatorForCausalLM:
         self.pad_to_multiple_of = pad_to_multiple_of
     
     def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Collate batch of features."""
-        # Extract texts
-        texts = [f["text"] for f in features]
-        
-        # Tokenize
-        batch = self.tokenizer(
-            texts,
-            max_length=self.max_length,
-            padding=True,
-            truncation=True,
-            return_tensors="pt"
-        )
+        """Collate batch of features.
         
-        # Labels are input_ids (shifted by model internally)
-        batch["labels"] = batch["input_ids"].clone()
+        Features from tokenize_dataset/pack_dataset are only padded; raw
+        'text' features are tokenized here.
+        """
+        if "input_ids" in features[0]:
+            batch = self.tokenizer.pad(
+                [
+                    {"input_ids": f["input_ids"], "attention_mask": f["attention_mask"]}
+                    for f in features
+                ],
+                padding=True,
+                pad_to_multiple_of=self.pad_to_multiple_of,
+                return_tensors="pt"
+            )
+        else:
+            batch = self.tokenizer(
+                [f["text"] for f in features],
+                max_length=self.max_length,
+                padding=True,
+                truncation=True,
+                pad_to_multiple_of=self.pad_to_multiple_of,
+                return_tensors="pt"
+            )
         
-        # Mask padding tokens in labels
-        batch["labels"][batch["attention_mask"] == 0] = -100
+        # Labels are input_ids (shifted by model internally) with padding
+        # masked out; masked_fill builds them in one pass, with no clone
+        # followed by a boolean-index scatter
+        batch["labels"] = batch["input_ids"].masked_fill(batch["attention_mask"] == 0, -100)
         
         return batch
@@ -1,7 +1,16 @@
 # ML Training
-from ml.training.lora_config import get_lora_config, get_preset_config
-from ml.training.trainer import LoRATrainer, TrainingConfig
-from ml.training.train_pipeline import TrainingPipeline, run_training_pipeline
+# Submodules are imported on first attribute access (PEP 562), so callers
+# that only need the LoRA config don't load the trainer's dependencies
+import importlib
+
+_LAZY = {
+    "get_lora_config": "ml.training.lora_config",
+    "get_preset_config": "ml.training.lora_config",
+    "LoRATrainer": "ml.training.trainer",
+    "TrainingConfig": "ml.training.trainer",
+    "TrainingPipeline": "ml.training.train_pipeline",
+    "run_training_pipeline": "ml.training.train_pipeline",
+}
 
 __all__ = [
     "get_lora_config",
@@ -11,3 +20,11 @@ __all__ = [
     "TrainingPipeline",
     "run_training_pipeline"
 ]
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
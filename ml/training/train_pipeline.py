@@ -2,17 +2,30 @@
 Training Pipeline - Orchestrates the full training workflow.
 """
 
+import argparse
 import os
 import json
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, List, Optional, Callable
 from datetime import datetime
 
 from datasets import Dataset
 
-from ml.preprocessing.formatter import prepare_dataset
+from ml.preprocessing.formatter import iter_prepared_dataset
 from ml.training.trainer import LoRATrainer, TrainingConfig
 from ml.evaluation.evaluator import Evaluator
 
+# Marks progress updates a torchrun child prints for its parent to relay
+PROGRESS_PREFIX = "FORGELLM_PROGRESS "
+
+
+def is_main_process() -> bool:
+    """True outside torchrun, or on its rank 0."""
+    return int(os.environ.get("RANK", "0")) == 0
+
+
+def _prepared_samples(file_path: str, mtime_ns: int):
+    yield from iter_prepared_dataset(file_path)
+
 
 class TrainingPipeline:
     """
@@ -50,16 +63,23 @@ class TrainingPipeline:
         self,
         num_epochs: int = 3,
         batch_size: int = 4,
+        gradient_accumulation_steps: int = 4,
         learning_rate: float = 2e-4,
         lora_r: int = 16,
         lora_alpha: int = 32,
         lora_dropout: float = 0.05,
         max_steps: int = -1,
-        eval_split: float = 0.1
+        eval_split: float = 0.1,
+        torch_compile: bool = False,
+        reuse_base_model: bool = False
     ) -> Dict[str, Any]:
         """
         Run the full training pipeline.
         
+        Training uses gradient checkpointing and a paged 8-bit optimizer,
+        so activations rather than weights bound the batch; on a 24 GB
+        card batch_size can usually go to 8 for 7B models.
+        
         Returns:
             Dict with training results and metrics
         """
@@ -68,10 +88,16 @@ class TrainingPipeline:
         
         # Step 1: Load and prepare dataset
         self._update_progress("loading_dataset", 5)
-        samples = prepare_dataset(self.dataset_path)
-        
-        # Convert to HuggingFace Dataset
-        dataset = Dataset.from_list(samples)
+        # Streamed into an Arrow table on disk; the raw and formatted samples
+        # are never all held as Python dicts at once
+        dataset = Dataset.from_generator(
+            _prepared_samples,
+            gen_kwargs={
+                "file_path": self.dataset_path,
+                # Part of the cache key, so an edited file is re-read
+                "mtime_ns": os.stat(self.dataset_path).st_mtime_ns,
+            },
+        )
         
         # Split into train/eval
         if eval_split > 0 and len(dataset) > 10:
@@ -85,13 +111,16 @@ class TrainingPipeline:
         self._update_progress("dataset_ready", 10, 
                               sample_count=len(train_dataset))
         
-        # Step 2: Configure training
+        # Step 2: Configure training (LoRATrainer picks bf16 where supported)
         training_config = TrainingConfig(
             output_dir=self.output_dir,
             num_epochs=num_epochs,
             batch_size=batch_size,
+            gradient_accumulation_steps=gradient_accumulation_steps,
             learning_rate=learning_rate,
-            max_steps=max_steps
+            max_steps=max_steps,
+            torch_compile=torch_compile,
+            reuse_base_model=reuse_base_model
         )
         
         # Step 3: Initialize trainer
@@ -124,9 +153,19 @@ class TrainingPipeline:
             "total_samples": len(train_dataset),
         }
         
+        # Other torchrun ranks are done once the adapter is trained
+        if not is_main_process():
+            return {
+                "adapter_path": train_results["adapter_path"],
+                "metrics": metrics,
+                "metadata": None
+            }
+        
         if eval_dataset:
             self._update_progress("evaluating", 90)
-            evaluator = Evaluator(trainer.model, trainer.tokenizer)
+            # Compiled only on request, like training: a dynamo failure here
+            # would fail a job whose adapter is already trained
+            evaluator = Evaluator(trainer.model, trainer.tokenizer, compile=torch_compile)
             eval_metrics = evaluator.evaluate(eval_dataset)
             metrics.update(eval_metrics)
         
@@ -190,9 +229,49 @@ def run_training_pipeline(
     return pipeline.run(
         num_epochs=config.get("num_epochs", 3),
         batch_size=config.get("batch_size", 4),
+        gradient_accumulation_steps=config.get("gradient_accumulation_steps", 4),
         learning_rate=config.get("learning_rate", 2e-4),
         lora_r=config.get("lora_r", 16),
         lora_alpha=config.get("lora_alpha", 32),
         lora_dropout=config.get("lora_dropout", 0.05),
-        max_steps=config.get("max_steps", -1)
+        max_steps=config.get("max_steps", -1),
+        reuse_base_model=config.get("reuse_base_model", False)
     )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Command-line entry point, used to run one job under torchrun.
+    
+    Rank 0 prints progress updates as PROGRESS_PREFIX + JSON lines and
+    writes the result to --result-file.
+    """
+    parser = argparse.ArgumentParser(description="Run a LoRA training job")
+    parser.add_argument("--job-id", type=int, required=True)
+    parser.add_argument("--base-model", required=True)
+    parser.add_argument("--dataset-path", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--config", default="{}", help="Training config as JSON")
+    parser.add_argument("--result-file", help="Where rank 0 writes the result JSON")
+    args = parser.parse_args(argv)
+    
+    def progress_callback(**kwargs):
+        print(PROGRESS_PREFIX + json.dumps(kwargs), flush=True)
+    
+    main_process = is_main_process()
+    result = run_training_pipeline(
+        job_id=args.job_id,
+        base_model=args.base_model,
+        dataset_path=args.dataset_path,
+        output_dir=args.output_dir,
+        config=json.loads(args.config),
+        progress_callback=progress_callback if main_process else None
+    )
+    
+    if main_process and args.result_file:
+        with open(args.result_file, "w") as f:
+            json.dump(result, f, default=float)
+
+
+if __name__ == "__main__":
+    main()
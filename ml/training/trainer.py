@@ -3,13 +3,17 @@ Trainer module for LoRA fine-tuning.
 Handles model loading, training loop, and checkpointing.
 """
 
+import contextlib
+import gc
+import logging
 import os
-from typing import Optional, Dict, Any, Callable
+import threading
+from typing import Optional, Dict, Any, Callable, Tuple
 from dataclasses import dataclass
 
 import torch
 from transformers import (
-    AutoModelForCausalLM,
+    AutoConfig,
     AutoTokenizer,
     TrainingArguments,
     Trainer,
@@ -18,8 +22,48 @@ from transformers import (
 from peft import get_peft_model, prepare_model_for_kbit_training, PeftModel
 from datasets import Dataset
 
+try:
+    from liger_kernel.transformers import (
+        apply_liger_kernel_to_llama,
+        apply_liger_kernel_to_mistral,
+        apply_liger_kernel_to_qwen2
+    )
+    LIGER_KERNELS = {
+        "llama": apply_liger_kernel_to_llama,
+        "mistral": apply_liger_kernel_to_mistral,
+        "qwen2": apply_liger_kernel_to_qwen2,
+    }
+except ImportError:
+    LIGER_KERNELS = {}
+
+from ml.inference.model_loader import get_compute_dtype, load_causal_lm
+from ml.preprocessing.formatter import CHAT_TEMPLATE
+from ml.preprocessing.tokenizer import DataCollatorForCausalLM, pack_dataset, tokenize_dataset
 from ml.training.lora_config import get_lora_config
 
+logger = logging.getLogger(__name__)
+
+# Below this many parameters NF4 dequantization costs more than the memory
+# it saves; such models are trained unquantized when they fit
+SMALL_MODEL_PARAMS = 3_000_000_000
+
+# Base models kept loaded between jobs in this process (reuse_base_model):
+# (model name, use_4bit, bf16) -> (last PeftModel trained on it, tokenizer,
+# whether it was loaded in 4-bit). At most one, since each costs GBs of GPU.
+_BASE_MODEL_CACHE: Dict[Tuple[str, bool, bool], Tuple[Any, Any, bool]] = {}
+_base_model_lock = threading.Lock()
+
+
+def clear_model_cache() -> None:
+    """Drop the kept base model and return its GPU memory."""
+    with _base_model_lock:
+        if not _BASE_MODEL_CACHE:
+            return
+        _BASE_MODEL_CACHE.clear()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
 
 @dataclass
 class TrainingConfig:
@@ -37,8 +81,16 @@ class TrainingConfig:
     fp16: bool = True
     bf16: bool = False
     gradient_checkpointing: bool = True
+    activation_offload: bool = False  # keep saved activations in pinned CPU memory
+    optim: str = "paged_adamw_8bit"
     max_grad_norm: float = 0.3
     weight_decay: float = 0.001
+    torch_compile: bool = False
+    group_by_length: bool = True
+    packing: bool = False
+    use_liger_kernel: bool = True
+    dataloader_num_workers: Optional[int] = None  # None: half the CPUs, at most 8
+    reuse_base_model: bool = False  # keep the base loaded for the next job
 
 
 class LoRATrainer:
@@ -62,29 +114,94 @@ class LoRATrainer:
         self.use_4bit = use_4bit
         self.progress_callback = progress_callback
         
+        # bf16 where supported: fp32's exponent range, so no GradScaler and
+        # no overflow on long sequences, at fp16's speed and memory
+        if get_compute_dtype() == torch.bfloat16:
+            self.training_config.bf16 = True
+            self.training_config.fp16 = False
+        
         self.model = None
         self.tokenizer = None
         self.trainer = None
+        self._base_config = None
+        self._cache_key = (base_model_name, use_4bit, training_config.bf16)
     
     def load_model(self) -> None:
         """Load and prepare the base model for training."""
+        # Let the fp32 parts (LoRA adapters, norms) run on tensor cores
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        
+        # Leave headroom for the CUDA context and other processes, so the
+        # allocator frees cached blocks before hitting a hard OOM. Under
+        # torchrun this rank's GPU is LOCAL_RANK, not the current device
+        if torch.cuda.is_available():
+            torch.cuda.set_per_process_memory_fraction(
+                0.92, device=int(os.environ.get("LOCAL_RANK", "0"))
+            )
+        
+        cached = None
+        if self.training_config.reuse_base_model:
+            with _base_model_lock:
+                cached = _BASE_MODEL_CACHE.pop(self._cache_key, None)
+        
+        if cached is not None:
+            previous, self.tokenizer, self.use_4bit = cached
+            # Strip the previous job's adapter; the base is already loaded
+            # and prepared for k-bit training
+            self.model = previous.unload()
+        else:
+            clear_model_cache()
+            self._load_base_model()
+        
+        # Get LoRA config
+        lora_config = get_lora_config(
+            r=self.lora_r,
+            lora_alpha=self.lora_alpha,
+            lora_dropout=self.lora_dropout
+        )
+        
+        # Apply LoRA
+        self.model = get_peft_model(self.model, lora_config)
+        self.model.print_trainable_parameters()
+    
+    def _load_base_model(self) -> None:
+        """Load the base model and tokenizer and prepare them for training."""
+        if self.use_4bit and self._fits_unquantized():
+            self.use_4bit = False
+        
         # Quantization config for 4-bit loading
         if self.use_4bit:
             bnb_config = BitsAndBytesConfig(
                 load_in_4bit=True,
                 bnb_4bit_quant_type="nf4",
-                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_compute_dtype=torch.bfloat16 if self.training_config.bf16 else torch.float16,
                 bnb_4bit_use_double_quant=True
             )
         else:
             bnb_config = None
         
+        self._apply_liger_kernel()
+        
+        # Under torchrun each rank holds a full replica on its own GPU;
+        # device_map="auto" would shard one copy over every visible GPU.
+        # A single GPU is also addressed directly: each shard's tensors are
+        # then placed straight onto it, with no device-map planning pass
+        if int(os.environ.get("WORLD_SIZE", "1")) > 1:
+            device_map = {"": int(os.environ.get("LOCAL_RANK", "0"))}
+        elif torch.cuda.device_count() == 1:
+            device_map = {"": 0}
+        else:
+            device_map = "auto"
+        
         # Load model
-        self.model = AutoModelForCausalLM.from_pretrained(
+        self.model = load_causal_lm(
             self.base_model_name,
             quantization_config=bnb_config,
-            device_map="auto",
-            trust_remote_code=True
+            device_map=device_map,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True,
+            torch_dtype=torch.bfloat16 if not self.use_4bit and self.training_config.bf16 else None
         )
         
         # Load tokenizer
@@ -98,20 +215,81 @@ class LoRATrainer:
             self.tokenizer.pad_token = self.tokenizer.eos_token
             self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
         
+        # Saved with the adapter, so its tokenizer formats chats as trained
+        self.tokenizer.chat_template = CHAT_TEMPLATE
+        
         # Prepare for k-bit training
+        checkpointing = self.training_config.gradient_checkpointing
         if self.use_4bit:
-            self.model = prepare_model_for_kbit_training(self.model)
+            self.model = prepare_model_for_kbit_training(
+                self.model,
+                use_gradient_checkpointing=checkpointing,
+                gradient_checkpointing_kwargs={"use_reentrant": False}
+            )
+        elif checkpointing:
+            # The frozen embeddings' outputs need grads for checkpointed
+            # blocks to backprop into the adapters
+            self.model.enable_input_require_grads()
+    
+    def _get_base_config(self):
+        """The base model's config (fetched once)."""
+        if self._base_config is None:
+            self._base_config = AutoConfig.from_pretrained(
+                self.base_model_name,
+                trust_remote_code=True
+            )
+        return self._base_config
+    
+    def _fits_unquantized(self) -> bool:
+        """
+        Whether a small base model fits on the GPU in 16-bit.
         
-        # Get LoRA config
-        lora_config = get_lora_config(
-            r=self.lora_r,
-            lora_alpha=self.lora_alpha,
-            lora_dropout=self.lora_dropout
-        )
+        The parameter count is estimated from the config (12 * hidden^2
+        per layer plus embeddings); 16-bit weights must take at most half
+        the free memory, leaving the rest for activations and optimizer.
+        """
+        # Unquantized weights are loaded in bf16; fp16 weights can't be
+        # trained under fp16 AMP (their grads can't be unscaled)
+        if not torch.cuda.is_available() or not self.training_config.bf16:
+            return False
         
-        # Apply LoRA
-        self.model = get_peft_model(self.model, lora_config)
-        self.model.print_trainable_parameters()
+        config = self._get_base_config()
+        hidden = getattr(config, "hidden_size", None)
+        layers = getattr(config, "num_hidden_layers", None)
+        if not hidden or not layers:
+            return False
+        
+        params = 12 * hidden * hidden * layers + getattr(config, "vocab_size", 0) * hidden
+        free_bytes, _ = torch.cuda.mem_get_info()
+        fits = params < SMALL_MODEL_PARAMS and params * 2 * 2 <= free_bytes
+        if fits:
+            logger.info(
+                f"Loading {self.base_model_name} unquantized: ~{params / 1e9:.1f}B params "
+                f"fit in {free_bytes / 2**30:.1f} GiB free"
+            )
+        return fits
+    
+    def _apply_liger_kernel(self) -> None:
+        """
+        Patch the HF modeling code with Liger's Triton kernels, if installed.
+        
+        Patches the model classes, so it must run before from_pretrained.
+        The fused linear + cross-entropy never materializes the full
+        [batch, seq, vocab] logits, which dominates activation memory.
+        """
+        if not self.training_config.use_liger_kernel or not torch.cuda.is_available():
+            return
+        
+        model_type = self._get_base_config().model_type
+        apply_kernel = LIGER_KERNELS.get(model_type)
+        if apply_kernel is not None:
+            apply_kernel(
+                rope=True,
+                swiglu=True,
+                rms_norm=True,
+                cross_entropy=False,
+                fused_linear_cross_entropy=True
+            )
     
     def train(self, train_dataset: Dataset, eval_dataset: Optional[Dataset] = None) -> Dict[str, Any]:
         """Run training."""
@@ -121,6 +299,34 @@ class LoRATrainer:
         # Ensure output dir exists
         os.makedirs(self.training_config.output_dir, exist_ok=True)
         
+        # Tokenize once up front so the collator only pads
+        train_dataset = tokenize_dataset(train_dataset, self.tokenizer, max_length=2048)
+        if eval_dataset is not None:
+            eval_dataset = tokenize_dataset(eval_dataset, self.tokenizer, max_length=2048)
+        if self.training_config.packing:
+            train_dataset = pack_dataset(train_dataset, 2048, self.tokenizer.eos_token_id)
+        
+        # bitsandbytes' 8-bit optimizer kernels need compute capability 7.0+
+        optim = self.training_config.optim
+        if (
+            optim == "paged_adamw_8bit"
+            and torch.cuda.is_available()
+            and torch.cuda.get_device_capability() < (7, 0)
+        ):
+            optim = "paged_adamw_32bit"
+        
+        # FORGELLM_COMPILE=1 turns compilation on for every job. The Trainer
+        # compiles the PEFT-wrapped model, fusing the LoRA A/B, scale and add
+        # ops; graphs dynamo can't trace (bitsandbytes kernels) run eagerly
+        torch_compile = self.training_config.torch_compile or os.environ.get("FORGELLM_COMPILE") == "1"
+        if torch_compile:
+            import torch._dynamo
+            torch._dynamo.config.suppress_errors = True
+        
+        num_workers = self.training_config.dataloader_num_workers
+        if num_workers is None:
+            num_workers = max(1, min(8, (os.cpu_count() or 2) // 2))
+        
         # Training arguments
         training_args = TrainingArguments(
             output_dir=self.training_config.output_dir,
@@ -136,26 +342,36 @@ class LoRATrainer:
             fp16=self.training_config.fp16,
             bf16=self.training_config.bf16,
             gradient_checkpointing=self.training_config.gradient_checkpointing,
+            gradient_checkpointing_kwargs={"use_reentrant": False},
             max_grad_norm=self.training_config.max_grad_norm,
             weight_decay=self.training_config.weight_decay,
-            optim="paged_adamw_32bit",
+            torch_compile=torch_compile,
+            # Packed rows are all max length already; nothing to group
+            group_by_length=self.training_config.group_by_length and not self.training_config.packing,
+            length_column_name="length",
+            # Collate and pin the next batches in worker processes while the
+            # GPU runs the current step; workers live across epochs
+            dataloader_num_workers=num_workers,
+            dataloader_pin_memory=True,
+            dataloader_persistent_workers=num_workers > 0,
+            # 8-bit AdamW states, paged to CPU memory under pressure
+            optim=optim,
             lr_scheduler_type="cosine",
             report_to="none",  # Disable wandb/tensorboard for now
             remove_unused_columns=False,
+            # Every adapter weight gets a grad each step, so DDP can skip the
+            # unused-parameter graph walk (gradient_accumulation_steps already
+            # defers the all-reduce to the last micro-batch)
+            ddp_find_unused_parameters=False,
         )
         
-        # Data collator
-        def data_collator(features):
-            texts = [f["text"] for f in features]
-            batch = self.tokenizer(
-                texts,
-                padding=True,
-                truncation=True,
-                max_length=2048,
-                return_tensors="pt"
-            )
-            batch["labels"] = batch["input_ids"].clone()
-            return batch
+        # Data collator: pad to the batch's longest row (rounded up to a
+        # multiple of 8 for tensor cores), not to max_length
+        data_collator = DataCollatorForCausalLM(
+            self.tokenizer,
+            max_length=2048,
+            pad_to_multiple_of=8
+        )
         
         # Create trainer
         self.trainer = Trainer(
@@ -166,13 +382,38 @@ class LoRATrainer:
             data_collator=data_collator,
         )
         
-        # Train
-        train_result = self.trainer.train()
+        # Train. DataLoader workers fork from this process, and a forked
+        # tokenizer with parallelism on can deadlock; the data is already
+        # tokenized, so turn it off for the run (restored afterwards)
+        tokenizers_parallelism = os.environ.get("TOKENIZERS_PARALLELISM")
+        if num_workers > 0:
+            os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        # With checkpointing, what autograd saves is mostly each block's
+        # input; activation_offload parks those in pinned host memory
+        # until backward (trading PCIe traffic for peak GPU memory)
+        if self.training_config.activation_offload:
+            offload = torch.autograd.graph.save_on_cpu(pin_memory=True)
+        else:
+            offload = contextlib.nullcontext()
+        try:
+            with offload:
+                train_result = self.trainer.train()
+        finally:
+            if tokenizers_parallelism is None:
+                os.environ.pop("TOKENIZERS_PARALLELISM", None)
+            else:
+                os.environ["TOKENIZERS_PARALLELISM"] = tokenizers_parallelism
         
         # Save adapter
         adapter_path = os.path.join(self.training_config.output_dir, "adapter")
-        self.model.save_pretrained(adapter_path)
-        self.tokenizer.save_pretrained(adapter_path)
+        # Under DDP every rank holds the same adapter; one writes it
+        if self.trainer.is_world_process_zero():
+            self.model.save_pretrained(adapter_path)
+            self.tokenizer.save_pretrained(adapter_path)
+        
+        if self.training_config.reuse_base_model:
+            with _base_model_lock:
+                _BASE_MODEL_CACHE[self._cache_key] = (self.model, self.tokenizer, self.use_4bit)
         
         return {
             "train_loss": train_result.training_loss,
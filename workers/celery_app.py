@@ -2,22 +2,28 @@
 Celery application configuration.
 """
 
+import os
+
 from celery import Celery
 
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
 # Create Celery app
 celery = Celery(
     "forgellm",
-    broker="redis://localhost:6379/0",
-    backend="redis://localhost:6379/0",
+    broker=REDIS_URL,
+    backend=REDIS_URL,
     include=["workers.tasks"]
 )
 
 # Celery configuration
 celery.conf.update(
-    # Task settings
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    # Task settings: msgpack is smaller and faster than JSON and keeps
+    # floats binary. JSON stays accepted for tasks queued before the switch.
+    task_serializer="msgpack",
+    accept_content=["msgpack", "json"],
+    result_serializer="msgpack",
+    result_accept_content=["msgpack", "json"],
     timezone="UTC",
     enable_utc=True,
     
@@ -2,21 +2,139 @@
 Celery tasks for async job processing.
 """
 
+import json
 import os
+import subprocess
 import sys
-from typing import Optional
+import time
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Callable, Dict, Optional
 
 # Add project root to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Must be set before torch initializes CUDA. Expandable segments grow the
+# allocator's blocks in place instead of leaving fragments of fixed-size
+# segments, which otherwise turn into OOMs (and job retries) late in a run.
+os.environ.setdefault(
+    "PYTORCH_CUDA_ALLOC_CONF",
+    "expandable_segments:True,garbage_collection_threshold:0.8"
+)
+
+# Batched tokenizer calls encode on the Rust thread pool; tokenizers are
+# loaded in the worker processes, after the fork, so this is safe
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
 from workers.celery_app import celery
+from celery.signals import worker_process_init
 from celery.utils.log import get_task_logger
 
 logger = get_task_logger(__name__)
 
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fields of TrainingService.update_job_progress a progress callback may set
+PROGRESS_FIELDS = ("current_step", "total_steps", "metrics")
+
+# Substring of torch's CUDA OOM error, in-process or in torchrun's output
+CUDA_OOM_MESSAGE = "CUDA out of memory"
+
+
+def oom_retry_call(job_id: int, gradient_accumulation_steps: int) -> Dict[str, Any]:
+    """
+    The args/kwargs for retrying run_training_job after an OOM.
+    
+    Both are given explicitly: Task.retry reuses the request's positional
+    args when args is omitted, and the job is enqueued as args=(job_id,).
+    """
+    return {
+        "args": (job_id,),
+        "kwargs": {"gradient_accumulation_steps": gradient_accumulation_steps},
+    }
+
+
+@lru_cache(maxsize=4)
+def _get_tokenizer(model_name: str):
+    """TokenizerWrapper for a model, loaded once per worker process."""
+    from ml.preprocessing.tokenizer import TokenizerWrapper
+    
+    tokenizer = TokenizerWrapper(model_name)
+    tokenizer.load()
+    return tokenizer
+
+
+@worker_process_init.connect
+def _preload_tokenizer(**kwargs):
+    """Load the base model's tokenizer before the first task needs it."""
+    from backend.app.config import settings
+    
+    try:
+        _get_tokenizer(settings.BASE_MODEL)
+    except Exception as e:
+        # Not fatal: process_dataset loads it (or reports the error) itself
+        logger.warning(f"Could not preload tokenizer for {settings.BASE_MODEL}: {e}")
+
+
+def _run_distributed_training(
+    nproc: int,
+    job_id: int,
+    base_model: str,
+    dataset_path: str,
+    output_dir: str,
+    config: Dict[str, Any],
+    progress_callback: Callable
+) -> Dict[str, Any]:
+    """
+    Run the training pipeline under torchrun, one DDP rank per GPU.
+    
+    Rank 0's progress lines are relayed to progress_callback; the result
+    comes back through a JSON file in output_dir.
+    """
+    from ml.training.train_pipeline import PROGRESS_PREFIX
+    
+    result_file = os.path.join(output_dir, "result.json")
+    command = [
+        sys.executable, "-m", "torch.distributed.run",
+        "--standalone", f"--nproc_per_node={nproc}",
+        "-m", "ml.training.train_pipeline",
+        "--job-id", str(job_id),
+        "--base-model", base_model,
+        "--dataset-path", dataset_path,
+        "--output-dir", output_dir,
+        "--config", json.dumps(config),
+        "--result-file", result_file,
+    ]
+    
+    process = subprocess.Popen(
+        command,
+        cwd=PROJECT_ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True
+    )
+    out_of_memory = False
+    for line in process.stdout:
+        if line.startswith(PROGRESS_PREFIX):
+            progress_callback(**json.loads(line[len(PROGRESS_PREFIX):]))
+        else:
+            out_of_memory = out_of_memory or CUDA_OOM_MESSAGE in line
+            logger.info(line.rstrip())
+    
+    returncode = process.wait()
+    if returncode != 0:
+        # A rank's traceback only reaches us as output; surface an OOM in
+        # the error so run_training_job retries it like an in-process one
+        if out_of_memory:
+            raise RuntimeError(f"torchrun exited with status {returncode}: {CUDA_OOM_MESSAGE}")
+        raise RuntimeError(f"torchrun exited with status {returncode}")
+    
+    with open(result_file) as f:
+        return json.load(f)
+
 
 @celery.task(bind=True, max_retries=3)
-def run_training_job(self, job_id: int):
+def run_training_job(self, job_id: int, gradient_accumulation_steps: int = 4):
     """
     Run a training job asynchronously.
     
@@ -25,11 +143,14 @@ def run_training_job(self, job_id: int):
     2. Runs the training pipeline
     3. Updates job status
     4. Registers the trained model
+    
+    On CUDA OOM the job is retried with half the micro-batch and twice
+    the gradient accumulation, so the effective batch size is unchanged.
     """
     from sqlalchemy.orm import Session
     from backend.app.db.database import SessionLocal
     from backend.app.db import models
-    from backend.app.services.training_service import TrainingService
+    from backend.app.services.training_service import TrainingService, flush_progress
     from backend.app.config import settings
     from ml.training.train_pipeline import run_training_pipeline
     
@@ -66,18 +187,27 @@ def run_training_job(self, job_id: int):
         )
         os.makedirs(output_dir, exist_ok=True)
         
-        # Progress callback
+        # Progress callback: forward at most one update per percentage
+        # point or 5 seconds; update_job_progress buffers what it gets into
+        # bulk UPDATEs, and pipeline-only fields (sample_count) are dropped
+        last_sent = {"progress": float("-inf"), "time": float("-inf")}
+        
         def progress_callback(status: str, progress: float, **kwargs):
+            now = time.monotonic()
+            if progress < 100 and progress - last_sent["progress"] < 1.0 and now - last_sent["time"] < 5.0:
+                return
+            last_sent.update(progress=progress, time=now)
             training_service.update_job_progress(
                 job_id,
                 progress=progress,
-                **kwargs
+                **{key: kwargs[key] for key in PROGRESS_FIELDS if key in kwargs}
             )
         
         # Training config
         config = {
             "num_epochs": job.num_epochs,
             "batch_size": job.batch_size,
+            "gradient_accumulation_steps": gradient_accumulation_steps,
             "learning_rate": job.learning_rate,
             "lora_r": job.lora_r,
             "lora_alpha": job.lora_alpha,
@@ -85,8 +215,11 @@ def run_training_job(self, job_id: int):
             "max_steps": job.max_steps or -1
         }
         
-        # Run training
-        result = run_training_pipeline(
+        # Run training: one job uses every GPU on the node (DDP under
+        # torchrun), in-process when there is only one
+        import torch
+        
+        training_kwargs = dict(
             job_id=job_id,
             base_model=job.base_model,
             dataset_path=dataset.file_path,
@@ -94,6 +227,13 @@ def run_training_job(self, job_id: int):
             config=config,
             progress_callback=progress_callback
         )
+        if torch.cuda.device_count() > 1:
+            result = _run_distributed_training(torch.cuda.device_count(), **training_kwargs)
+        else:
+            # This worker runs jobs one after another; keep the base model
+            # loaded so the next job on it skips from_pretrained
+            config["reuse_base_model"] = True
+            result = run_training_pipeline(**training_kwargs)
         
         # Complete job and register model
         model = training_service.complete_job(
@@ -119,15 +259,59 @@ def run_training_job(self, job_id: int):
         training_service.fail_job(job_id, str(e))
         
         # Retry on certain errors
-        if "CUDA out of memory" in str(e):
-            raise self.retry(exc=e, countdown=60)
+        if CUDA_OOM_MESSAGE in str(e):
+            # Don't retry next to a kept base model or cached blocks
+            import gc
+            import torch
+            from ml.training.trainer import clear_model_cache
+            clear_model_cache()
+            gc.collect()
+            torch.cuda.empty_cache()
+            
+            # The same config would OOM again; retry with a smaller
+            # micro-batch, keeping batch_size * accumulation constant.
+            # Only change the job once a retry is certain to be sent.
+            job = db.query(models.TrainingJob).filter(
+                models.TrainingJob.id == job_id
+            ).first()
+            if (
+                job is not None
+                and job.batch_size > 1
+                and self.request.retries < self.max_retries
+            ):
+                job.batch_size //= 2
+                gradient_accumulation_steps *= 2
+                db.commit()
+                logger.warning(
+                    f"Retrying job {job_id} after OOM with batch_size={job.batch_size}, "
+                    f"gradient_accumulation_steps={gradient_accumulation_steps} "
+                    f"(effective batch {job.batch_size * gradient_accumulation_steps})"
+                )
+                raise self.retry(
+                    exc=e,
+                    countdown=10,
+                    **oom_retry_call(job_id, gradient_accumulation_steps)
+                )
         
         raise
     
     finally:
+        # Write any still-buffered progress before the session goes away
+        flush_progress()
         db.close()
 
 
+@celery.task
+def simulate_training_job(job_id: int):
+    """
+    Run the demo training simulation off the API process.
+    """
+    from backend.app.services.training_service import simulate_training
+    
+    logger.info(f"Simulating training job {job_id}")
+    simulate_training(job_id)
+
+
 @celery.task
 def process_dataset(dataset_id: int):
     """
@@ -139,8 +323,7 @@ def process_dataset(dataset_id: int):
     """
     from backend.app.db.database import SessionLocal
     from backend.app.db import models
-    from ml.preprocessing.formatter import prepare_dataset
-    from ml.preprocessing.tokenizer import TokenizerWrapper
+    from ml.preprocessing.formatter import iter_prepared_dataset
     from backend.app.config import settings
     
     logger.info(f"Processing dataset {dataset_id}")
@@ -159,28 +342,28 @@ def process_dataset(dataset_id: int):
         dataset.status = "processing"
         db.commit()
         
-        # Process
-        samples = prepare_dataset(dataset.file_path)
-        
-        # Count tokens
-        tokenizer = TokenizerWrapper(settings.BASE_MODEL)
-        tokenizer.load()
+        # Process and count tokens, streaming: only one chunk of samples
+        # is held at a time
+        tokenizer = _get_tokenizer(settings.BASE_MODEL)
+        samples = iter_prepared_dataset(dataset.file_path)
         
+        sample_count = 0
         total_tokens = 0
-        for sample in samples:
-            total_tokens += tokenizer.count_tokens(sample["text"])
+        while chunk := list(islice(samples, 1024)):
+            total_tokens += sum(tokenizer.count_tokens_batch([sample["text"] for sample in chunk]))
+            sample_count += len(chunk)
         
         # Update dataset
-        dataset.sample_count = len(samples)
+        dataset.sample_count = sample_count
         dataset.token_count = total_tokens
         dataset.status = "ready"
         db.commit()
         
-        logger.info(f"Dataset {dataset_id} processed: {len(samples)} samples, {total_tokens} tokens")
+        logger.info(f"Dataset {dataset_id} processed: {sample_count} samples, {total_tokens} tokens")
         
         return {
             "dataset_id": dataset_id,
-            "sample_count": len(samples),
+            "sample_count": sample_count,
             "token_count": total_tokens
         }
     
@@ -199,6 +382,7 @@ def cleanup_old_jobs():
     """
     Periodic task to clean up old completed jobs.
     """
+    from concurrent.futures import ThreadPoolExecutor
     from datetime import datetime, timedelta
     from backend.app.db.database import SessionLocal
     from backend.app.db import models
@@ -217,18 +401,31 @@ def cleanup_old_jobs():
             models.TrainingJob.status.in_(["completed", "failed", "cancelled"])
         ).all()
         
-        for job in old_jobs:
-            # Don't delete if model is still active
-            if job.model and job.model.is_active:
-                continue
-            
-            # Delete checkpoints directory
-            if job.model_path:
-                checkpoint_dir = os.path.dirname(job.model_path)
-                if os.path.exists(checkpoint_dir):
-                    shutil.rmtree(checkpoint_dir)
+        # Unlink latency dominates deleting checkpoint trees, so delete
+        # several at once
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            removals = {}
+            for job in old_jobs:
+                # Don't delete if model is still active
+                if job.model and job.model.is_active:
+                    continue
+                
+                # Delete checkpoints directory
+                if job.model_path:
+                    checkpoint_dir = os.path.dirname(job.model_path)
+                    if os.path.exists(checkpoint_dir):
+                        removals[job.id] = pool.submit(shutil.rmtree, checkpoint_dir)
+                        continue
+                
+                logger.info(f"Cleaned up job {job.id}")
             
-            logger.info(f"Cleaned up job {job.id}")
+            for job_id, removal in removals.items():
+                try:
+                    removal.result()
+                except OSError as e:
+                    logger.warning(f"Could not remove checkpoints of job {job_id}: {e}")
+                else:
+                    logger.info(f"Cleaned up job {job_id}")
         
         db.commit()
         